@@ -1,9 +1,12 @@
+import glob
 import os
 import unittest
 import logging
+import time
 import vtk, qt, ctk, slicer
 from slicer.ScriptedLoadableModule import *
 from slicer.util import VTKObservationMixin
+import VRTutorialLib
 
 #
 # VRTutorial
@@ -101,8 +104,8 @@ class VRTutorialWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
     self.logic = None
     self._parameterNode = None
     self._updatingGUIFromParameterNode = False
-    self.tutorialPart = 1
     self.info_display = False
+    self.connectionStatus = ''
 
     self.instructionsPath = slicer.modules.vrtutorial.path.replace("VRTutorial.py","") + 'Resources/Instructions/'
 
@@ -144,6 +147,8 @@ class VRTutorialWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
     # Create logic class. Logic implements all computations that should be possible to run
     # in batch mode, without a graphical user interface.
     self.logic = VRTutorialLogic()
+    self.logic.distanceToTargetCallback = self.onDistanceToTargetChanged
+    self.logic.alignmentErrorCallback = self.onAlignmentErrorChanged
 
     # Add controllers instructions image (HTC by default)
     self.markerSelectedIconPixmap = qt.QPixmap(self.instructionsPath + 'HTCControllers.png')
@@ -169,6 +174,18 @@ class VRTutorialWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
     # Settings
     self.ui.controllersVisibilityCheckBox.toggled.connect(self.onControllerVisibilityCheckBoxClicked)
     self.ui.resetVRViewButton.connect('clicked(bool)', self.onResetVRViewButtonClicked)
+    self.ui.trackingUpdateRateSpinBox.connect('valueChanged(int)', self.updateParameterNodeFromGUI)
+    self.ui.trackingEventDecimationSpinBox.connect('valueChanged(int)', self.updateParameterNodeFromGUI)
+    self.ui.alignmentThresholdSpinBox.connect('valueChanged(double)', self.updateParameterNodeFromGUI)
+    self.ui.telemetryEnabledCheckBox.connect('toggled(bool)', self.updateParameterNodeFromGUI)
+
+    # Profiling
+    self.profilingTimer = qt.QTimer()
+    self.profilingTimer.setInterval(1000)
+    self.profilingTimer.timeout.connect(self.updateProfilingSummary)
+    self.ui.profilingEnabledCheckBox.toggled.connect(self.onProfilingEnabledToggled)
+    self.ui.resetProfilingButton.connect('clicked(bool)', self.onResetProfilingButtonClicked)
+    self.ui.exportProfilingButton.connect('clicked(bool)', self.onExportProfilingButtonClicked)
 
 
     self.ui.HTCRadioButton.connect('clicked(bool)', self.onControllerSelected)
@@ -185,6 +202,14 @@ class VRTutorialWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
     Called when the application closes and the module widget is destroyed.
     """
     self.removeObservers()
+    self.logic.stopTelemetry()
+    self.logic.taskStateMachine.reset()
+    self.logic.transformDispatcher.removeAllCallbacks()
+    self.logic.cancelAssetLoading()
+    self.logic.stopScenarioStreaming()
+    self.logic.stopTouchDetection()
+    self.logic.assetCache.flushIndex()
+    self.profilingTimer.stop()
 
   def enter(self):
     """
@@ -206,6 +231,15 @@ class VRTutorialWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
     """
     # Parameter node will be reset, do not use it anymore
     self.setParameterNode(None)
+    # Collision pairs and transform observations reference nodes of the closing scene
+    self.logic.stopTouchDetection()
+    self.logic.stopTelemetry()
+    self.logic.stopScenarioStreaming()
+    self.logic.clearCollisionPairs()
+    self.logic.assetCache.flushIndex()
+    self.logic.taskStateMachine.reset()
+    self.logic.transformDispatcher.removeAllCallbacks()
+    self.logic.resetLoadedModels()
 
   def onSceneEndClose(self, caller, event):
     """
@@ -278,6 +312,20 @@ class VRTutorialWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
     #   self.ui.applyButton# Update buttons states and tooltips
     # .enabled = False
 
+    trackingUpdateRate = int(float(self._parameterNode.GetParameter("TrackingUpdateRate")))
+    trackingEventDecimation = int(float(self._parameterNode.GetParameter("TrackingEventDecimation")))
+    self.ui.trackingUpdateRateSpinBox.value = trackingUpdateRate
+    self.ui.trackingEventDecimationSpinBox.value = trackingEventDecimation
+    # Decimation is only used when evaluating on transform events (no timer)
+    self.ui.trackingEventDecimationSpinBox.enabled = (trackingUpdateRate == 0)
+    self.logic.setTrackingUpdateRate(trackingUpdateRate, trackingEventDecimation)
+    alignmentThreshold = float(self._parameterNode.GetParameter("AlignmentThreshold"))
+    self.ui.alignmentThresholdSpinBox.value = alignmentThreshold
+    self.logic.setAlignmentSuccessThreshold(alignmentThreshold)
+    telemetryEnabled = (self._parameterNode.GetParameter("TelemetryEnabled") == "true")
+    self.ui.telemetryEnabledCheckBox.checked = telemetryEnabled
+    self.logic.setTelemetryEnabled(telemetryEnabled)
+
     # All the GUI updates are done
     self._updatingGUIFromParameterNode = False
 
@@ -297,6 +345,10 @@ class VRTutorialWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
     # self._parameterNode.SetParameter("Threshold", str(self.ui.imageThresholdSliderWidget.value))
     # self._parameterNode.SetParameter("Invert", "true" if self.ui.invertOutputCheckBox.checked else "false")
     # self._parameterNode.SetNodeReferenceID("OutputVolumeInverse", self.ui.invertedOutputSelector.currentNodeID)
+    self._parameterNode.SetParameter("TrackingUpdateRate", str(self.ui.trackingUpdateRateSpinBox.value))
+    self._parameterNode.SetParameter("TrackingEventDecimation", str(self.ui.trackingEventDecimationSpinBox.value))
+    self._parameterNode.SetParameter("AlignmentThreshold", str(self.ui.alignmentThresholdSpinBox.value))
+    self._parameterNode.SetParameter("TelemetryEnabled", "true" if self.ui.telemetryEnabledCheckBox.checked else "false")
 
     self._parameterNode.EndModify(wasModified)
 
@@ -309,20 +361,33 @@ class VRTutorialWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
     if connected:
       # modify button text and show connection status
       wr = slicer.modules.virtualreality.widgetRepresentation()
-      label = slicer.util.findChild(wr, 'ConnectionStatusLabel').text
-      self.ui.statusText.text = label
+      self.connectionStatus = slicer.util.findChild(wr, 'ConnectionStatusLabel').text
+      self.ui.statusText.text = self.connectionStatus
       self.ui.createConnectionButton.setText("Deactivate VR")
-      self.ui.startTutorialButton.enabled = True
-      self.logic.loadModels()
-      self.logic.loadInstructions()
-      self.logic.applyTransformsToAvatars()
+      # load models and instructions in the background, the tutorial can be started when done
+      self.ui.startTutorialButton.enabled = False
+      self.logic.loadTutorialAssetsAsync(self.onAssetLoadingProgress, self.onAssetLoadingFinished)
     else:
+      self.logic.cancelAssetLoading()
       self.ui.createConnectionButton.setText("Activate VR")
       self.ui.statusText.text = ''    
 
     if not self.logic.slicerVRinstalled:
       self.ui.statusText.text = 'install SlicerVR extension'
 
+  def onAssetLoadingProgress(self, numberOfLoadedAssets, numberOfAssets, assetName):
+    self.ui.statusText.text = 'Loading {0} ({1}/{2})'.format(assetName, numberOfLoadedAssets, numberOfAssets)
+
+  def onAssetLoadingFinished(self):
+    self.ui.statusText.text = self.connectionStatus
+    self.ui.startTutorialButton.enabled = True
+
+  def onDistanceToTargetChanged(self, distanceToTarget):
+    self.ui.resultText.text = 'Distance to target: {0:.0f} mm'.format(max(0.0, distanceToTarget))
+
+  def onAlignmentErrorChanged(self, alignmentError):
+    self.ui.resultText.text = 'Alignment error: {0:.1f} mm'.format(alignmentError)
+
   def onLoadTutorialData(self):
     # load scenario
     self.logic.loadScenario()
@@ -333,11 +398,8 @@ class VRTutorialWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
   def onStartTutorial(self):
     print("starting tutorial")
     self.logic.applyTransformsToAvatars()
-    self.onShowInstructionsButtonClicked()
-    if self.tutorialPart == 1:
-      self.logic.startPart1()
-    elif self.tutorialPart == 2:
-      self.logic.startPart2()
+    self.setInstructionsVisible(True)
+    self.logic.startTutorial()
 
 
   ## Layout
@@ -393,27 +455,31 @@ class VRTutorialWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
 
   # INFORMATION
   def onShowInstructionsButtonClicked(self):
+    self.setInstructionsVisible(not self.info_display)
 
-    # Update layout to show or hide info
-    if self.info_display:
-        self.layoutManager.setLayout(self.customLayout_1_ID) # Set 3D view only layout
-        self.info_display = False
-        self.ui.showInstructionsButton.setText('Show Instructions')
-    else:
+  def setInstructionsVisible(self, visible):
+    # Update layout to show or hide info, the layout is only changed when the visibility changes
+    if visible == self.info_display:
+      return
+    if visible:
         self.layoutManager.setLayout(self.customLayout_3_ID) # Set red slice view layout
-        self.info_display = True
         self.ui.showInstructionsButton.setText('Hide Instructions')
+        # the current slide is kept
         self.logic.red_logic.FitSliceToAll()
-        self.logic.red_logic.SetSliceOffset(0)
+        self.logic.showSlide(self.logic.slideStack.currentSlideIndex)
+    else:
+        self.layoutManager.setLayout(self.customLayout_1_ID) # Set 3D view only layout
+        self.ui.showInstructionsButton.setText('Show Instructions')
+    self.info_display = visible
 
   def onPreviousButtonClicked(self):
     self.logic.hideSuccessMessage()
-    self.onShowInstructionsButtonClicked()
+    self.setInstructionsVisible(True)
     self.logic.changeInfoSlide('PREVIOUS')
 
   def onNextButtonClicked(self):
     self.logic.hideSuccessMessage()
-    self.onShowInstructionsButtonClicked()
+    self.setInstructionsVisible(True)
     self.logic.changeInfoSlide('NEXT')
     
   def onControllerVisibilityCheckBoxClicked(self):
@@ -429,6 +495,30 @@ class VRTutorialWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
     self.logic.resetVRView()
     
 
+  def onProfilingEnabledToggled(self, enabled):
+    VRTutorialLib.callProfiler.enabled = enabled
+    if enabled:
+      self.profilingTimer.start()
+    else:
+      self.profilingTimer.stop()
+    self.updateProfilingSummary()
+
+  def onResetProfilingButtonClicked(self):
+    VRTutorialLib.callProfiler.reset()
+    self.updateProfilingSummary()
+
+  def updateProfilingSummary(self):
+    self.ui.profilingSummaryLabel.text = VRTutorialLib.callProfiler.getSummaryText()
+
+  def onExportProfilingButtonClicked(self):
+    filePath = qt.QFileDialog.getSaveFileName(self.parent, 'Export profiling results', '', 'CSV files (*.csv);;JSON files (*.json)')
+    if not filePath:
+      return
+    if filePath.lower().endswith('.json'):
+      VRTutorialLib.callProfiler.exportJSON(filePath)
+    else:
+      VRTutorialLib.callProfiler.exportCSV(filePath)
+
   def onControllerSelected(self):
 
     if self.ui.HTCRadioButton.isChecked():
@@ -470,7 +560,9 @@ class VRTutorialLogic(ScriptedLoadableModuleLogic):
     """
     ScriptedLoadableModuleLogic.__init__(self)
     self.vrEnabled = False
-    self.threeDView = slicer.app.layoutManager().threeDWidget(0).threeDView()
+    # Views are not available when the logic is used without the main window (e.g. batch evaluation)
+    layoutManager = slicer.app.layoutManager()
+    self.threeDView = layoutManager.threeDWidget(0).threeDView() if layoutManager else None
     self.instructionsImagesVisible = False
     self.slicerVRinstalled = False
     try:
@@ -495,8 +587,126 @@ class VRTutorialLogic(ScriptedLoadableModuleLogic):
       logging.error('ERROR: "Viewpoint" module was not found.')
 
     # Info
-    self.red_logic = slicer.app.layoutManager().sliceWidget("Red").sliceLogic()
-    
+    self.red_logic = layoutManager.sliceWidget("Red").sliceLogic() if layoutManager else None
+
+    # Models and textures are loaded from a binary cache after the first use
+    self.assetCache = VRTutorialLib.AssetCache()
+    self.assetLoader = None
+    # Model textures, prepared once (flipped, mip levels) and limited to maximumTextureSize pixels
+    self.textureCache = VRTutorialLib.TextureCache(self.assetCache)
+    self.maximumTextureSize = 2048
+    self.scenarioTexture = None
+    # texture image -> producer connected to the display nodes of all the models showing it
+    self.textureProducers = {}
+    # The scenario is split into tiles with levels of detail once, then the tiles in view are
+    # streamed within a memory budget (see VRTutorialLib.ScenarioTileStreamer)
+    self.scenarioStreamingEnabled = True
+    self.scenarioTileCache = VRTutorialLib.ScenarioTileCache(self.assetCache)
+    self.scenarioMemoryBudgetBytes = 256 * 1024 * 1024
+    self.scenarioStreamer = None
+    self.scenarioStreamingTimer = qt.QTimer()
+    self.scenarioStreamingTimer.setInterval(100)
+    self.scenarioStreamingTimer.timeout.connect(self.updateScenarioStreaming)
+    # Instruction slides, all packed in one volume
+    self.slideStack = VRTutorialLib.InstructionSlideStack(self.instructionsPath + 'Slides', self.assetCache)
+
+    # Tutorial models: logic attribute name, file in Resources/Models, color and opacity set after
+    # loading (None keeps the default), whether it is part of the avatar (loaded first), the
+    # tutorial parts that use it (loaded on demand when the part starts, empty if always loaded)
+    # and the model whose mesh it shares if it is a rigid or mirrored copy of it (see SharedGeometryInstancer),
+    # and whether the hands can touch it (it is in the scene BVH while it is shown)
+    self.modelDefinitions = [
+      {'attributeName': 'headModel', 'fileName': 'Avatar/Head.vtk', 'color': [0.8549019607843137, 0.7450980392156863, 0.5725490196078431], 'opacity': None, 'avatar': True, 'parts': [], 'instanceOf': None, 'interactable': False},
+      {'attributeName': 'handRightModel', 'fileName': 'Avatar/Hand_Right.vtk', 'color': [0,0,1], 'opacity': None, 'avatar': True, 'parts': [], 'instanceOf': None, 'interactable': False},
+      {'attributeName': 'handLeftModel', 'fileName': 'Avatar/Hand_Left.vtk', 'color': [1,0,0], 'opacity': None, 'avatar': True, 'parts': [], 'instanceOf': 'handRightModel', 'interactable': False},
+      {'attributeName': 'cylinderModel', 'fileName': 'CylinderModel.vtk', 'color': None, 'opacity': 0, 'avatar': False, 'parts': [1], 'instanceOf': None, 'interactable': True},
+      {'attributeName': 'femurModel', 'fileName': 'femurModel.vtk', 'color': [0.94,0.84,0.57], 'opacity': 0, 'avatar': False, 'parts': [2], 'instanceOf': None, 'interactable': True},
+      {'attributeName': 'femurModelCopy', 'fileName': 'femurModelCopy.vtk', 'color': [0.94,0.84,0.57], 'opacity': 0, 'avatar': False, 'parts': [2], 'instanceOf': 'femurModel', 'interactable': True},
+      {'attributeName': 'successTextModel', 'fileName': 'SuccessTextModel.stl', 'color': [0,1,0], 'opacity': 0, 'avatar': False, 'parts': [], 'instanceOf': None, 'interactable': False},
+      ]
+    for modelDefinition in self.modelDefinitions:
+      setattr(self, modelDefinition['attributeName'], None)
+    self.geometryInstancer = VRTutorialLib.SharedGeometryInstancer(self.assetCache)
+    # Parts whose models are loaded, least recently started first. Models of the parts that are not
+    # active are hidden (not rendered), models of the oldest parts are removed beyond the maximum.
+    self.loadedParts = []
+    self.maximumNumberOfLoadedParts = 2
+
+    # Collision detection filters, kept alive between checks (see getCollisionPair)
+    self.collisionPairs = {}
+    # Collision tests use decimated versions of the meshes, display uses the full resolution
+    self.useCollisionProxies = True
+    self.collisionProxyCache = VRTutorialLib.CollisionProxyCache(defaultTriangleBudget=500)
+    self.collisionProxyCache.setTriangleBudget('Head', 400)
+    self.collisionProxyCache.setTriangleBudget('Hand_Left', 300)
+    self.collisionProxyCache.setTriangleBudget('Hand_Right', 300)
+    self.collisionProxyCache.setTriangleBudget('femurModel', 1000)
+    self.collisionProxyCache.setTriangleBudget('femurModelCopy', 1000)
+    # Head collision is tested along the motion since the previous check (see
+    # VRTutorialLib.SweptCollisionDetector), so a fast head cannot pass through the target
+    self.useContinuousCollision = True
+    # Success predicates of touch tasks, with the collision settings above (see getTargetContactPredicate)
+    self.targetContactPredicates = {}
+    # Targets that are primitives (box, cylinder) are tested in closed form against their fitted
+    # shape, other targets (femur) against their mesh
+    self.useAnalyticTargets = True
+    self.analyticTargetCache = VRTutorialLib.AnalyticTargetCache()
+
+    # Signed distance fields of task targets: distance from the head to the target on every
+    # tracking update, mesh collision is only tested when the head bounding sphere reaches the target
+    self.useDistanceFields = True
+    self.distanceFieldCache = VRTutorialLib.DistanceFieldCache(self.assetCache)
+    self.probeSpheres = {}
+    self.distanceToTarget = None
+    self.distanceToTargetCallback = None
+
+    # Alignment of the femur with its translucent copy (tutorial part 2), scored from the model
+    # matrices with points sampled once on the femur mesh
+    self.alignmentEvaluator = None
+    self.alignmentSuccessThreshold = 5.0
+    self.alignmentMetric = 'rms'
+    self.alignmentError = None
+    self.alignmentErrorCallback = None
+
+    # Tracked device events are coalesced and evaluated at a limited rate
+    self.transformDispatcher = VRTutorialLib.TransformEventDispatcher()
+    # Interactable models shown in the scene, for contact queries of both hands at once
+    self.sceneBVH = VRTutorialLib.SceneBVH(self.transformDispatcher, self.collisionProxyCache)
+    # Touch detection of both hands against the models of the scene BVH, handTouchCallback(handName, modelNode, touching)
+    # is called when a hand starts or stops touching a model
+    self.handTouchDetector = VRTutorialLib.HandTouchDetector(self.sceneBVH, self.transformDispatcher)
+    self.handTouchDetector.touchCallback = self.onHandTouchChanged
+    self.handTouchCallback = None
+
+    # Tutorial tasks, in the order of the instruction slides: tutorial part (models loaded and shown),
+    # opacity of the part models, first instruction slide of the task, logic attributes of the nodes
+    # whose motion triggers the evaluation and the success predicate (see VRTutorialLib.TaskStateMachine)
+    self.HMDTransform = None
+    self.RightControllerTransform = None
+    self.LeftControllerTransform = None
+    self.taskDefinitions = [
+      {'name': 'HeadCylinderCollision', 'part': 1, 'modelOpacities': {'cylinderModel': 0.3}, 'slideIndex': 0,
+        'observedNodes': ['HMDTransform'], 'successPredicate': self.isHeadTouchingCylinder},
+      {'name': 'FemurAlignment', 'part': 2, 'modelOpacities': {'femurModel': 1, 'femurModelCopy': 0.6}, 'slideIndex': 1,
+        'observedNodes': ['femurModel', 'femurModelCopy'], 'successPredicate': self.isFemurAligned},
+      ]
+    self.taskStateMachine = VRTutorialLib.TaskStateMachine(self.transformDispatcher)
+    self.taskStateMachine.getNode = lambda attributeName: getattr(self, attributeName)
+    self.taskStateMachine.taskActivatedCallback = self.onTaskActivated
+    self.taskStateMachine.taskCompletedCallback = self.onTaskCompleted
+    for taskDefinition in self.taskDefinitions:
+      self.taskStateMachine.addTask(taskDefinition)
+
+    # Session telemetry: poses of the tracked devices and task events of each tutorial session,
+    # written to a new folder of telemetryDirectory (see VRTutorialLib.SessionTelemetryRecorder).
+    # Off unless enabled in the module settings.
+    self.telemetryEnabled = False
+    self.telemetryDirectory = os.path.join(slicer.app.defaultScenePath, 'VRTutorialSessions')
+    self.telemetryRecorder = None
+
+    # Recording of tracked devices, and replay of a recording instead of the VR hardware
+    self.trackingRecorder = None
+    self.trackingReplayer = None
 
 
   def setDefaultParameters(self, parameterNode):
@@ -507,6 +717,42 @@ class VRTutorialLogic(ScriptedLoadableModuleLogic):
       parameterNode.SetParameter("Threshold", "100.0")
     if not parameterNode.GetParameter("Invert"):
       parameterNode.SetParameter("Invert", "false")
+    if not parameterNode.GetParameter("TrackingUpdateRate"):
+      parameterNode.SetParameter("TrackingUpdateRate", "60")
+    if not parameterNode.GetParameter("TrackingEventDecimation"):
+      parameterNode.SetParameter("TrackingEventDecimation", "1")
+    if not parameterNode.GetParameter("AlignmentThreshold"):
+      parameterNode.SetParameter("AlignmentThreshold", "5.0")
+    if not parameterNode.GetParameter("TelemetryEnabled"):
+      parameterNode.SetParameter("TelemetryEnabled", "false")
+
+
+  def setTrackingUpdateRate(self, updateRateHz, eventDecimation=1):
+    """
+    Set how often task logic is evaluated on tracked device motion.
+    updateRateHz > 0 evaluates at most that many times per second with the latest pose,
+    updateRateHz = 0 evaluates on every eventDecimation-th transform event.
+    """
+    self.transformDispatcher.setEventDecimation(eventDecimation)
+    self.transformDispatcher.setUpdateRate(updateRateHz)
+
+
+  def setAlignmentSuccessThreshold(self, threshold):
+    """
+    Set the femur alignment error (mm) below which part 2 is completed.
+    """
+    self.alignmentSuccessThreshold = threshold
+    if self.alignmentEvaluator is not None:
+      self.alignmentEvaluator.successThreshold = threshold
+
+
+  def setTelemetryEnabled(self, enabled):
+    """
+    Record the telemetry of the next tutorial sessions. Disabling it stops the current recording.
+    """
+    self.telemetryEnabled = enabled
+    if not enabled:
+      self.stopTelemetry()
 
 
   def checkInstallationRequiredModules(self):
@@ -523,6 +769,8 @@ class VRTutorialLogic(ScriptedLoadableModuleLogic):
 
   def activateVirtualReality(self):
     if (self.vrEnabled):
+      # the session ends with the VR connection
+      self.stopTelemetry()
       self.vrLogic.SetVirtualRealityConnected(False)
       self.vrEnabled = False
       return False
@@ -551,95 +799,334 @@ class VRTutorialLogic(ScriptedLoadableModuleLogic):
 
   
   def loadScenario(self):
+    scenarioFilePath = self.modelsPath + '/ClinicalScenario/ClinicalScenario_1.obj'
+    if self.scenarioTexture is None:
+      # flipped and mip-mapped once, then read from the cache (see VRTutorialLib.TextureCache)
+      self.scenarioTexture = self.textureCache.getTexture(self.modelsPath + '/ClinicalScenario/ClinicalScenario1_Texture.png', self.maximumTextureSize)
+    if self.scenarioStreamingEnabled and self.startScenarioStreaming(scenarioFilePath):
+      self.assetCache.flushIndex()
+      return
     # load model and texture
     try:
       self.scenarioModel = slicer.util.getNode('ClinicalScenario_1')
     except:
-      self.scenarioModel = slicer.util.loadModel(self.modelsPath + '/ClinicalScenario/ClinicalScenario_1.obj')
-    try:
-      self.scenarioTexture = slicer.util.getNode('ClinicalScenario1_Texture')
-    except:
-      self.scenarioTexture = slicer.util.loadVolume(self.modelsPath + '/ClinicalScenario/ClinicalScenario1_Texture.png')
+      self.scenarioModel = self.assetCache.loadModel(scenarioFilePath)
     # apply texture
     self.showTextureOnModel(self.scenarioModel, self.scenarioTexture)
     # make it non selectable
     self.scenarioModel.SelectableOff()
+    self.assetCache.flushIndex()
+
+
+  def startScenarioStreaming(self, scenarioFilePath):
+    """
+    Show the scenario as streamed tiles. Returns False if the scenario could not be tiled.
+    """
+    if self.scenarioStreamer is None:
+      tileSet = self.scenarioTileCache.getTileSet(scenarioFilePath)
+      self.assetCache.flushIndex()
+      if tileSet is None:
+        return False
+      self.scenarioStreamer = VRTutorialLib.ScenarioTileStreamer(tileSet, self.scenarioMemoryBudgetBytes)
+      self.scenarioStreamer.tileNodeCreatedCallback = self.onScenarioTileCreated
+    self.updateScenarioStreaming()
+    self.scenarioStreamingTimer.start()
+    return True
+
+
+  def stopScenarioStreaming(self):
+    self.scenarioStreamingTimer.stop()
+    if self.scenarioStreamer is not None:
+      self.scenarioStreamer.stop()
+    self.scenarioStreamer = None
+
+
+  def getStreamingRenderer(self):
+    """
+    Return the renderer whose camera selects the streamed scenario tiles: the virtual reality
+    view when connected, the 3D view otherwise.
+    """
+    if self.slicerVRinstalled and self.vrLogic.GetVirtualRealityConnected():
+      vrViewWidget = slicer.modules.virtualreality.viewWidget()
+      if vrViewWidget is not None:
+        return vrViewWidget.renderer()
+    if self.threeDView is not None:
+      return self.threeDView.renderWindow().GetRenderers().GetFirstRenderer()
+    return None
+
+
+  def updateScenarioStreaming(self):
+    renderer = self.getStreamingRenderer()
+    if self.scenarioStreamer is None or renderer is None:
+      return
+    self.scenarioStreamer.update(renderer.GetActiveCamera(), renderer.GetTiledAspectRatio())
+
+
+  def onScenarioTileCreated(self, modelNode):
+    self.showTextureOnModel(modelNode, self.scenarioTexture)
+    modelNode.SelectableOff()
 
 
   def loadModels(self):
-    # load avatars
-    try:
-      self.headModel = slicer.util.getNode('Head')
-    except:
-      self.headModel = slicer.util.loadModel(self.modelsPath + 'Avatar/Head.vtk')
-      self.headModel.GetModelDisplayNode().SetColor([0.8549019607843137, 0.7450980392156863, 0.5725490196078431])
-    try:
-      self.handRightModel = slicer.util.getNode('Hand_Right')
-    except:
-      self.handRightModel = slicer.util.loadModel(self.modelsPath + 'Avatar/Hand_Right.vtk')
-      self.handRightModel.GetModelDisplayNode().SetColor([0,0,1])
-    try:
-      self.handLeftModel = slicer.util.getNode('Hand_Left')
-    except:
-      self.handLeftModel = slicer.util.loadModel(self.modelsPath + 'Avatar/Hand_Left.vtk')
-      self.handLeftModel.GetModelDisplayNode().SetColor([1,0,0])
-    
-    # load interaction models
-    try:
-      self.cylinderModel = slicer.util.getNode('CylinderModel')
-    except:
-      self.cylinderModel = slicer.util.loadModel(self.modelsPath + 'CylinderModel.vtk')
-      # self.cylinderModel.GetModelDisplayNode().SetColor([1,0,0])
-      self.cylinderModel.GetModelDisplayNode().SetOpacity(0)
-    try:
-      self.femurModel = slicer.util.getNode('femurModel')
-    except:
-      self.femurModel = slicer.util.loadModel(self.modelsPath + 'femurModel.vtk')
-      self.femurModel.GetModelDisplayNode().SetColor([0.94,0.84,0.57])
-      self.femurModel.GetModelDisplayNode().SetOpacity(0)
-    try:
-      self.femurModelCopy = slicer.util.getNode('femurModelCopy')
-    except:
-      self.femurModelCopy = slicer.util.loadModel(self.modelsPath + 'femurModelCopy.vtk')
-      self.femurModelCopy.GetModelDisplayNode().SetColor([0.94,0.84,0.57])
-      self.femurModelCopy.GetModelDisplayNode().SetOpacity(0)
+    # load avatars and text model, models of the tutorial parts are loaded when the part is started
+    for modelDefinition in self.modelDefinitions:
+      if not modelDefinition['parts']:
+        self.loadModel(modelDefinition)
+    self.assetCache.flushIndex()
 
-    # load text model
+
+  def loadModel(self, modelDefinition):
+    """
+    Get the model node of a model definition, loading it if it is not in the scene.
+    """
+    nodeName = os.path.splitext(os.path.basename(modelDefinition['fileName']))[0]
     try:
-      self.successTextModel = slicer.util.getNode('SuccessTextModel')
+      modelNode = slicer.util.getNode(nodeName)
     except:
-      self.successTextModel = slicer.util.loadModel(self.modelsPath + 'SuccessTextModel.stl')
-      self.successTextModel.GetModelDisplayNode().SetColor([0,1,0])
-      self.successTextModel.GetModelDisplayNode().SetOpacity(0)
+      modelNode = None
+      if modelDefinition['instanceOf']:
+        modelNode = self.loadModelInstance(modelDefinition, nodeName)
+      if modelNode is None:
+        modelNode = self.assetCache.loadModel(self.modelsPath + modelDefinition['fileName'])
+      self.setupModelDisplay(modelNode, modelDefinition)
+    setattr(self, modelDefinition['attributeName'], modelNode)
+    return modelNode
+
+
+  def loadModelInstance(self, modelDefinition, nodeName):
+    """
+    Create the model as an instance sharing the mesh of the model in modelDefinition['instanceOf'].
+    Returns None if the model file is not a rigid or mirrored copy of that model.
+    """
+    sourceDefinition = [definition for definition in self.modelDefinitions if definition['attributeName'] == modelDefinition['instanceOf']][0]
+    sourceModelNode = getattr(self, sourceDefinition['attributeName'])
+    if sourceModelNode is None:
+      sourceModelNode = self.loadModel(sourceDefinition)
+    instanceMatrix = self.geometryInstancer.getInstanceMatrix(self.modelsPath + sourceDefinition['fileName'],
+      self.modelsPath + modelDefinition['fileName'], sourceModelNode.GetPolyData())
+    if instanceMatrix is None:
+      return None
+    return self.geometryInstancer.addInstance(sourceModelNode, nodeName, instanceMatrix)
+
+
+  def attachModelToTransform(self, modelNode, transformNode):
+    """
+    Make modelNode follow transformNode. Instances keep their instance transform, which is attached instead.
+    """
+    attachmentNode = VRTutorialLib.SharedGeometryInstancer.getAttachmentNode(modelNode)
+    attachmentNode.SetAndObserveTransformNodeID(transformNode.GetID() if transformNode is not None else None)
+
+
+  def activatePartModels(self, part):
+    """
+    Load the models used by a tutorial part and show them, hide the models of other parts.
+    Models of least recently started parts are removed from the scene if more than
+    maximumNumberOfLoadedParts parts are loaded.
+    """
+    for modelDefinition in self.modelDefinitions:
+      if not modelDefinition['parts']:
+        continue
+      if part in modelDefinition['parts']:
+        modelNode = self.loadModel(modelDefinition)
+        modelNode.GetDisplayNode().SetVisibility(True)
+        if modelDefinition['interactable']:
+          self.sceneBVH.addObject(modelNode)
+      else:
+        modelNode = getattr(self, modelDefinition['attributeName'])
+        if modelNode is not None:
+          modelNode.GetDisplayNode().SetVisibility(False)
+          self.sceneBVH.removeObject(modelNode)
+    if part in self.loadedParts:
+      self.loadedParts.remove(part)
+    self.loadedParts.append(part)
+    while len(self.loadedParts) > self.maximumNumberOfLoadedParts:
+      self.unloadPartModels(self.loadedParts.pop(0))
+    self.assetCache.flushIndex()
+
+
+  def resetLoadedModels(self):
+    """
+    Forget loaded model nodes (e.g. when the scene is closed).
+    """
+    for modelDefinition in self.modelDefinitions:
+      setattr(self, modelDefinition['attributeName'], None)
+    self.loadedParts = []
+    self.sceneBVH.clear()
+    self.textureProducers = {}
+
+
+  def unloadPartModels(self, part):
+    """
+    Remove from the scene the models of a part that are not used by any other loaded part.
+    """
+    if part in self.loadedParts:
+      self.loadedParts.remove(part)
+    for modelDefinition in self.modelDefinitions:
+      if part not in modelDefinition['parts'] or any(loadedPart in modelDefinition['parts'] for loadedPart in self.loadedParts):
+        continue
+      modelNode = getattr(self, modelDefinition['attributeName'])
+      if modelNode is not None:
+        self.sceneBVH.removeObject(modelNode)
+        VRTutorialLib.SharedGeometryInstancer.removeModel(modelNode)
+        setattr(self, modelDefinition['attributeName'], None)
+    # Collision pairs may reference removed nodes
+    self.clearCollisionPairs()
+
+
+  def setupModelDisplay(self, modelNode, modelDefinition):
+    if modelDefinition['color'] is not None:
+      modelNode.GetModelDisplayNode().SetColor(modelDefinition['color'])
+    if modelDefinition['opacity'] is not None:
+      modelNode.GetModelDisplayNode().SetOpacity(modelDefinition['opacity'])
+
+
+  def loadTutorialAssetsAsync(self, progressCallback=None, finishedCallback=None):
+    """
+    Load models and instructions in the background (see VRTutorialLib.AssetLoader).
+    The avatar is loaded and attached to the tracked devices first, then the text model and the
+    instructions. Models of the tutorial parts are loaded when the part is started. progressCallback(numberOfLoadedAssets, numberOfAssets, assetName)
+    and finishedCallback() are called on the main thread.
+    """
+    self.cancelAssetLoading()
+    self.assetLoader = VRTutorialLib.AssetLoader(self.assetCache)
+    for modelDefinition in self.modelDefinitions:
+      if modelDefinition['parts']:
+        # loaded when the part is started
+        continue
+      nodeName = os.path.splitext(os.path.basename(modelDefinition['fileName']))[0]
+      try:
+        setattr(self, modelDefinition['attributeName'], slicer.util.getNode(nodeName))
+        continue
+      except:
+        pass
+      priority = 0 if modelDefinition['avatar'] else 1
+      if modelDefinition['instanceOf']:
+        # Shares the mesh of a model added before it, nothing to read in the background
+        self.assetLoader.addMainThreadTask(lambda modelDefinition=modelDefinition: self.loadModel(modelDefinition), nodeName, priority)
+        continue
+      self.assetLoader.addModel(self.modelsPath + modelDefinition['fileName'], nodeName, priority,
+        loadedCallback=lambda modelNode, modelDefinition=modelDefinition: self.onModelLoaded(modelNode, modelDefinition))
+    # Assets of the same priority are completed in the order they are added
+    self.assetLoader.addMainThreadTask(self.applyTransformsToAvatars, 'Avatar', priority=0)
+    self.assetLoader.addMainThreadTask(self.loadInstructions, 'Instructions', priority=2)
+    self.assetLoader.start(progressCallback, finishedCallback)
+
+
+  def onModelLoaded(self, modelNode, modelDefinition):
+    self.setupModelDisplay(modelNode, modelDefinition)
+    setattr(self, modelDefinition['attributeName'], modelNode)
 
 
+  def cancelAssetLoading(self):
+    if self.assetLoader is not None:
+      self.assetLoader.cancel()
+      self.assetLoader = None
+
+
+  @VRTutorialLib.profiled('applyTransformsToAvatars', topLevel=True)
   def applyTransformsToAvatars(self):
+    # use replayed transforms if a tracking recording is being used instead of the hardware
+    if self.trackingReplayer is not None:
+      self.setTrackedDeviceTransforms(self.trackingReplayer.getTransformNode('HMD'),
+        self.trackingReplayer.getTransformNode('RightController'),
+        self.trackingReplayer.getTransformNode('LeftController'))
+      return
     # apply transforms
     vrViewNode = self.vrLogic.GetVirtualRealityViewNode()
     try:
       self.HMDTransform = vrViewNode.GetHMDTransformNode()
-      self.headModel.SetAndObserveTransformNodeID(self.HMDTransform.GetID())
+      self.attachModelToTransform(self.headModel, self.HMDTransform)
     except:
       print("unable to get HMD transform")
     try:
       self.RightControllerTransform = vrViewNode.GetRightControllerTransformNode()
-      self.handRightModel.SetAndObserveTransformNodeID(self.RightControllerTransform.GetID())
+      self.attachModelToTransform(self.handRightModel, self.RightControllerTransform)
     except:
       print("unable to get Right controller transform")
     try:
       self.LeftControllerTransform = vrViewNode.GetLeftControllerTransformNode()
-      self.handLeftModel.SetAndObserveTransformNodeID(self.LeftControllerTransform.GetID())
+      self.attachModelToTransform(self.handLeftModel, self.LeftControllerTransform)
     except:
       print("unable to get Left controller transform")
 
 
-  def showTextureOnModel(self, modelNode, textureImageNode):
+  def setTrackedDeviceTransforms(self, HMDTransform, RightControllerTransform, LeftControllerTransform):
+    """
+    Use the given transform nodes as HMD and controller transforms and attach the avatar models to them.
+    """
+    self.HMDTransform = HMDTransform
+    self.RightControllerTransform = RightControllerTransform
+    self.LeftControllerTransform = LeftControllerTransform
+    for modelName, transformNode in [('headModel', HMDTransform), ('handRightModel', RightControllerTransform), ('handLeftModel', LeftControllerTransform)]:
+      if getattr(self, modelName) is not None and transformNode is not None:
+        self.attachModelToTransform(getattr(self, modelName), transformNode)
+
+
+  def startTrackingRecording(self):
+    """
+    Start recording the HMD and controller transforms of the VR view.
+    """
+    vrViewNode = self.vrLogic.GetVirtualRealityViewNode()
+    transformNodes = [vrViewNode.GetHMDTransformNode(), vrViewNode.GetRightControllerTransformNode(), vrViewNode.GetLeftControllerTransformNode()]
+    self.trackingRecorder = VRTutorialLib.TrackingRecorder(transformNodes)
+    self.trackingRecorder.start()
+
+
+  def stopTrackingRecording(self, filePath=None):
+    """
+    Stop recording and save the recorded samples if a file path is given.
+    """
+    if self.trackingRecorder is None:
+      return
+    self.trackingRecorder.stop()
+    if filePath:
+      self.trackingRecorder.save(filePath)
+
+
+  def loadTrackingReplay(self, filePath):
+    """
+    Use a tracking recording instead of the VR hardware. The recorded devices are replayed into
+    linear transform nodes that the avatars and the task observers are attached to.
+    """
+    self.trackingReplayer = VRTutorialLib.TrackingReplayer(filePath)
+    self.trackingReplayer.createTransformNodes()
+    self.applyTransformsToAvatars()
+    return self.trackingReplayer
+
+
+  def replayTracking(self, realTime=False):
+    """
+    Replay the loaded tracking recording. With realTime the recorded timing is kept, otherwise
+    all samples are pushed as fast as possible and task logic is evaluated after each of them.
+    Returns the elapsed time in seconds for fast replay.
+    """
+    if realTime:
+      self.trackingReplayer.sampleCallback = None
+      self.trackingReplayer.start()
+      return None
+    self.trackingReplayer.sampleCallback = lambda sampleIndex: self.transformDispatcher.dispatchPending()
+    return self.trackingReplayer.replayAll()
+
+
+  def unloadTrackingReplay(self):
+    if self.trackingReplayer is not None:
+      self.trackingReplayer.stop()
+    self.trackingReplayer = None
+
+
+  def showTextureOnModel(self, modelNode, textureImageData):
+    # The texture is already prepared (flipped), it is passed as is to the display pipeline
     modelDisplayNode = modelNode.GetDisplayNode()
     modelDisplayNode.SetBackfaceCulling(0)
-    textureImageFlipVert = vtk.vtkImageFlip()
-    textureImageFlipVert.SetFilteredAxis(1)
-    textureImageFlipVert.SetInputConnection(textureImageNode.GetImageDataConnection())
-    modelDisplayNode.SetTextureImageDataConnection(textureImageFlipVert.GetOutputPort())
+    if textureImageData is None:
+      return
+    # one producer per texture, shared by the models that show it (e.g. all the scenario tiles)
+    textureProducer = self.textureProducers.get(textureImageData)
+    if textureProducer is None:
+      textureProducer = vtk.vtkTrivialProducer()
+      textureProducer.SetOutput(textureImageData)
+      self.textureProducers[textureImageData] = textureProducer
+    modelDisplayNode.SetTextureImageDataConnection(textureProducer.GetOutputPort())
 
 
   def adjustViewpoint(self):
@@ -690,6 +1177,141 @@ class VRTutorialLogic(ScriptedLoadableModuleLogic):
     self.successTextModel.GetModelDisplayNode().SetOpacity(0)
 
 
+  def getCollisionPair(self, node1, node2):
+    """
+    Get the persistent collision pair for two model nodes, creating it on first use.
+    """
+    key = (node1.GetID(), node2.GetID())
+    collisionPair = self.collisionPairs.get(key)
+    shape = self.analyticTargetCache.getShape(node2) if self.useAnalyticTargets else None
+    if (collisionPair is None or collisionPair.nodes[0] is not node1 or collisionPair.nodes[1] is not node2
+      or getattr(collisionPair, 'shape', None) is not shape):
+      proxyCache = self.collisionProxyCache if self.useCollisionProxies else None
+      if shape is not None:
+        collisionPair = VRTutorialLib.AnalyticCollisionPair(node1, node2, shape, proxyCache)
+      else:
+        collisionPair = VRTutorialLib.MeshCollisionPair(node1, node2, proxyCache)
+      self.collisionPairs[key] = collisionPair
+    return collisionPair
+
+
+  def clearCollisionPairs(self):
+    self.collisionPairs = {}
+    self.targetContactPredicates = {}
+    self.collisionProxyCache.clear()
+    self.distanceFieldCache.clear()
+    self.analyticTargetCache.clear()
+    self.probeSpheres = {}
+    self.alignmentEvaluator = None
+
+
+  def getProbeSphere(self, modelNode):
+    """
+    Bounding sphere of a model used as probe in distance queries (head, hands), in model coordinates.
+    """
+    polyData = modelNode.GetPolyData()
+    probeSphere = self.probeSpheres.get(modelNode.GetID())
+    if probeSphere is None or probeSphere[0] is not polyData or probeSphere[1] != polyData.GetMTime():
+      probeSphere = (polyData, polyData.GetMTime(), VRTutorialLib.BoundingSphere(polyData))
+      self.probeSpheres[modelNode.GetID()] = probeSphere
+    return probeSphere[2]
+
+
+  def findContacts(self, probeModels):
+    """
+    Find the interactable models touched by the bounding spheres of probe models (e.g. hands).
+    Returns a dictionary of the list of touched model nodes of each probe model.
+    """
+    probeModels = [probeModel for probeModel in probeModels if probeModel is not None and probeModel.GetPolyData() is not None]
+    centers = []
+    radii = []
+    probeToWorld = vtk.vtkMatrix4x4()
+    for probeModel in probeModels:
+      if probeModel.GetParentTransformNode() is not None:
+        probeModel.GetParentTransformNode().GetMatrixTransformToWorld(probeToWorld)
+      else:
+        probeToWorld.Identity()
+      probeSphere = self.getProbeSphere(probeModel)
+      probeSphere.updateWorld(probeToWorld)
+      centers.append(probeSphere.worldCenter)
+      radii.append(max(probeSphere.worldRadius, 0.0))
+    contacts = {probeModel: [] for probeModel in probeModels}
+    for probeIndex, modelNode, distance in self.sceneBVH.findContacts(centers, radii):
+      contacts[probeModels[probeIndex]].append(modelNode)
+    return contacts
+
+
+  def getDistanceToTarget(self, probeModel, targetModel):
+    """
+    Signed distance (mm) from the bounding sphere of probeModel to the surface of targetModel,
+    looked up in the precomputed distance field of the target. Negative if they overlap.
+    """
+    targetDistanceField = self.getTargetDistanceField(targetModel)
+    return targetDistanceField.distanceToSphere(probeModel, self.getProbeSphere(probeModel))
+
+
+  def getTargetDistanceField(self, targetModel):
+    """
+    Distance field of a target model: exact for primitive targets, sampled on a grid otherwise.
+    """
+    targetDistanceField = self.analyticTargetCache.getTargetDistanceField(targetModel) if self.useAnalyticTargets else None
+    if targetDistanceField is None:
+      targetDistanceField = self.distanceFieldCache.getTargetDistanceField(targetModel)
+    return targetDistanceField
+
+
+  def getAlignmentEvaluator(self):
+    """
+    Get the evaluator of the alignment of femurModel with femurModelCopy, created on first use.
+    Returns None if the copy is not a rigid copy of the femur mesh.
+    """
+    if self.alignmentEvaluator is None:
+      polyData = self.femurModel.GetPolyData()
+      targetPolyData = self.femurModelCopy.GetPolyData()
+      correspondenceMatrix = None
+      if targetPolyData is not polyData:
+        # Copy loaded as a separate mesh, find where the femur points are on the copy mesh
+        correspondenceMatrix = VRTutorialLib.fitInstanceMatrix(polyData, targetPolyData)
+        if correspondenceMatrix is None:
+          logging.error('ERROR: femur copy is not a rigid copy of the femur, alignment cannot be scored')
+          return None
+      self.alignmentEvaluator = VRTutorialLib.AlignmentEvaluator.fromPolyData(polyData, correspondenceMatrix,
+        successThreshold=self.alignmentSuccessThreshold, metric=self.alignmentMetric)
+    return self.alignmentEvaluator
+
+
+  def setCollisionProxyTriangleBudget(self, modelName, triangleBudget):
+    """
+    Set the number of triangles of the collision proxy of a model (0 to test the full mesh).
+    """
+    self.collisionProxyCache.setTriangleBudget(modelName, triangleBudget)
+    self.clearCollisionPairs()
+
+
+  def setUseCollisionProxies(self, useCollisionProxies):
+    self.useCollisionProxies = useCollisionProxies
+    self.clearCollisionPairs()
+
+
+  def getCollisionStatistics(self):
+    """
+    Return the number of collision checks, broad phase rejections and narrow phase (mesh) tests
+    summed over all collision pairs.
+    """
+    statistics = {'checks': 0, 'broadPhaseRejections': 0, 'narrowPhaseChecks': 0}
+    for collisionPair in self.collisionPairs.values():
+      statistics['checks'] += collisionPair.numberOfChecks
+      statistics['broadPhaseRejections'] += collisionPair.numberOfBroadPhaseRejections
+      statistics['narrowPhaseChecks'] += collisionPair.numberOfNarrowPhaseChecks
+    return statistics
+
+
+  def resetCollisionStatistics(self):
+    for collisionPair in self.collisionPairs.values():
+      collisionPair.resetStatistics()
+
+
+  @VRTutorialLib.profiled('findMeshCollision')
   def findMeshCollision(self, node1, node2, verbose=False ):
     '''
         Find Mesh Collision
@@ -697,30 +1319,15 @@ class VRTutorialLogic(ScriptedLoadableModuleLogic):
     '''
     #
     # Variables
-    collisionDetection = vtk.vtkCollisionDetectionFilter()
     numberOfCollisions = 0
     collisionFlag = False
     #
     # Collision Detection
-    node1ToWorldTransformMatrix = vtk.vtkMatrix4x4()
-    node2ToWorldTransformMatrix = vtk.vtkMatrix4x4()
-    node1ParentTransformNode = node1.GetParentTransformNode()
-    node2ParentTransformNode = node2.GetParentTransformNode()
-    if node1ParentTransformNode != None:
-        node1ParentTransformNode.GetMatrixTransformToWorld(node1ToWorldTransformMatrix)
-    if node2ParentTransformNode != None:
-        node2ParentTransformNode.GetMatrixTransformToWorld(node2ToWorldTransformMatrix)
-    #
-    collisionDetection.SetInputData( 0, node1.GetPolyData() )
-    collisionDetection.SetInputData( 1, node2.GetPolyData() )
-    collisionDetection.SetMatrix( 0, node1ToWorldTransformMatrix )
-    collisionDetection.SetMatrix( 1, node2ToWorldTransformMatrix )
-    collisionDetection.SetBoxTolerance( 0.0 )
-    collisionDetection.SetCellTolerance( 0.0 )
-    collisionDetection.SetNumberOfCellsPerNode( 2 )
-    collisionDetection.Update()
-    #
-    numberOfCollisions = collisionDetection.GetNumberOfContacts()
+    # The filter and its OBB trees are reused between calls, only the matrices are updated.
+    # Mesh test is skipped if the bounding spheres do not overlap.
+    # Primitive targets are tested in closed form (see VRTutorialLib.AnalyticCollisionPair).
+    collisionPair = self.getCollisionPair(node1, node2)
+    numberOfCollisions = collisionPair.check()
     if numberOfCollisions > 0:
         collisionFlag = True
     else:
@@ -737,76 +1344,166 @@ class VRTutorialLogic(ScriptedLoadableModuleLogic):
     return collisionFlag, numberOfCollisions
 
 
+  def getTargetContactPredicate(self, node1, node2):
+    """
+    Get the test of node1 touching the target node2 (see VRTutorialLib.TargetContactPredicate),
+    created again when the collision pair or the distance field and continuous collision settings
+    change. node2 should not move.
+    """
+    key = (node1.GetID(), node2.GetID())
+    collisionPair = self.getCollisionPair(node1, node2)
+    targetDistanceField = self.getTargetDistanceField(node2) if self.useDistanceFields else None
+    probeSphere = self.getProbeSphere(node1) if self.useDistanceFields else None
+    predicate = self.targetContactPredicates.get(key)
+    if (predicate is None or predicate.collisionPair is not collisionPair or predicate.targetDistanceField is not targetDistanceField
+      or predicate.probeSphere is not probeSphere or predicate.continuous != self.useContinuousCollision):
+      predicate = VRTutorialLib.TargetContactPredicate(collisionPair, targetDistanceField, probeSphere, self.useContinuousCollision)
+      self.targetContactPredicates[key] = predicate
+    return predicate
+
+
   def loadInstructions(self):
-    # Load instructions images
+    # Load all the instruction slides as one volume (see VRTutorialLib.InstructionSlideStack)
     try:
-        self.instructionsImageVolume = slicer.util.getNode('Slide1')
-    except:
-      try:
-        self.instructionsImageVolume = slicer.util.loadVolume(self.instructionsPath + 'Slides/Slide1.PNG')
-        self.red_logic.SetSliceOffset(0)
-        self.red_logic.FitSliceToAll()
-      except:
-        logging.error('ERROR: Instructions files could not be loaded...')
+      self.instructionsImageVolume = self.slideStack.load()
+    except Exception as e:
+      logging.error('ERROR: Instructions files could not be loaded: {0}'.format(e))
+      return
+    self.slideStack.show(self.red_logic)
+
+
+  def showSlide(self, slideIndex):
+    """
+    Show an instruction slide. Only the slice offset of the view changes.
+    """
+    self.slideStack.showSlide(self.red_logic, slideIndex)
 
 
   def changeInfoSlide(self, directionID):
-    # Change slice offset
+    # Tasks are registered in slide order
     if directionID == 'PREVIOUS':
-      self.red_logic.SetSliceOffset(0)
-      self.startPart1()
+      self.taskStateMachine.activatePreviousTask()
     elif directionID == 'NEXT':
-      self.red_logic.SetSliceOffset(1)
-      self.startPart2()
+      self.taskStateMachine.activateNextTask()
+
+
+  def startTutorial(self):
+    """
+    Start the current task again, or the first one.
+    """
+    if self.telemetryEnabled and self.telemetryRecorder is None:
+      self.startTelemetry()
+    self.startTouchDetection()
+    self.taskStateMachine.restartActiveTask()
 
 
+  def startTouchDetection(self):
+    self.handTouchDetector.setHands([
+      ('RightHand', self.RightControllerTransform, self.handRightModel),
+      ('LeftHand', self.LeftControllerTransform, self.handLeftModel),
+      ])
+    self.handTouchDetector.start()
 
-  def startPart1(self):
-    # show cylinder
-    self.cylinderModel.GetModelDisplayNode().SetOpacity(0.3)
-    self.femurModel.GetModelDisplayNode().SetOpacity(0)
-    self.femurModelCopy.GetModelDisplayNode().SetOpacity(0)
-    # add observer to detect collision of head with cylinder
-    self.addObserverToHMDTransformNode()
 
-  def startPart2(self):
-    # show femur
-    self.femurModel.GetModelDisplayNode().SetOpacity(1)
-    self.femurModelCopy.GetModelDisplayNode().SetOpacity(0.6)
-    self.cylinderModel.GetModelDisplayNode().SetOpacity(0)
-    # add observer to detect collision of head with cylinder
-    self.addObserverToHMDTransformNode()
+  def stopTouchDetection(self):
+    self.handTouchDetector.stop()
 
 
-  #------------------------------------------------------------------------------
-  def addObserverToHMDTransformNode(self):
+  def onHandTouchChanged(self, handName, modelNode, touching):
+    self.recordTelemetryEvent('TouchStarted' if touching else 'TouchEnded', 0 if handName == 'RightHand' else 1)
+    if self.handTouchCallback:
+      self.handTouchCallback(handName, modelNode, touching)
+
+
+  def startTelemetry(self):
     """
-    Add observer to master sequence node.
+    Start logging the tracked device poses and task events of a new session.
     """
-    try:
-      self.observerID = self.HMDTransform.AddObserver(slicer.vtkMRMLTransformableNode.TransformModifiedEvent, self.detectCylinderCollision)
-    except:
-      logging.error('Error adding observer to HMD transform node...')    
+    self.stopTelemetry()
+    sessionDirectory = os.path.join(self.telemetryDirectory, time.strftime('Session-%Y%m%d-%H%M%S'))
+    self.telemetryRecorder = VRTutorialLib.SessionTelemetryRecorder(sessionDirectory, self.transformDispatcher,
+      [self.HMDTransform, self.RightControllerTransform, self.LeftControllerTransform])
+    self.telemetryRecorder.metadata['taskNames'] = self.taskStateMachine.taskNames
+    self.telemetryRecorder.start()
+    logging.info('Recording session telemetry to ' + sessionDirectory)
 
-  #------------------------------------------------------------------------------
-  def removeObserverToHMDTransformNode(self):
+
+  def stopTelemetry(self):
     """
-    Remove observer from master sequence node.
+    Stop logging, all recorded samples are written before returning.
     """
-    if self.observerID:
-      try:
-        self.HMDTransform.RemoveObserver(self.observerID)
-      except:
-        logging.error('Error removing observer from HMD transform node...')   
+    if self.telemetryRecorder is None:
+      return
+    self.telemetryRecorder.stop()
+    self.telemetryRecorder = None
+
+
+  def recordTelemetryEvent(self, eventName, value=0.0):
+    if self.telemetryRecorder is not None:
+      self.telemetryRecorder.recordEvent(eventName, value)
+
+
+  def exportSessionSummary(self, filePath, sessionDirectories=None):
+    """
+    Write the per-task metrics of recorded sessions (all sessions in telemetryDirectory by default)
+    to a CSV file. Returns the rows.
+    """
+    if sessionDirectories is None:
+      sessionDirectories = sorted(glob.glob(os.path.join(self.telemetryDirectory, 'Session-*')))
+    return VRTutorialLib.writeSessionSummaryTable(sessionDirectories, filePath)
+
+
+  def onTaskActivated(self, task):
+    # load part models, models of other parts are hidden
+    self.activatePartModels(task['part'])
+    for attributeName, opacity in task['modelOpacities'].items():
+      getattr(self, attributeName).GetModelDisplayNode().SetOpacity(opacity)
+    # show the instructions of the task
+    self.showSlide(task['slideIndex'])
+    # motion before the task started is not tested for collisions
+    for predicate in self.targetContactPredicates.values():
+      predicate.reset()
+    self.recordTelemetryEvent('TaskStarted', task['index'])
+
+
+  def onTaskCompleted(self, task):
+    logging.info('Task {0} completed'.format(task['name']))
+    self.recordTelemetryEvent('TaskCompleted', task['index'])
+    self.successTextModel.SetAndObserveTransformNodeID(self.HMDTransform.GetID())
+    self.successTextModel.GetModelDisplayNode().SetOpacity(1)
 
   #------------------------------------------------------------------------------
-  def detectCylinderCollision(self, unused1=None, unused2=None):
-    collisionDetected, numberOfCollisions = self.findMeshCollision(self.headModel, self.cylinderModel, False)
+  @VRTutorialLib.profiled('isHeadTouchingCylinder')
+  def isHeadTouchingCylinder(self):
+    # same predicate as the batch evaluation workers (see VRTutorialLib.BatchEvaluator)
+    predicate = self.getTargetContactPredicate(self.headModel, self.cylinderModel)
+    collisionDetected = predicate.check()
+    self.distanceToTarget = predicate.distanceToTarget
+    if self.distanceToTarget is not None and self.distanceToTargetCallback:
+      self.distanceToTargetCallback(self.distanceToTarget)
     if (collisionDetected):
       print("Collision detected!")
-      self.successTextModel.SetAndObserveTransformNodeID(self.HMDTransform.GetID())
-      self.successTextModel.GetModelDisplayNode().SetOpacity(1)
-      self.removeObserverToHMDTransformNode()
+      self.recordTelemetryEvent('CollisionDetected', predicate.numberOfContacts)
+      statistics = self.getCollisionStatistics()
+      logging.info('Collision checks: {checks}, rejected by broad phase: {broadPhaseRejections}, mesh tests: {narrowPhaseChecks}'.format(**statistics))
+    return collisionDetected
+
+  #------------------------------------------------------------------------------
+  @VRTutorialLib.profiled('isFemurAligned')
+  def isFemurAligned(self):
+    alignmentEvaluator = self.getAlignmentEvaluator()
+    if alignmentEvaluator is None:
+      return False
+    # World matrices read once per event by the dispatcher, shared with other callbacks
+    movingToWorld = self.transformDispatcher.getWorldMatrix(self.femurModel)
+    targetToWorld = self.transformDispatcher.getWorldMatrix(self.femurModelCopy)
+    if movingToWorld is not None and targetToWorld is not None:
+      self.alignmentError = alignmentEvaluator.getError(movingToWorld, targetToWorld)
+    else:
+      self.alignmentError = alignmentEvaluator.evaluateNodes(self.femurModel, self.femurModelCopy)
+    if self.alignmentErrorCallback:
+      self.alignmentErrorCallback(self.alignmentError)
+    return alignmentEvaluator.isAligned(self.alignmentError)
 
 
 #
@@ -829,50 +1526,1204 @@ class VRTutorialTest(ScriptedLoadableModuleTest):
     """Run as few or as many tests as needed here.
     """
     self.setUp()
-    self.test_VRTutorial1()
+    self.test_FindMeshCollision()
+    self.setUp()
+    self.test_CollisionBenchmark()
+    self.setUp()
+    self.test_TrackingRecording()
+    self.setUp()
+    self.test_CollisionProxies()
+    self.setUp()
+    self.test_AssetCache()
+    self.setUp()
+    self.test_AssetLoader()
+    self.setUp()
+    self.test_SharedGeometry()
+    self.setUp()
+    self.test_LazyPartLoading()
+    self.setUp()
+    self.test_Profiling()
+    self.setUp()
+    self.test_DistanceField()
+    self.setUp()
+    self.test_FemurAlignment()
+    self.setUp()
+    self.test_TaskStateMachine()
+    self.setUp()
+    self.test_TransformEventDispatcher()
+    self.setUp()
+    self.test_BatchEvaluation()
+    self.setUp()
+    self.test_SessionTelemetry()
+    self.setUp()
+    self.test_TrajectoryAnalytics()
+    self.setUp()
+    self.test_InstructionSlideStack()
+    self.setUp()
+    self.test_TextureCache()
+    self.setUp()
+    self.test_ScenarioTiles()
+    self.setUp()
+    self.test_SceneBVH()
+    self.setUp()
+    self.test_HandTouchDetection()
+    self.setUp()
+    self.test_ContinuousCollision()
+    self.setUp()
+    self.test_AnalyticTargets()
+
+  def loadTestModel(self, fileName):
+    modelsPath = os.path.join(os.path.dirname(__file__), 'Resources', 'Models')
+    return slicer.util.loadModel(os.path.join(modelsPath, fileName))
+
+  def test_FindMeshCollision(self):
+    """ Check that findMeshCollision reports contacts only when the meshes overlap,
+    including after the moving mesh transform changes between calls.
+    """
+
+    self.delayDisplay("Starting the test")
+
+    logic = VRTutorialLogic()
+    femurModel = self.loadTestModel('femurModel.vtk')
+    femurModelCopy = self.loadTestModel('femurModelCopy.vtk')
+    transformNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLLinearTransformNode')
+    femurModelCopy.SetAndObserveTransformNodeID(transformNode.GetID())
+
+    collisionFlag, numberOfCollisions = logic.findMeshCollision(femurModel, femurModelCopy)
+    self.assertTrue(collisionFlag)
+    self.assertGreater(numberOfCollisions, 0)
+
+    # Move the copy away, the same collision pair must see the new matrix
+    bounds = femurModel.GetPolyData().GetBounds()
+    translation = vtk.vtkMatrix4x4()
+    translation.SetElement(0, 3, 3 * (bounds[1] - bounds[0]) + 3 * (bounds[3] - bounds[2]))
+    transformNode.SetMatrixTransformToParent(translation)
+    collisionFlag, numberOfCollisions = logic.findMeshCollision(femurModel, femurModelCopy)
+    self.assertFalse(collisionFlag)
+    self.assertEqual(numberOfCollisions, 0)
+    self.assertEqual(logic.getCollisionStatistics()['broadPhaseRejections'], 1)
+
+    # Move it back
+    transformNode.SetMatrixTransformToParent(vtk.vtkMatrix4x4())
+    collisionFlag, numberOfCollisions = logic.findMeshCollision(femurModel, femurModelCopy)
+    self.assertTrue(collisionFlag)
+
+    self.delayDisplay('Test passed')
+
+  def test_CollisionBenchmark(self):
+    """ Measure findMeshCollision latency for the tutorial model pairs and for meshes of
+    increasing triangle count. Results are written to VRTutorialCollisionBenchmark.json
+    in the application temporary folder.
+    """
+
+    self.delayDisplay("Starting the benchmark")
+
+    logic = VRTutorialLogic()
+    headModel = self.loadTestModel('Avatar/Head.vtk')
+    handLeftModel = self.loadTestModel('Avatar/Hand_Left.vtk')
+    handRightModel = self.loadTestModel('Avatar/Hand_Right.vtk')
+    cylinderModel = self.loadTestModel('CylinderModel.vtk')
+    femurModel = self.loadTestModel('femurModel.vtk')
+    femurModelCopy = self.loadTestModel('femurModelCopy.vtk')
+
+    benchmark = VRTutorialLib.CollisionBenchmark(logic)
+    # Tutorial model pairs with the full meshes and with the collision proxies, all tested
+    # against the target meshes
+    logic.useAnalyticTargets = False
+    for useCollisionProxies, suffix in [(False, ' (full mesh)'), (True, ' (proxy)')]:
+      logic.setUseCollisionProxies(useCollisionProxies)
+      benchmark.runSweep('head vs cylinder' + suffix, headModel, cylinderModel)
+      benchmark.runSweep('left hand vs femur' + suffix, handLeftModel, femurModel)
+      benchmark.runSweep('right hand vs femur' + suffix, handRightModel, femurModel)
+      benchmark.runSweep('femur vs femur copy' + suffix, femurModelCopy, femurModel)
+    logic.setUseCollisionProxies(False)
+    benchmark.runTriangleCountSweep(cylinderModel)
+    # The cylinder tested in closed form against its fitted shape (see VRTutorialLib.AnalyticCollisionPair)
+    logic.useAnalyticTargets = True
+    benchmark.runSweep('head vs cylinder (analytic)', headModel, cylinderModel)
+    logic.setUseCollisionProxies(True)
+    benchmark.runSweep('head vs cylinder (analytic, proxy)', headModel, cylinderModel)
+    logic.setUseCollisionProxies(False)
+    benchmark.runTriangleCountSweep(cylinderModel, suffix=' (analytic)')
+    benchmark.cleanup()
+
+    reportFilePath = os.path.join(slicer.app.temporaryPath, 'VRTutorialCollisionBenchmark.json')
+    benchmark.writeReport(reportFilePath)
+    for result in benchmark.results:
+      logging.info('{name}: p50 {latencyMs[p50]:.3f} ms, p99 {latencyMs[p99]:.3f} ms, {throughputCallsPerSecond:.0f} calls/s'.format(**result))
+      # Every sweep passes through the target
+      self.assertGreater(result['collidingPoses'], 0)
+      self.assertLess(result['collidingPoses'], result['calls'])
+      expectedCollisionPair = 'AnalyticCollisionPair' if '(analytic' in result['name'] else 'MeshCollisionPair'
+      self.assertEqual(result['collisionPair'], expectedCollisionPair)
+
+    self.delayDisplay('Benchmark results written to ' + reportFilePath)
+
+  def test_TrackingRecording(self):
+    """ Record synthetic poses of two devices, save and read them back, and replay them into
+    linear transform nodes.
+    """
+
+    import numpy as np
+    self.delayDisplay("Starting the test")
+
+    deviceNames = ['HMD', 'RightController']
+    transformNodes = [slicer.mrmlScene.AddNewNodeByClass('vtkMRMLLinearTransformNode', name) for name in deviceNames]
+    recorder = VRTutorialLib.TrackingRecorder(transformNodes, deviceNames, initialCapacity=2)
+    recorder.start()
+    self.assertTrue(recorder.isRecording())
+    matrix = vtk.vtkMatrix4x4()
+    for poseIndex in range(5):
+      for deviceIndex, transformNode in enumerate(transformNodes):
+        matrix.SetElement(0, 3, 10 * poseIndex + deviceIndex)
+        matrix.SetElement(1, 1, -1 if poseIndex % 2 else 1)
+        transformNode.SetMatrixTransformToParent(matrix)
+    recorder.stop()
+    self.assertFalse(recorder.isRecording())
+    # initial pose of each device, then one sample per change
+    self.assertEqual(recorder.numberOfSamples, 2 + 2 * 5)
+
+    filePath = os.path.join(slicer.app.temporaryPath, 'VRTutorialTrackingTest.vrtr')
+    recorder.save(filePath)
+    readDeviceNames, samples = VRTutorialLib.readTrackingFile(filePath)
+    self.assertEqual(readDeviceNames, deviceNames)
+    np.testing.assert_array_equal(samples['device'], recorder.getSamples()['device'])
+    np.testing.assert_allclose(samples['matrix'], recorder.getSamples()['matrix'])
+    self.assertTrue((np.diff(samples['time']) >= 0).all())
+
+    replayer = VRTutorialLib.TrackingReplayer(filePath)
+    self.assertEqual(replayer.getNumberOfSamples(), recorder.numberOfSamples)
+    replayedSamples = []
+    replayer.sampleCallback = replayedSamples.append
+    replayer.replayAll()
+    self.assertEqual(replayedSamples, list(range(recorder.numberOfSamples)))
+    for deviceName, transformNode in zip(deviceNames, transformNodes):
+      replayNode = replayer.getTransformNode(deviceName)
+      self.assertEqual(replayNode.GetName(), 'Replay' + deviceName)
+      expected = slicer.util.arrayFromTransformMatrix(transformNode)
+      np.testing.assert_allclose(slicer.util.arrayFromTransformMatrix(replayNode), expected, atol=1e-5)
+
+    os.remove(filePath)
+    self.delayDisplay('Test passed')
 
-  def test_VRTutorial1(self):
-    """ Ideally you should have several levels of tests.  At the lowest level
-    tests should exercise the functionality of the logic with different inputs
-    (both valid and invalid).  At higher levels your tests should emulate the
-    way the user would interact with your code and confirm that it still works
-    the way you intended.
-    One of the most important features of the tests is that it should alert other
-    developers when their changes will have an impact on the behavior of your
-    module.  For example, if a developer removes a feature that you depend on,
-    your test should break so they know that the feature is needed.
+  def test_CollisionProxies(self):
+    """ Check that proxies respect the triangle budget, are reused from disk while they are newer
+    than the source and rebuilt when the source changes or the file was made for another budget.
     """
 
+    import shutil
     self.delayDisplay("Starting the test")
 
-    # Get/create input data
+    testDirectory = os.path.join(slicer.app.temporaryPath, 'VRTutorialProxyTest')
+    if os.path.exists(testDirectory):
+      shutil.rmtree(testDirectory)
+    os.makedirs(testDirectory)
+    sphere = vtk.vtkSphereSource()
+    sphere.SetThetaResolution(64)
+    sphere.SetPhiResolution(64)
+    sphere.Update()
+    sourceFilePath = os.path.join(testDirectory, 'ProxySphere.vtk')
+    writer = vtk.vtkPolyDataWriter()
+    writer.SetFileName(sourceFilePath)
+    writer.SetInputData(sphere.GetOutput())
+    writer.Write()
+    modelNode = slicer.util.loadModel(sourceFilePath)
+
+    proxyCache = VRTutorialLib.CollisionProxyCache(defaultTriangleBudget=200)
+    proxyPolyData = proxyCache.getProxyPolyData(modelNode)
+    self.assertLessEqual(proxyPolyData.GetNumberOfCells(), 200)
+    self.assertGreater(proxyPolyData.GetNumberOfCells(), 0)
+    proxyFilePath = proxyCache.getProxyFilePath(sourceFilePath, 200)
+    self.assertTrue(os.path.exists(proxyFilePath))
+    # in memory, then from disk without writing it again
+    self.assertIs(proxyCache.getProxyPolyData(modelNode), proxyPolyData)
+    proxyFileMTime = os.path.getmtime(proxyFilePath)
+    proxyCache.clear()
+    self.assertEqual(proxyCache.getProxyPolyData(modelNode).GetNumberOfCells(), proxyPolyData.GetNumberOfCells())
+    self.assertEqual(os.path.getmtime(proxyFilePath), proxyFileMTime)
+
+    # source newer than the proxy
+    sourceMTime = os.path.getmtime(sourceFilePath)
+    os.utime(proxyFilePath, (sourceMTime - 10, sourceMTime - 10))
+    proxyCache.clear()
+    proxyCache.getProxyPolyData(modelNode)
+    self.assertGreaterEqual(os.path.getmtime(proxyFilePath), sourceMTime)
+
+    # a file made for another budget is not reused
+    shutil.copy(proxyFilePath, proxyCache.getProxyFilePath(sourceFilePath, 100))
+    proxyCache.clear()
+    proxyCache.setTriangleBudget(modelNode.GetName(), 100)
+    proxyPolyData = proxyCache.getProxyPolyData(modelNode)
+    self.assertLessEqual(proxyPolyData.GetNumberOfCells(), 100)
+    self.assertEqual(proxyCache.getStoredTriangleBudget(proxyPolyData), 100)
+
+    # within budget, the full mesh is used
+    proxyCache.setTriangleBudget(modelNode.GetName(), 0)
+    self.assertIsNone(proxyCache.getProxyPolyData(modelNode))
+
+    shutil.rmtree(testDirectory)
+    self.delayDisplay('Test passed')
+
+  def test_AssetCache(self):
+    """ Store a model in the asset cache and load it back, write the index once per batch and
+    evict least recently used entries.
+    """
+
+    import json
+    import shutil
+    self.delayDisplay("Starting the test")
+
+    testDirectory = os.path.join(slicer.app.temporaryPath, 'VRTutorialAssetCacheTest')
+    if os.path.exists(testDirectory):
+      shutil.rmtree(testDirectory)
+    os.makedirs(testDirectory)
+    sphere = vtk.vtkSphereSource()
+    sphere.SetCenter(10, 20, 30)
+    sphere.Update()
+    sourceFilePath = os.path.join(testDirectory, 'CacheSphere.vtk')
+    writer = vtk.vtkPolyDataWriter()
+    writer.SetFileName(sourceFilePath)
+    writer.SetInputData(sphere.GetOutput())
+    writer.Write()
+
+    cacheDirectory = os.path.join(testDirectory, 'Cache')
+    indexFilePath = os.path.join(cacheDirectory, VRTutorialLib.AssetCache.INDEX_FILE_NAME)
+    assetCache = VRTutorialLib.AssetCache(cacheDirectory)
+    loadedModel = assetCache.loadModel(sourceFilePath, 'ColdSphere')
+    cachedModel = assetCache.loadModel(sourceFilePath, 'CachedSphere')
+    self.assertEqual(len(assetCache.index['entries']), 1)
+    # node name and source file do not depend on the cache state
+    self.assertEqual(loadedModel.GetName(), 'ColdSphere')
+    self.assertEqual(loadedModel.GetAttribute(assetCache.SOURCE_FILE_ATTRIBUTE), os.path.abspath(sourceFilePath))
+    self.assertEqual(cachedModel.GetName(), 'CachedSphere')
+    self.assertEqual(cachedModel.GetAttribute(assetCache.SOURCE_FILE_ATTRIBUTE), os.path.abspath(sourceFilePath))
+    self.assertEqual(cachedModel.GetPolyData().GetNumberOfCells(), loadedModel.GetPolyData().GetNumberOfCells())
+    # both in RAS
+    for loadedBound, cachedBound in zip(loadedModel.GetPolyData().GetBounds(), cachedModel.GetPolyData().GetBounds()):
+      self.assertAlmostEqual(loadedBound, cachedBound, places=4)
+
+    assetCache.enabled = False
+    uncachedModel = assetCache.loadModel(sourceFilePath, 'UncachedSphere')
+    assetCache.enabled = True
+    self.assertEqual(uncachedModel.GetName(), 'UncachedSphere')
+    self.assertEqual(uncachedModel.GetAttribute(assetCache.SOURCE_FILE_ATTRIBUTE), os.path.abspath(sourceFilePath))
+
+    # accesses are written by flushIndex only
+    self.assertTrue(assetCache.indexModified)
+    self.assertFalse(os.path.exists(indexFilePath))
+    assetCache.flushIndex()
+    self.assertFalse(assetCache.indexModified)
+    with open(indexFilePath, 'r') as file:
+      self.assertEqual(list(json.load(file)['entries'].keys()), list(assetCache.index['entries'].keys()))
+    self.assertEqual(VRTutorialLib.AssetCache(cacheDirectory).index['entries'], assetCache.index['entries'])
+
+    # least recently used entries are removed first
+    entryFilePaths = []
+    for entryIndex in range(3):
+      entryFilePath = os.path.join(cacheDirectory, 'entry{0}.bin'.format(entryIndex))
+      with open(entryFilePath, 'wb') as file:
+        file.write(b'0' * 1000)
+      assetCache.registerEntry(entryFilePath, {'type': 'test'})
+      assetCache.index['entries'][os.path.basename(entryFilePath)]['lastAccess'] = entryIndex
+      entryFilePaths.append(entryFilePath)
+    assetCache.touch(entryFilePaths[0])
+    assetCache.evict(assetCache.getSize() - 1000)
+    self.assertFalse(os.path.exists(entryFilePaths[1]))
+    self.assertTrue(os.path.exists(entryFilePaths[0]))
+    self.assertTrue(os.path.exists(entryFilePaths[2]))
+    self.assertNotIn('entry1.bin', assetCache.index['entries'])
+
+    assetCache.clear()
+    self.assertEqual(assetCache.getSize(), 0)
+    shutil.rmtree(testDirectory)
+    self.delayDisplay('Test passed')
+
+  def test_AssetLoader(self):
+    """ Read model files in RAS on worker threads and check that nodes are created in
+    priority order.
+    """
+
+    import shutil
+    self.delayDisplay("Starting the test")
 
-    import SampleData
-    registerSampleData()
-    inputVolume = SampleData.downloadSample('VRTutorial1')
-    self.delayDisplay('Loaded test data set')
+    testDirectory = os.path.join(slicer.app.temporaryPath, 'VRTutorialAssetLoaderTest')
+    if os.path.exists(testDirectory):
+      shutil.rmtree(testDirectory)
+    os.makedirs(testDirectory)
+    points = vtk.vtkPoints()
+    points.InsertNextPoint(1, 2, 3)
+    points.InsertNextPoint(4, 5, 6)
+    points.InsertNextPoint(7, 8, 10)
+    triangle = vtk.vtkCellArray()
+    triangle.InsertNextCell(3, [0, 1, 2])
+    polyData = vtk.vtkPolyData()
+    polyData.SetPoints(points)
+    polyData.SetPolys(triangle)
+    filePaths = {}
+    for header in ['LPS', 'RAS']:
+      filePaths[header] = os.path.join(testDirectory, 'Triangle{0}.vtk'.format(header))
+      writer = vtk.vtkPolyDataWriter()
+      writer.SetFileName(filePaths[header])
+      writer.SetHeader('3D Slicer output. SPACE={0}'.format(header))
+      writer.SetInputData(polyData)
+      writer.Write()
+
+    # files without SPACE=RAS are LPS
+    self.assertEqual(VRTutorialLib.readModelFile(filePaths['LPS']).GetPoint(0), (-1.0, -2.0, 3.0))
+    self.assertEqual(VRTutorialLib.readModelFile(filePaths['RAS']).GetPoint(0), (1.0, 2.0, 3.0))
+    self.assertIsNone(VRTutorialLib.readModelFile(os.path.join(testDirectory, 'Triangle.txt')))
+
+    loadedNames = []
+    loader = VRTutorialLib.AssetLoader(maximumNumberOfWorkers=2, timeBudgetPerTickSeconds=0)
+    for nodeName, priority in [('Last', 2), ('First', 0), ('SecondA', 1), ('SecondB', 1)]:
+      loader.addModel(filePaths['LPS'], nodeName, priority, loadedCallback=lambda modelNode: loadedNames.append(modelNode.GetName()))
+    loader.addMainThreadTask(lambda: loadedNames.append('Task'), 'Task', priority=1)
+    finished = []
+    loader.start(finishedCallback=lambda: finished.append(True))
+    startTime = time.time()
+    while not finished and time.time() - startTime < 10:
+      slicer.app.processEvents()
+      time.sleep(0.01)
+    self.assertTrue(finished)
+    self.assertEqual(loadedNames, ['First', 'SecondA', 'SecondB', 'Task', 'Last'])
+    self.assertFalse(loader.isLoading())
+
+    shutil.rmtree(testDirectory)
+    self.delayDisplay('Test passed')
+
+  def test_SharedGeometry(self):
+    """ Fit the instance matrix of a rotated and of a mirrored copy of a mesh, and reject a copy
+    that is not rigid.
+    """
 
-    inputScalarRange = inputVolume.GetImageData().GetScalarRange()
-    self.assertEqual(inputScalarRange[0], 0)
-    self.assertEqual(inputScalarRange[1], 695)
+    import numpy as np
+    self.delayDisplay("Starting the test")
 
-    outputVolume = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLScalarVolumeNode")
-    threshold = 100
+    cone = vtk.vtkConeSource()
+    cone.SetResolution(8)
+    cone.SetHeight(40)
+    cone.SetRadius(10)
+    cone.Update()
+    sourcePolyData = vtk.vtkPolyData()
+    sourcePolyData.DeepCopy(cone.GetOutput())
+
+    def transformedCopy(transform):
+      transformFilter = vtk.vtkTransformPolyDataFilter()
+      transformFilter.SetTransform(transform)
+      transformFilter.SetInputData(sourcePolyData)
+      transformFilter.Update()
+      return transformFilter.GetOutput()
+
+    rotation = vtk.vtkTransform()
+    rotation.Translate(100, -20, 5)
+    rotation.RotateWXYZ(35, 1, 2, 3)
+    mirror = vtk.vtkTransform()
+    mirror.Translate(-50, 0, 0)
+    mirror.Scale(-1, 1, 1)
+    stretch = vtk.vtkTransform()
+    stretch.Scale(1, 1.5, 1)
+    for transform in [rotation, mirror]:
+      instanceMatrix = VRTutorialLib.fitInstanceMatrix(sourcePolyData, transformedCopy(transform))
+      self.assertIsNotNone(instanceMatrix)
+      np.testing.assert_allclose(instanceMatrix, slicer.util.arrayFromVTKMatrix(transform.GetMatrix()), atol=1e-3)
+    self.assertLess(np.linalg.det(VRTutorialLib.fitInstanceMatrix(sourcePolyData, transformedCopy(mirror))[:3, :3]), 0)
+    self.assertIsNone(VRTutorialLib.fitInstanceMatrix(sourcePolyData, transformedCopy(stretch)))
+    # different mesh
+    cone.SetResolution(9)
+    cone.Update()
+    self.assertIsNone(VRTutorialLib.fitInstanceMatrix(sourcePolyData, cone.GetOutput()))
 
-    # Test the module logic
+    self.delayDisplay('Test passed')
+
+  def test_LazyPartLoading(self):
+    """ Start the tutorial parts in turn and check that only the models of the started part are
+    loaded and shown, and that the least recently started part is removed beyond the maximum.
+    """
+
+    self.delayDisplay("Starting the test")
 
     logic = VRTutorialLogic()
+    logic.activatePartModels(2)
+    self.assertEqual(logic.loadedParts, [2])
+    self.assertIsNone(logic.cylinderModel)
+    for modelNode in [logic.femurModel, logic.femurModelCopy]:
+      self.assertIsNotNone(modelNode)
+      self.assertTrue(modelNode.GetDisplayNode().GetVisibility())
+
+    # models of the other loaded part are hidden, not removed
+    logic.activatePartModels(1)
+    self.assertEqual(logic.loadedParts, [2, 1])
+    self.assertTrue(logic.cylinderModel.GetDisplayNode().GetVisibility())
+    for modelNode in [logic.femurModel, logic.femurModelCopy]:
+      self.assertIsNotNone(modelNode.GetScene())
+      self.assertFalse(modelNode.GetDisplayNode().GetVisibility())
+
+    logic.activatePartModels(2)
+    self.assertEqual(logic.loadedParts, [1, 2])
+    self.assertFalse(logic.cylinderModel.GetDisplayNode().GetVisibility())
+    self.assertTrue(logic.femurModel.GetDisplayNode().GetVisibility())
+
+    # beyond the maximum, the models of the least recently started part are removed with their
+    # instance transforms
+    logic.maximumNumberOfLoadedParts = 1
+    femurNodes = [logic.femurModel, logic.femurModelCopy]
+    femurNodes += [transformNode for transformNode in map(VRTutorialLib.SharedGeometryInstancer.getInstanceTransformNode, femurNodes) if transformNode is not None]
+    cylinderModel = logic.cylinderModel
+    logic.activatePartModels(1)
+    self.assertEqual(logic.loadedParts, [1])
+    self.assertIsNone(logic.femurModel)
+    self.assertIsNone(logic.femurModelCopy)
+    for node in femurNodes:
+      self.assertIsNone(node.GetScene())
+    self.assertIs(logic.cylinderModel, cylinderModel)
+    self.assertTrue(cylinderModel.GetDisplayNode().GetVisibility())
+
+    self.delayDisplay('Test passed')
 
-    # Test algorithm with non-inverted threshold
-    logic.process(inputVolume, outputVolume, threshold, True)
-    outputScalarRange = outputVolume.GetImageData().GetScalarRange()
-    self.assertEqual(outputScalarRange[0], inputScalarRange[0])
-    self.assertEqual(outputScalarRange[1], threshold)
-
-    # Test algorithm with inverted threshold
-    logic.process(inputVolume, outputVolume, threshold, False)
-    outputScalarRange = outputVolume.GetImageData().GetScalarRange()
-    self.assertEqual(outputScalarRange[0], inputScalarRange[0])
-    self.assertEqual(outputScalarRange[1], inputScalarRange[1])
+  def test_Profiling(self):
+    """ Check that disabled profiling records nothing and that the summary of known call
+    durations is right.
+    """
+
+    self.delayDisplay("Starting the test")
+
+    profiler = VRTutorialLib.callProfiler
+    wasEnabled = profiler.enabled
+
+    @VRTutorialLib.profiled('VRTutorialTest.profiledFunction')
+    def profiledFunction(value):
+      return 2 * value
+
+    statistics = profiler.statistics['VRTutorialTest.profiledFunction']
+    try:
+      profiler.enabled = False
+      self.assertEqual(profiledFunction(1), 2)
+      self.assertEqual(statistics.numberOfCalls, 0)
+      profiler.enabled = True
+      for value in range(3):
+        self.assertEqual(profiledFunction(value), 2 * value)
+      self.assertEqual(statistics.numberOfCalls, 3)
+    finally:
+      profiler.enabled = wasEnabled
+      del profiler.statistics['VRTutorialTest.profiledFunction']
+
+    # one call per second lasting 1, 2, ... 10 ms, the buffer keeps the last 8 calls
+    statistics = VRTutorialLib.CallStatistics('known', bufferSize=8)
+    for callIndex in range(10):
+      statistics.record(float(callIndex), (callIndex + 1) / 1000.0)
+    summary = statistics.getSummary(now=10.0)
+    self.assertEqual(summary['count'], 10)
+    # buffered durations are 3 to 10 ms
+    self.assertAlmostEqual(summary['meanMs'], 6.5)
+    self.assertAlmostEqual(summary['p50Ms'], 6.5)
+    self.assertAlmostEqual(summary['p95Ms'], 3 + 0.95 * 7)
+    self.assertAlmostEqual(summary['maxMs'], 10.0)
+    # 8 calls since the oldest buffered start time (2 s)
+    self.assertAlmostEqual(summary['callRateHz'], 1.0)
+    statistics.reset()
+    self.assertEqual(statistics.getSummary(now=10.0)['p99Ms'], 0.0)
+
+    self.delayDisplay('Test passed')
+
+  def test_DistanceField(self):
+    """ Compare the sampled distance field of a sphere with the exact distance to its mesh, and
+    check that the field is read from the asset cache the second time.
+    """
+
+    import glob
+    import shutil
+    import numpy as np
+    from unittest import mock
+    self.delayDisplay("Starting the test")
+
+    testDirectory = os.path.join(slicer.app.temporaryPath, 'VRTutorialDistanceFieldTest')
+    if os.path.exists(testDirectory):
+      shutil.rmtree(testDirectory)
+    os.makedirs(testDirectory)
+    sphere = vtk.vtkSphereSource()
+    sphere.SetRadius(50)
+    sphere.SetThetaResolution(32)
+    sphere.SetPhiResolution(32)
+    sphere.Update()
+    sourceFilePath = os.path.join(testDirectory, 'DistanceSphere.vtk')
+    writer = vtk.vtkPolyDataWriter()
+    writer.SetFileName(sourceFilePath)
+    writer.SetInputData(sphere.GetOutput())
+    writer.Write()
+    assetCache = VRTutorialLib.AssetCache(os.path.join(testDirectory, 'Cache'))
+    sphereModel = assetCache.loadModel(sourceFilePath)
+    distanceFieldCache = VRTutorialLib.DistanceFieldCache(assetCache, maximumDimension=32)
+    distanceField = distanceFieldCache.getDistanceField(sphereModel)
+
+    # inside, on the surface, outside in the grid and outside the grid
+    points = np.array([[0.0, 0, 0], sphereModel.GetPolyData().GetPoint(100), [55.0, 0, 0], [0, 200.0, 0], [-150.0, -150, 0]])
+    exactDistance = vtk.vtkImplicitPolyDataDistance()
+    exactDistance.SetInput(sphereModel.GetPolyData())
+    exactDistances = np.array([exactDistance.EvaluateFunction(point) for point in points])
+    distances = distanceField.evaluate(points)
+    spacing = float(distanceField.spacing.max())
+    np.testing.assert_allclose(distances, exactDistances, atol=spacing)
+    self.assertLess(distances[0], -50 + spacing)
+    self.assertTrue((distances[2:] > 0).all())
+
+    # the second request reads the cache entry
+    entryFilePaths = glob.glob(os.path.join(assetCache.cacheDirectory, 'sdf-*.npz'))
+    self.assertEqual(len(entryFilePaths), 1)
+    with mock.patch.object(VRTutorialLib.SignedDistanceField, 'fromPolyData', side_effect=AssertionError('distance field computed again')):
+      cachedDistanceField = distanceFieldCache.getDistanceField(sphereModel)
+    np.testing.assert_array_equal(cachedDistanceField.values, distanceField.values)
+    np.testing.assert_array_equal(cachedDistanceField.origin, distanceField.origin)
+
+    self.delayDisplay('Test passed')
+
+  def test_FemurAlignment(self):
+    """ Check that the femur alignment error is zero when the femur is moved onto its copy,
+    and that the closed form RMS error matches the per-point errors.
+    """
+
+    import numpy as np
+    self.delayDisplay("Starting the test")
+
+    logic = VRTutorialLogic()
+    logic.femurModel = self.loadTestModel('femurModel.vtk')
+    logic.femurModelCopy = self.loadTestModel('femurModelCopy.vtk')
+    alignmentEvaluator = logic.getAlignmentEvaluator()
+    self.assertIsNotNone(alignmentEvaluator)
+
+    # Models as loaded are not aligned
+    error = alignmentEvaluator.evaluateNodes(logic.femurModel, logic.femurModelCopy)
+    self.assertFalse(alignmentEvaluator.isAligned(error))
+    errors = alignmentEvaluator.getErrors(np.eye(4), np.eye(4))
+    self.assertAlmostEqual(error, float(np.sqrt(np.mean(errors ** 2))), places=3)
+    # Errors of a trajectory, with both metrics, match the per-pose errors
+    poses = np.tile(np.eye(4), (3, 1, 1))
+    poses[:, 0, 3] = [0.0, 10.0, 20.0]
+    for metric in ['rms', 'hausdorff']:
+      alignmentEvaluator.metric = metric
+      trajectoryErrors = alignmentEvaluator.getTrajectoryErrors(poses, np.eye(4), chunkSize=2)
+      for pose, trajectoryError in zip(poses, trajectoryErrors):
+        poseErrors = alignmentEvaluator.getErrors(pose, np.eye(4))
+        expectedError = poseErrors.max() if metric == 'hausdorff' else np.sqrt(np.mean(poseErrors ** 2))
+        self.assertAlmostEqual(trajectoryError, float(expectedError), places=3)
+    alignmentEvaluator.metric = 'rms'
+
+    # Move the femur onto the copy
+    transformNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLLinearTransformNode')
+    transformNode.SetMatrixTransformToParent(slicer.util.vtkMatrixFromArray(alignmentEvaluator.correspondenceMatrix))
+    logic.femurModel.SetAndObserveTransformNodeID(transformNode.GetID())
+    error = alignmentEvaluator.evaluateNodes(logic.femurModel, logic.femurModelCopy)
+    self.assertLess(error, 1e-3)
+    self.assertTrue(alignmentEvaluator.isAligned(error))
+
+    self.delayDisplay('Test passed')
+
+  def test_TaskStateMachine(self):
+    """ Check that switching tasks back and forth keeps one observer set, and that a completed
+    task stops evaluating its predicate.
+    """
+
+    self.delayDisplay("Starting the test")
+
+    transformNode1 = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLLinearTransformNode')
+    transformNode2 = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLLinearTransformNode')
+    dispatcher = VRTutorialLib.TransformEventDispatcher(updateRateHz=0)
+    stateMachine = VRTutorialLib.TaskStateMachine(dispatcher)
+    stateMachine.getNode = lambda nodeName: {'node1': transformNode1, 'node2': transformNode2}[nodeName]
+    evaluations = {'task1': 0, 'task2': 0}
+    completedTasks = []
+    def predicate(name, completed):
+      evaluations[name] += 1
+      return completed
+    stateMachine.addTask({'name': 'task1', 'observedNodes': ['node1'], 'successPredicate': lambda: predicate('task1', False)})
+    stateMachine.addTask({'name': 'task2', 'observedNodes': ['node1', 'node2'], 'successPredicate': lambda: predicate('task2', True)})
+    stateMachine.taskCompletedCallback = lambda task: completedTasks.append(task['name'])
+
+    for i in range(5):
+      stateMachine.activateNextTask()
+      stateMachine.activatePreviousTask()
+    self.assertEqual(stateMachine.getActiveTaskName(), 'task1')
+    self.assertEqual(len(dispatcher.observedNodes), 1)
+    transformNode1.InvokeEvent(slicer.vtkMRMLTransformableNode.TransformModifiedEvent)
+    self.assertEqual(evaluations['task1'], 1)
+
+    stateMachine.activateNextTask()
+    self.assertEqual(len(dispatcher.observedNodes), 2)
+    transformNode2.InvokeEvent(slicer.vtkMRMLTransformableNode.TransformModifiedEvent)
+    transformNode1.InvokeEvent(slicer.vtkMRMLTransformableNode.TransformModifiedEvent)
+    self.assertEqual(evaluations['task2'], 1)
+    self.assertEqual(completedTasks, ['task2'])
+    self.assertEqual(len(dispatcher.observedNodes), 0)
+
+    self.delayDisplay('Test passed')
+
+  def test_TransformEventDispatcher(self):
+    """ Check callback priority order, removal of callbacks during dispatch, the shared
+    world matrix buffer, coalescing of events by the timer, event decimation and raw callbacks.
+    """
+
+    self.delayDisplay("Starting the test")
+
+    parentTransformNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLLinearTransformNode')
+    transformNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLLinearTransformNode')
+    transformNode.SetAndObserveTransformNodeID(parentTransformNode.GetID())
+    dispatcher = VRTutorialLib.TransformEventDispatcher(updateRateHz=0)
+    calls = []
+    def lowPriorityCallback(node, event):
+      calls.append('low')
+    def highPriorityCallback(node, event):
+      calls.append('high')
+      # removing a callback that has not been called yet in this dispatch
+      dispatcher.removeCallback(node, lowPriorityCallback)
+    dispatcher.addCallback(transformNode, lowPriorityCallback, priority=0)
+    dispatcher.addCallback(transformNode, highPriorityCallback, priority=10)
+    self.assertEqual(len(dispatcher.observedNodes), 1)
+
+    translation = vtk.vtkMatrix4x4()
+    translation.SetElement(0, 3, 10.0)
+    parentTransformNode.SetMatrixTransformToParent(translation)
+    self.assertEqual(calls, ['high'])
+    self.assertEqual(dispatcher.getWorldMatrix(transformNode)[0, 3], 10.0)
+
+    # Events between two timer ticks are dispatched once, with the latest pose; raw callbacks
+    # run on every event
+    dispatchedTranslations = []
+    def poseCallback(node, event):
+      dispatchedTranslations.append(dispatcher.getWorldMatrix(node)[0, 3])
+    rawTranslations = []
+    def rawCallback(node, event):
+      rawTranslations.append(dispatcher.getWorldMatrix(node)[0, 3])
+    dispatcher.removeCallback(transformNode, highPriorityCallback)
+    dispatcher.addCallback(transformNode, poseCallback)
+    dispatcher.addRawCallback(transformNode, rawCallback)
+    dispatcher.setUpdateRate(60)
+    for x in range(20, 25):
+      translation.SetElement(0, 3, x)
+      parentTransformNode.SetMatrixTransformToParent(translation)
+    self.assertEqual(dispatchedTranslations, [])
+    self.assertTrue(dispatcher.timer.isActive())
+    dispatcher.onTimeout()
+    self.assertEqual(dispatchedTranslations, [24.0])
+    # no event since the last tick, the timer stops until the next event
+    dispatcher.onTimeout()
+    self.assertEqual(dispatchedTranslations, [24.0])
+    self.assertFalse(dispatcher.timer.isActive())
+    translation.SetElement(0, 3, 30.0)
+    parentTransformNode.SetMatrixTransformToParent(translation)
+    self.assertTrue(dispatcher.timer.isActive())
+    for iteration in range(100):
+      slicer.app.processEvents()
+      if len(dispatchedTranslations) > 1:
+        break
+      time.sleep(0.01)
+    self.assertEqual(dispatchedTranslations, [24.0, 30.0])
+    self.assertEqual(rawTranslations, [20.0, 21.0, 22.0, 23.0, 24.0, 30.0])
+
+    # Without the timer, callbacks run on every Nth event only
+    dispatcher.setUpdateRate(0)
+    dispatcher.setEventDecimation(3)
+    del dispatchedTranslations[:]
+    del rawTranslations[:]
+    for x in range(40, 47):
+      translation.SetElement(0, 3, x)
+      parentTransformNode.SetMatrixTransformToParent(translation)
+    self.assertEqual(dispatchedTranslations, [42.0, 45.0])
+    self.assertEqual(rawTranslations, [float(x) for x in range(40, 47)])
+
+    # Nodes are observed while they have callbacks or raw callbacks
+    dispatcher.removeCallback(transformNode, poseCallback)
+    self.assertEqual(len(dispatcher.observedNodes), 1)
+    dispatcher.removeRawCallback(transformNode, rawCallback)
+    self.assertEqual(len(dispatcher.observedNodes), 0)
+    dispatcher.addCallback(transformNode, poseCallback)
+
+    dispatcher.removeAllCallbacks()
+    self.assertIsNone(dispatcher.getWorldMatrix(transformNode))
+
+    self.delayDisplay('Test passed')
+
+  def test_BatchEvaluation(self):
+    """ Run simulated trainees through the task success logic in this process and in a worker
+    process, and check the report.
+    """
+
+    self.delayDisplay("Starting the test")
+
+    logic = VRTutorialLogic()
+    batchEvaluator = VRTutorialLib.BatchEvaluator(logic, maximumNumberOfWorkers=0)
+    batchEvaluator.addSimulatedTrainees(8, duration=10.0)
+    results = batchEvaluator.run()
+    self.assertEqual(len(results), 8)
+    report = batchEvaluator.getReport()
+    self.assertEqual(report['HeadCylinderCollision']['trajectories'], 8)
+    self.assertEqual(len(report['FemurAlignment']), len(batchEvaluator.alignmentThresholds))
+    # A looser threshold cannot have fewer successes
+    successes = [statistics['successes'] for statistics in report['FemurAlignment']]
+    self.assertEqual(successes, sorted(successes))
+    batchEvaluator.writeReport(os.path.join(slicer.app.temporaryPath, 'VRTutorialBatchEvaluation.json'))
+
+    # same trajectories in one worker process (spawned PythonSlicer, initializer and pickled
+    # trajectories), results must not depend on where they are evaluated
+    workerBatchEvaluator = VRTutorialLib.BatchEvaluator(logic, maximumNumberOfWorkers=1)
+    workerBatchEvaluator.trajectories = batchEvaluator.trajectories
+    if workerBatchEvaluator.getWorkerExecutable() is None:
+      logging.warning('PythonSlicer not found, batch evaluation worker processes are not tested')
+    self.assertEqual(workerBatchEvaluator.run(), results)
+    self.assertNotIn('VRTUTORIAL_BATCH_WORKER', os.environ)
+
+    # workers use the alignment metric of the logic: the maximum point error is never below the
+    # RMS error
+    logic.alignmentMetric = 'hausdorff'
+    logic.alignmentEvaluator = None
+    hausdorffResults = batchEvaluator.run()
+    for result, hausdorffResult in zip(results, hausdorffResults):
+      self.assertGreaterEqual(hausdorffResult['FemurAlignment']['minimumError'] + 1e-6, result['FemurAlignment']['minimumError'])
+      self.assertEqual(hausdorffResult['HeadCylinderCollision'], result['HeadCylinderCollision'])
+
+    self.delayDisplay('Test passed')
+
+  def test_SessionTelemetry(self):
+    """ Record poses through small ring buffers and check that every sample and event is on
+    disk after stop, including events coalesced by the dispatcher timer.
+    """
+
+    import shutil
+    self.delayDisplay("Starting the test")
+
+    sessionDirectory = os.path.join(slicer.app.temporaryPath, 'VRTutorialTelemetryTest')
+    if os.path.exists(sessionDirectory):
+      shutil.rmtree(sessionDirectory)
+    transformNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLLinearTransformNode')
+    # poses are modified faster than the timer ticks, the recorder must not depend on it
+    dispatcher = VRTutorialLib.TransformEventDispatcher(updateRateHz=60)
+    recorder = VRTutorialLib.SessionTelemetryRecorder(sessionDirectory, dispatcher, [transformNode], chunkSize=16, numberOfChunks=2)
+    recorder.start()
+    matrix = vtk.vtkMatrix4x4()
+    numberOfPoses = 100
+    for poseIndex in range(numberOfPoses):
+      matrix.SetElement(0, 3, poseIndex)
+      transformNode.SetMatrixTransformToParent(matrix)
+    recorder.recordEvent('CollisionDetected', 3)
+    recorder.stop()
+    self.assertEqual(len(dispatcher.observedNodes), 0)
+
+    session = VRTutorialLib.readSessionTelemetry(sessionDirectory)
+    self.assertEqual(session['metadata']['eventNames'], ['CollisionDetected'])
+    self.assertEqual(len(session['events']), 1)
+    self.assertEqual(len(session['poses']) + session['metadata']['droppedPoses'], numberOfPoses)
+    # chunks are read back in recording order
+    translations = session['poses']['matrix'][:, 3]
+    self.assertTrue((translations[1:] > translations[:-1]).all())
+
+    self.delayDisplay('Test passed')
+
+  def test_TrajectoryAnalytics(self):
+    """ Check the task metrics of a synthetic session: the headset walks 1 m in 10 s, stands
+    still for 5 s, flies 3 m in 0.5 s and the task is completed.
+    """
+
+    import numpy as np
+    self.delayDisplay("Starting the test")
+
+    times = np.arange(0.0, 16.0, 1.0 / 90.0)
+    headX = np.interp(times, [0.0, 10.0, 15.0, 15.5, 16.0], [0.0, 1000.0, 1000.0, 4000.0, 4000.0])
+    poses = np.zeros(len(times), dtype=VRTutorialLib.SAMPLE_DTYPE)
+    poses['time'] = times
+    poses['matrix'][:, [0, 5, 10]] = 1.0
+    poses['matrix'][:, 3] = headX
+    events = np.zeros(2, dtype=VRTutorialLib.EVENT_DTYPE)
+    events['time'] = [0.0, 15.9]
+    events['event'] = [0, 1]
+    session = {'metadata': {'deviceNames': ['HMD'], 'eventNames': ['TaskStarted', 'TaskCompleted'], 'taskNames': ['HeadCylinderCollision']},
+      'poses': poses, 'events': events}
+
+    summary = VRTutorialLib.SessionAnalyzer(session).getSummary()
+    self.assertEqual(len(summary), 1)
+    metrics = summary[0]
+    self.assertEqual(metrics['task'], 'HeadCylinderCollision')
+    self.assertTrue(metrics['completed'])
+    self.assertAlmostEqual(metrics['duration'], 15.9, places=3)
+    self.assertAlmostEqual(metrics['headPathLength'], 1000.0, delta=20.0)
+    self.assertEqual(metrics['flyActions'], 1)
+    self.assertEqual(metrics['idlePeriods'], 1)
+    self.assertAlmostEqual(metrics['idleTime'], 5.0, delta=0.1)
+
+    self.delayDisplay('Test passed')
+
+  def test_InstructionSlideStack(self):
+    """ Pack the tutorial slides in one volume, from the files then from the asset cache, and
+    switch slides by slice offset.
+    """
+
+    import shutil
+    self.delayDisplay("Starting the test")
+
+    cacheDirectory = os.path.join(slicer.app.temporaryPath, 'VRTutorialSlideCacheTest')
+    if os.path.exists(cacheDirectory):
+      shutil.rmtree(cacheDirectory)
+    assetCache = VRTutorialLib.AssetCache(cacheDirectory)
+    slidesDirectory = slicer.modules.vrtutorial.path.replace("VRTutorial.py","") + 'Resources/Instructions/Slides'
+    slideStack = VRTutorialLib.InstructionSlideStack(slidesDirectory, assetCache)
+    numberOfSlides = slideStack.getNumberOfSlides()
+    self.assertGreater(numberOfSlides, 1)
+    volumeNode = slideStack.load()
+    self.assertEqual(volumeNode.GetImageData().GetDimensions()[2], numberOfSlides)
+    self.assertEqual(volumeNode.GetImageData().GetNumberOfScalarComponents(), 3)
+    self.assertEqual(len(assetCache.index['entries']), 1)
+
+    cachedSlideStack = VRTutorialLib.InstructionSlideStack(slidesDirectory, assetCache)
+    cachedVolumeNode = cachedSlideStack.load()
+    self.assertEqual(cachedVolumeNode.GetImageData().GetDimensions(), volumeNode.GetImageData().GetDimensions())
+
+    sliceLogic = slicer.app.layoutManager().sliceWidget('Red').sliceLogic() if slicer.app.layoutManager() else None
+    slideStack.show(sliceLogic)
+    slideStack.showSlide(sliceLogic, numberOfSlides + 5)
+    self.assertEqual(slideStack.currentSlideIndex, numberOfSlides - 1)
+    if sliceLogic is not None:
+      self.assertAlmostEqual(sliceLogic.GetSliceOffset(), slideStack.getSliceOffset(numberOfSlides - 1))
+
+    self.delayDisplay('Test passed')
+
+  def test_TextureCache(self):
+    """ Prepare the mip levels of a texture once, then read them from the cache at a lower
+    maximum resolution.
+    """
+
+    import shutil
+    import numpy as np
+    from vtk.util.numpy_support import vtk_to_numpy
+    self.delayDisplay("Starting the test")
+
+    cacheDirectory = os.path.join(slicer.app.temporaryPath, 'VRTutorialTextureCacheTest')
+    if os.path.exists(cacheDirectory):
+      shutil.rmtree(cacheDirectory)
+    os.makedirs(cacheDirectory)
+    # 300 x 200 image, top row red, bottom row blue
+    pixels = np.zeros((200, 300, 3), dtype=np.uint8)
+    pixels[0, :, 0] = 255
+    pixels[-1, :, 2] = 255
+    imageData = vtk.vtkImageData()
+    imageData.SetDimensions(300, 200, 1)
+    imageData.AllocateScalars(vtk.VTK_UNSIGNED_CHAR, 3)
+    vtk_to_numpy(imageData.GetPointData().GetScalars())[:] = pixels[::-1].reshape(-1, 3)
+    filePath = os.path.join(cacheDirectory, 'Texture.png')
+    writer = vtk.vtkPNGWriter()
+    writer.SetFileName(filePath)
+    writer.SetInputData(imageData)
+    writer.Write()
+
+    assetCache = VRTutorialLib.AssetCache(os.path.join(cacheDirectory, 'Cache'))
+    textureCache = VRTutorialLib.TextureCache(assetCache)
+    pyramid = textureCache.getPyramid(filePath)
+    self.assertEqual([level.shape[:2] for level in pyramid.levels[:3]], [(200, 300), (100, 150), (50, 75)])
+    self.assertEqual(pyramid.levels[-1].shape[:2], (1, 1))
+    # flipped for VTK: the first row is the bottom of the image
+    self.assertEqual(tuple(pyramid.levels[0][0, 0]), (0, 0, 255))
+    self.assertEqual(len(assetCache.index['entries']), 1)
+
+    texture = textureCache.getTexture(filePath, maximumSize=128)
+    self.assertEqual(texture.GetDimensions(), (75, 50, 1))
+    self.assertEqual(len(assetCache.index['entries']), 1)
+
+    self.delayDisplay('Test passed')
+
+  def test_ScenarioTiles(self):
+    """ Tile a textured 4 m x 4 m floor in 1 m tiles and stream the tiles in front of a camera
+    standing in the middle of it.
+    """
+
+    import shutil
+    self.delayDisplay("Starting the test")
+
+    tileDirectory = os.path.join(slicer.app.temporaryPath, 'VRTutorialScenarioTilesTest')
+    if os.path.exists(tileDirectory):
+      shutil.rmtree(tileDirectory)
+    os.makedirs(tileDirectory)
+    floor = vtk.vtkPlaneSource()
+    floor.SetOrigin(-2000, -2000, 0)
+    floor.SetPoint1(2000, -2000, 0)
+    floor.SetPoint2(-2000, 2000, 0)
+    floor.SetResolution(40, 40)
+    triangulate = vtk.vtkTriangleFilter()
+    triangulate.SetInputConnection(floor.GetOutputPort())
+    writer = vtk.vtkXMLPolyDataWriter()
+    writer.SetFileName(os.path.join(tileDirectory, 'Floor.vtp'))
+    writer.SetInputConnection(triangulate.GetOutputPort())
+    writer.Write()
+
+    assetCache = VRTutorialLib.AssetCache(os.path.join(tileDirectory, 'Cache'))
+    tileCache = VRTutorialLib.ScenarioTileCache(assetCache, tileSize=1000.0)
+    tileSet = tileCache.getTileSet(os.path.join(tileDirectory, 'Floor.vtp'))
+    # tiles are written to the asset cache, not next to the source file
+    self.assertEqual(os.path.dirname(os.path.dirname(tileSet['folder'])), os.path.join(assetCache.cacheDirectory, tileCache.TILE_FOLDER_NAME))
+    self.assertFalse(os.path.exists(os.path.join(tileDirectory, tileCache.TILE_FOLDER_NAME)))
+    self.assertEqual(len(tileSet['tiles']), 16)
+    self.assertEqual(sum(tile['lods'][0]['numberOfTriangles'] for tile in tileSet['tiles']), 40 * 40 * 2)
+    for tile in tileSet['tiles']:
+      self.assertLess(tile['lods'][-1]['numberOfTriangles'], tile['lods'][0]['numberOfTriangles'])
+
+    camera = vtk.vtkCamera()
+    camera.SetPosition(0, 0, 500)
+    camera.SetFocalPoint(1000, 0, 500)
+    camera.SetViewUp(0, 0, 1)
+    camera.SetViewAngle(30)
+    streamer = VRTutorialLib.ScenarioTileStreamer(tileSet)
+    logic = VRTutorialLogic()
+    texture = vtk.vtkImageData()
+    texture.SetDimensions(4, 4, 1)
+    texture.AllocateScalars(vtk.VTK_UNSIGNED_CHAR, 3)
+    streamer.tileNodeCreatedCallback = lambda modelNode: logic.showTextureOnModel(modelNode, texture)
+    for iteration in range(100):
+      streamer.update(camera)
+      if not streamer.pendingLoads:
+        break
+      time.sleep(0.05)
+    streamer.update(camera)
+    shownCenters = [tileSet['tiles'][tileIndex]['center'] for tileIndex in streamer.displayedLods]
+    self.assertTrue(shownCenters)
+    # tiles behind the camera are not shown
+    self.assertTrue(all(center[0] > -1000 for center in shownCenters))
+    self.assertIsNotNone(streamer.modelNodes[next(iter(streamer.displayedLods))].GetPolyData().GetPointData().GetTCoords())
+    # all the tiles share the texture producer
+    self.assertEqual(len(logic.textureProducers), 1)
+    textureProducer = logic.textureProducers[texture]
+    for modelNode in streamer.modelNodes.values():
+      self.assertIs(modelNode.GetDisplayNode().GetTextureImageDataConnection().GetProducer(), textureProducer)
+    streamer.removeModelNodes()
+    logic.resetLoadedModels()
+    self.assertEqual(len(logic.textureProducers), 0)
+
+    self.delayDisplay('Test passed')
+
+  def test_SceneBVH(self):
+    """ Query the contacts of two probes with a row of spheres, then move one sphere and check
+    that only its leaf is refitted.
+    """
+
+    self.delayDisplay("Starting the test")
+
+    dispatcher = VRTutorialLib.TransformEventDispatcher(updateRateHz=0)
+    sceneBVH = VRTutorialLib.SceneBVH(dispatcher)
+    transformNodes = []
+    for sphereIndex in range(8):
+      sphere = vtk.vtkSphereSource()
+      sphere.SetRadius(20)
+      sphere.SetThetaResolution(24)
+      sphere.SetPhiResolution(24)
+      sphere.Update()
+      modelNode = slicer.modules.models.logic().AddModel(sphere.GetOutput())
+      transformNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLLinearTransformNode')
+      matrix = vtk.vtkMatrix4x4()
+      matrix.SetElement(0, 3, 100 * sphereIndex)
+      transformNode.SetMatrixTransformToParent(matrix)
+      modelNode.SetAndObserveTransformNodeID(transformNode.GetID())
+      sceneBVH.addObject(modelNode)
+      transformNodes.append(transformNode)
+    nodes = sceneBVH.getNodes()
+
+    # the first probe touches sphere 2, the second one touches nothing
+    contacts = sceneBVH.findContacts([[200, 25, 0], [350, 0, 0]], [10, 10])
+    self.assertEqual([(probeIndex, node) for probeIndex, node, distance in contacts], [(0, nodes[2])])
+    self.assertAlmostEqual(contacts[0][2], 5.0, delta=0.5)
+    self.assertEqual(sceneBVH.numberOfMeshTests, 1)
+
+    sceneBVH.resetStatistics()
+    matrix = vtk.vtkMatrix4x4()
+    matrix.SetElement(0, 3, 350)
+    transformNodes[5].SetMatrixTransformToParent(matrix)
+    contacts = sceneBVH.findContacts([[200, 25, 0], [350, 0, 0]], [10, 10])
+    self.assertEqual(sorted(probeIndex for probeIndex, node, distance in contacts), [0, 1])
+    self.assertEqual(sceneBVH.numberOfRefittedLeaves, 1)
+    self.assertEqual(sceneBVH.numberOfRebuilds, 0)
+
+    sceneBVH.clear()
+    self.assertEqual(len(dispatcher.observedNodes), 0)
+
+    self.delayDisplay('Test passed')
+
+  def test_HandTouchDetection(self):
+    """ Move two hands onto and off a target and check the touch events of both hands.
+    """
+
+    self.delayDisplay("Starting the test")
+
+    dispatcher = VRTutorialLib.TransformEventDispatcher(updateRateHz=0)
+    sceneBVH = VRTutorialLib.SceneBVH(dispatcher)
+    target = vtk.vtkCubeSource()
+    target.SetXLength(100)
+    target.SetYLength(100)
+    target.SetZLength(100)
+    target.Update()
+    targetModel = slicer.modules.models.logic().AddModel(target.GetOutput())
+    sceneBVH.addObject(targetModel)
+    hands = []
+    for handName, x in [('RightHand', 200), ('LeftHand', -200)]:
+      hand = vtk.vtkCylinderSource()
+      hand.SetRadius(10)
+      hand.SetHeight(80)
+      hand.Update()
+      handModel = slicer.modules.models.logic().AddModel(hand.GetOutput())
+      controllerTransform = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLLinearTransformNode')
+      matrix = vtk.vtkMatrix4x4()
+      matrix.SetElement(0, 3, x)
+      controllerTransform.SetMatrixTransformToParent(matrix)
+      handModel.SetAndObserveTransformNodeID(controllerTransform.GetID())
+      hands.append((handName, controllerTransform, handModel))
+
+    events = []
+    detector = VRTutorialLib.HandTouchDetector(sceneBVH, dispatcher)
+    detector.touchCallback = lambda handName, modelNode, touching: events.append((handName, modelNode, touching))
+    detector.setHands(hands)
+    detector.start()
+    self.assertEqual(events, [])
+
+    # both hands move into the faces of the cube
+    for handName, controllerTransform, handModel in hands:
+      matrix = vtk.vtkMatrix4x4()
+      controllerTransform.GetMatrixTransformToParent(matrix)
+      matrix.SetElement(0, 3, 55 if matrix.GetElement(0, 3) > 0 else -55)
+      controllerTransform.SetMatrixTransformToParent(matrix)
+    detector.update()
+    self.assertEqual(set(events), set([('RightHand', targetModel, True), ('LeftHand', targetModel, True)]))
+
+    del events[:]
+    matrix = vtk.vtkMatrix4x4()
+    matrix.SetElement(0, 3, 300)
+    hands[0][1].SetMatrixTransformToParent(matrix)
+    detector.update()
+    self.assertEqual(events, [('RightHand', targetModel, False)])
+
+    del events[:]
+    detector.stop()
+    self.assertEqual(events, [('LeftHand', targetModel, False)])
+    self.assertEqual(len(dispatcher.observedNodes), 1)
+
+    self.delayDisplay('Test passed')
+
+  def test_ContinuousCollision(self):
+    """ Move a sphere through a thin plate in one step: the discrete test misses the plate,
+    the swept test finds the contact.
+    """
+
+    self.delayDisplay("Starting the test")
+
+    import numpy as np
+
+    plate = vtk.vtkCubeSource()
+    plate.SetXLength(4)
+    plate.SetYLength(200)
+    plate.SetZLength(200)
+    plate.Update()
+    plateModel = slicer.modules.models.logic().AddModel(plate.GetOutput())
+    sphere = vtk.vtkSphereSource()
+    sphere.SetRadius(10)
+    sphere.Update()
+    sphereModel = slicer.modules.models.logic().AddModel(sphere.GetOutput())
+    sphereTransform = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLLinearTransformNode')
+    sphereModel.SetAndObserveTransformNodeID(sphereTransform.GetID())
+
+    def moveSphere(x):
+      matrix = vtk.vtkMatrix4x4()
+      matrix.SetElement(0, 3, x)
+      sphereTransform.SetMatrixTransformToParent(matrix)
+
+    # poses are interpolated along the shortest rotation
+    start = np.eye(4)
+    end = np.eye(4)
+    end[:3, :3] = [[0, -1, 0], [1, 0, 0], [0, 0, 1]]
+    end[:3, 3] = [100, 0, 0]
+    poses = VRTutorialLib.interpolatePoses(start, end, [0.0, 0.5, 1.0])
+    np.testing.assert_allclose(poses[0], start, atol=1e-9)
+    np.testing.assert_allclose(poses[2], end, atol=1e-9)
+    np.testing.assert_allclose(poses[1][:3, 3], [50, 0, 0], atol=1e-9)
+    np.testing.assert_allclose(poses[1][1, 0], np.sin(np.pi / 4), atol=1e-9)
+
+    collisionPair = VRTutorialLib.MeshCollisionPair(sphereModel, plateModel)
+    distanceField = VRTutorialLib.TargetDistanceField(plateModel, VRTutorialLib.SignedDistanceField.fromPolyData(plate.GetOutput()))
+    detector = VRTutorialLib.SweptCollisionDetector(collisionPair, distanceField)
+    moveSphere(-100)
+    self.assertEqual(detector.check(), 0)
+    moveSphere(100)
+    self.assertEqual(collisionPair.check(), 0)
+    self.assertGreater(detector.check(), 0)
+    self.assertGreater(detector.contactFraction, 0.0)
+    self.assertLess(detector.contactFraction, 1.0)
+    self.assertGreater(detector.numberOfSteps, 1)
+    self.assertLess(detector.numberOfMeshTests, detector.numberOfSteps)
+
+    # without a previous pose only the current pose is tested
+    detector.reset()
+    moveSphere(-100)
+    self.assertEqual(detector.check(), 0)
+    self.assertEqual(detector.numberOfSteps, 1)
+
+    self.delayDisplay('Test passed')
+
+  def test_AnalyticTargets(self):
+    """ Fit the primitive targets, compare the closed form tests with the mesh tests and check
+    that other targets use the mesh test.
+    """
+
+    self.delayDisplay("Starting the test")
+
+    import numpy as np
+
+    # declared shapes
+    box = VRTutorialLib.AnalyticBox([0, 0, 0], np.eye(3), [10, 20, 30])
+    np.testing.assert_allclose(box.evaluate([[15, 0, 0], [0, 0, 0], [13, 24, 0]]), [5, -10, 5])
+    np.testing.assert_array_equal(box.intersectsSegments(np.array([[-50.0, 0, 0], [-50.0, 25, 0]]), np.array([[50.0, 0, 0], [50.0, 25, 0]])), [True, False])
+    cylinder = VRTutorialLib.AnalyticCylinder([0, 0, 0], [0, 0, 1], 10, 50)
+    np.testing.assert_allclose(cylinder.evaluate([[20, 0, 0], [0, 0, 0], [0, 0, 60]]), [10, -10, 10])
+    np.testing.assert_array_equal(cylinder.intersectsSegments(np.array([[-50.0, 5, 0], [-50.0, 15, 0]]), np.array([[50.0, 5, 0], [50.0, 15, 0]])), [True, False])
+    # segments parallel to the caps above the cylinder, or along the axis, must not produce invalid values
+    with np.errstate(all='raise'):
+      np.testing.assert_array_equal(cylinder.intersectsSegments(np.array([[-50.0, 0, 60], [0.0, 0, -80]]), np.array([[50.0, 0, 60], [0.0, 0, 80]])), [False, True])
+    # shapes must implement the whole interface
+    class IncompleteShape(VRTutorialLib.AnalyticTargets.AnalyticShape):
+      def signedDistance(self, points):
+        return np.zeros(len(points))
+    with self.assertRaises(TypeError):
+      IncompleteShape()
+
+    # fitted shapes, distances agree with the meshes
+    cylinderModel = self.loadTestModel('CylinderModel.vtk')
+    cubeModel = self.loadTestModel('CubeModel.vtk')
+    femurModel = self.loadTestModel('femurModel.vtk')
+    logic = VRTutorialLogic()
+    self.assertIsInstance(logic.analyticTargetCache.getShape(cylinderModel), VRTutorialLib.AnalyticCylinder)
+    self.assertIsInstance(logic.analyticTargetCache.getShape(cubeModel), VRTutorialLib.AnalyticBox)
+    self.assertIsNone(logic.analyticTargetCache.getShape(femurModel))
+    for targetModel in [cylinderModel, cubeModel]:
+      polyData = targetModel.GetPolyData()
+      bounds = np.array(polyData.GetBounds()).reshape(3, 2)
+      size = (bounds[:, 1] - bounds[:, 0]).max()
+      points = bounds[:, 0] + (bounds[:, 1] - bounds[:, 0]) * np.random.RandomState(0).uniform(-0.5, 1.5, (50, 3))
+      meshDistance = vtk.vtkImplicitPolyDataDistance()
+      meshDistance.SetInput(polyData)
+      expectedDistances = [meshDistance.EvaluateFunction(point) for point in points]
+      distances = logic.analyticTargetCache.getShape(targetModel).evaluate(points)
+      np.testing.assert_allclose(distances, expectedDistances, atol=0.02 * size)
+
+    # collisions of a sphere with the fitted shape and with the mesh
+    sphere = vtk.vtkSphereSource()
+    sphere.SetRadius(10)
+    sphere.Update()
+    sphereModel = slicer.modules.models.logic().AddModel(sphere.GetOutput())
+    sphereTransform = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLLinearTransformNode')
+    sphereModel.SetAndObserveTransformNodeID(sphereTransform.GetID())
+    self.assertIsInstance(logic.getCollisionPair(sphereModel, cylinderModel), VRTutorialLib.AnalyticCollisionPair)
+    self.assertNotIsInstance(logic.getCollisionPair(sphereModel, femurModel), VRTutorialLib.AnalyticCollisionPair)
+    bounds = np.array(cylinderModel.GetPolyData().GetBounds()).reshape(3, 2)
+    center = bounds.mean(axis=1)
+    # sphere centered on the surface of the target, then far from it
+    for offset, expectedCollision in [(0.5, True), (2.0, False)]:
+      matrix = vtk.vtkMatrix4x4()
+      for axis in range(3):
+        matrix.SetElement(axis, 3, center[axis])
+      matrix.SetElement(0, 3, center[0] + offset * (bounds[0, 1] - bounds[0, 0]))
+      sphereTransform.SetMatrixTransformToParent(matrix)
+      meshCollision = VRTutorialLib.MeshCollisionPair(sphereModel, cylinderModel).check() > 0
+      analyticCollision, numberOfCollisions = logic.findMeshCollision(sphereModel, cylinderModel)
+      self.assertEqual(analyticCollision, expectedCollision)
+      self.assertEqual(meshCollision, expectedCollision)
 
     self.delayDisplay('Test passed')
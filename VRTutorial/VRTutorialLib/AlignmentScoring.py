@@ -0,0 +1,113 @@
+import numpy as np
+import vtk
+from vtk.util.numpy_support import vtk_to_numpy
+
+#
+# Surface sampling
+#
+
+def sampleSurfacePoints(polyData, maximumNumberOfPoints=1000):
+  """
+  Return at most maximumNumberOfPoints mesh points of polyData (N x 3 array), evenly spread over
+  the point list so that the sample does not depend on a random seed.
+  """
+  points = vtk_to_numpy(polyData.GetPoints().GetData()).astype(float)
+  if len(points) <= maximumNumberOfPoints:
+    return points
+  indices = np.linspace(0, len(points) - 1, maximumNumberOfPoints).round().astype(int)
+  return points[indices]
+
+#
+# AlignmentEvaluator
+#
+
+class AlignmentEvaluator(object):
+  """Measures how well a moving model is aligned with a target model, from the model to world
+  matrices only. Points sampled once on the moving mesh are paired with the same surface points of
+  the target mesh (the correspondence matrix maps moving mesh coordinates to target mesh
+  coordinates, identity if both nodes share the mesh). Per-point errors of all pairs are computed
+  with one matrix product, the RMS error from the precomputed second moments of the points.
+  """
+
+  def __init__(self, modelPoints, correspondenceMatrix=None, successThreshold=5.0, metric='rms'):
+    self.modelPoints = np.ascontiguousarray(modelPoints, dtype=float)
+    self.correspondenceMatrix = np.eye(4) if correspondenceMatrix is None else np.asarray(correspondenceMatrix, dtype=float)
+    # mean and second moment of the points, for the RMS error without per-point work
+    self.meanPoint = self.modelPoints.mean(axis=0)
+    self.secondMoment = self.modelPoints.T.dot(self.modelPoints) / len(self.modelPoints)
+    self.successThreshold = successThreshold
+    self.metric = metric
+    self._movingToWorldMatrix = vtk.vtkMatrix4x4()
+    self._targetToWorldMatrix = vtk.vtkMatrix4x4()
+
+  @classmethod
+  def fromPolyData(cls, polyData, correspondenceMatrix=None, maximumNumberOfPoints=1000, **kwargs):
+    return cls(sampleSurfacePoints(polyData, maximumNumberOfPoints), correspondenceMatrix, **kwargs)
+
+  def getErrors(self, movingToWorld, targetToWorld):
+    """
+    Distance between each moving point and its corresponding target point, in world coordinates.
+    """
+    difference = movingToWorld - targetToWorld.dot(self.correspondenceMatrix)
+    return np.linalg.norm(self.modelPoints.dot(difference[:3, :3].T) + difference[:3, 3], axis=1)
+
+  def getRMSError(self, movingToWorld, targetToWorld):
+    """
+    Root mean square of the point errors: mean |A p + b|^2 = trace(A S A^T) + 2 b.A m + |b|^2
+    with S and m the second moment and mean of the points.
+    """
+    difference = movingToWorld - targetToWorld.dot(self.correspondenceMatrix)
+    linear = difference[:3, :3]
+    translation = difference[:3, 3]
+    meanSquaredError = np.sum(linear.dot(self.secondMoment) * linear) + 2.0 * translation.dot(linear.dot(self.meanPoint)) + translation.dot(translation)
+    return float(np.sqrt(max(0.0, meanSquaredError)))
+
+  def getError(self, movingToWorld, targetToWorld):
+    """
+    Alignment error with the selected metric: 'rms' (root mean square of the point errors) or
+    'hausdorff' (maximum point error).
+    """
+    return float(self.getTrajectoryErrors(np.asarray(movingToWorld)[np.newaxis], targetToWorld)[0])
+
+  def getTrajectoryErrors(self, movingToWorlds, targetToWorld, chunkSize=None):
+    """
+    Alignment errors with the selected metric for N poses of the moving model (N x 4 x 4) and a
+    fixed target pose. Maximum point errors are computed over chunks of poses, so that the
+    temporary point arrays stay small.
+    """
+    differences = np.asarray(movingToWorlds, dtype=float) - targetToWorld.dot(self.correspondenceMatrix)
+    linear = differences[:, :3, :3]
+    translations = differences[:, :3, 3]
+    if self.metric == 'hausdorff':
+      if chunkSize is None:
+        chunkSize = max(1, 100000 // len(self.modelPoints))
+      errors = np.zeros(len(differences))
+      for start in range(0, len(differences), chunkSize):
+        pointErrors = np.einsum('nij,pj->npi', linear[start:start + chunkSize], self.modelPoints) + translations[start:start + chunkSize, np.newaxis]
+        errors[start:start + chunkSize] = np.linalg.norm(pointErrors, axis=2).max(axis=1)
+      return errors
+    # closed form of getRMSError for every pose
+    meanSquaredErrors = (np.einsum('nij,jk,nik->n', linear, self.secondMoment, linear)
+      + 2.0 * np.einsum('ni,nij,j->n', translations, linear, self.meanPoint)
+      + np.einsum('ni,ni->n', translations, translations))
+    return np.sqrt(np.maximum(meanSquaredErrors, 0.0))
+
+  def isAligned(self, error):
+    return error <= self.successThreshold
+
+  def evaluateNodes(self, movingModel, targetModel):
+    """
+    Return the alignment error of two model nodes, reading their parent transforms to world.
+    """
+    movingToWorld = self._getModelToWorld(movingModel, self._movingToWorldMatrix)
+    targetToWorld = self._getModelToWorld(targetModel, self._targetToWorldMatrix)
+    return self.getError(movingToWorld, targetToWorld)
+
+  @staticmethod
+  def _getModelToWorld(modelNode, vtkMatrix):
+    parentTransformNode = modelNode.GetParentTransformNode()
+    if parentTransformNode is None:
+      vtkMatrix.Identity()
+    else:
+      parentTransformNode.GetMatrixTransformToWorld(vtkMatrix)
+    return np.array([[vtkMatrix.GetElement(row, column) for column in range(4)] for row in range(4)])
@@ -0,0 +1,357 @@
+import abc
+import logging
+import numpy as np
+import vtk
+from vtk.util.numpy_support import vtk_to_numpy
+from .DistanceField import TargetDistanceField
+from .MeshCollision import MeshCollisionPair
+
+#
+# Mesh arrays
+#
+
+def getTriangleMesh(polyData):
+  """
+  Return the points (N x 3) and triangles (M x 3 point indices) of a mesh.
+  """
+  triangleFilter = vtk.vtkTriangleFilter()
+  triangleFilter.SetInputData(polyData)
+  triangleFilter.PassLinesOff()
+  triangleFilter.PassVertsOff()
+  triangleFilter.Update()
+  triangles = triangleFilter.GetOutput()
+  if triangles.GetNumberOfPoints() == 0:
+    return np.zeros((0, 3)), np.zeros((0, 3), dtype=np.int64)
+  points = vtk_to_numpy(triangles.GetPoints().GetData()).astype(float)
+  connectivity = vtk_to_numpy(triangles.GetPolys().GetConnectivityArray()).reshape(-1, 3)
+  return points, connectivity
+
+
+def getEdges(triangles):
+  """
+  Unique edges (K x 2 point indices) of triangles.
+  """
+  edges = np.concatenate([triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [2, 0]]])
+  return np.unique(np.sort(edges, axis=1), axis=0)
+
+
+def segmentsCrossTriangles(starts, ends, trianglePoints):
+  """
+  Test S segments against T triangles (T x 3 x 3 points) at once (Moller-Trumbore).
+  Returns an S x T boolean array.
+  """
+  directions = ends - starts
+  edges1 = trianglePoints[:, 1] - trianglePoints[:, 0]
+  edges2 = trianglePoints[:, 2] - trianglePoints[:, 0]
+  p = np.cross(directions[:, np.newaxis], edges2[np.newaxis])
+  determinants = np.einsum('tk,stk->st', edges1, p)
+  valid = np.abs(determinants) > 1e-12
+  inverses = np.where(valid, 1.0 / np.where(valid, determinants, 1.0), 0.0)
+  s = starts[:, np.newaxis] - trianglePoints[np.newaxis, :, 0]
+  u = np.einsum('stk,stk->st', s, p) * inverses
+  q = np.cross(s, edges1[np.newaxis])
+  v = np.einsum('sk,stk->st', directions, q) * inverses
+  t = np.einsum('tk,stk->st', edges2, q) * inverses
+  return valid & (u >= 0) & (v >= 0) & (u + v <= 1) & (t >= 0) & (t <= 1)
+
+#
+# Analytic shapes
+#
+
+class AnalyticShape(abc.ABC):
+  """Solid primitive in model coordinates, tested in closed form.
+  Shapes have the evaluate method of SignedDistanceField, so they can be used wherever a
+  distance field is expected (e.g. in a TargetDistanceField).
+  """
+
+  @abc.abstractmethod
+  def signedDistance(self, points):
+    """
+    Signed distances (negative inside) of points (N x 3).
+    """
+
+  @abc.abstractmethod
+  def intersectsSegments(self, starts, ends):
+    """
+    Whether each segment (starts and ends N x 3) intersects the shape.
+    """
+
+  @abc.abstractmethod
+  def getSkeletonSegments(self):
+    """
+    Segments of the shape (start and end points) that a mesh crossing the shape without
+    reaching it with its edges must cross.
+    """
+
+  def evaluate(self, points):
+    return self.signedDistance(np.atleast_2d(np.asarray(points, dtype=float)))
+
+  def containsPoints(self, points):
+    return self.evaluate(points) <= 0
+
+  def intersectsSpheres(self, centers, radii):
+    return self.evaluate(centers) <= radii
+
+  def countContacts(self, points, triangles, edges=None):
+    """
+    Number of contacts of a mesh (points in shape coordinates) with the shape: edges of the mesh
+    that reach the shape (which includes points inside it) plus triangles crossed by the shape
+    skeleton. A mesh that only grazes the shape by less than the size of its triangles may not
+    be in contact.
+    """
+    if len(triangles) == 0:
+      return 0
+    if edges is None:
+      edges = getEdges(triangles)
+    numberOfContacts = int(np.count_nonzero(self.intersectsSegments(points[edges[:, 0]], points[edges[:, 1]])))
+    starts, ends = self.getSkeletonSegments()
+    numberOfContacts += int(np.count_nonzero(segmentsCrossTriangles(starts, ends, points[triangles]).any(axis=0)))
+    return numberOfContacts
+
+
+def getFrameFromAxis(axis):
+  """
+  Orthonormal frame (rows) whose first axis is axis.
+  """
+  axis = axis / np.linalg.norm(axis)
+  other = np.eye(3)[np.argmin(np.abs(axis))]
+  second = np.cross(axis, other)
+  second /= np.linalg.norm(second)
+  return np.array([axis, second, np.cross(axis, second)])
+
+
+class AnalyticBox(AnalyticShape):
+  """Oriented box: center, axes (rows of a 3 x 3 rotation) and half sizes along the axes.
+  """
+
+  def __init__(self, center, axes, halfSizes):
+    self.center = np.asarray(center, dtype=float)
+    self.axes = np.asarray(axes, dtype=float)
+    self.halfSizes = np.asarray(halfSizes, dtype=float)
+
+  @classmethod
+  def fit(cls, points, axes):
+    """
+    Smallest box of the given axes that contains points.
+    """
+    localPoints = points.dot(axes.T)
+    lower = localPoints.min(axis=0)
+    upper = localPoints.max(axis=0)
+    return cls(((lower + upper) / 2.0).dot(axes), axes, (upper - lower) / 2.0)
+
+  def signedDistance(self, points):
+    q = np.abs((points - self.center).dot(self.axes.T)) - self.halfSizes
+    return np.linalg.norm(np.maximum(q, 0.0), axis=1) + np.minimum(q.max(axis=1), 0.0)
+
+  def intersectsSegments(self, starts, ends):
+    localStarts = (starts - self.center).dot(self.axes.T)
+    directions = (ends - starts).dot(self.axes.T)
+    # slab method, the segment is clipped to [0, 1] by each pair of planes
+    inSlabs = np.abs(localStarts) <= self.halfSizes
+    parallel = directions == 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+      t1 = (-self.halfSizes - localStarts) / directions
+      t2 = (self.halfSizes - localStarts) / directions
+    tNear = np.where(parallel, np.where(inSlabs, -np.inf, np.inf), np.minimum(t1, t2))
+    tFar = np.where(parallel, np.where(inSlabs, np.inf, -np.inf), np.maximum(t1, t2))
+    return np.maximum(tNear.max(axis=1), 0.0) <= np.minimum(tFar.min(axis=1), 1.0)
+
+  def getSkeletonSegments(self):
+    signs = np.array([[x, y, z] for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)], dtype=float)
+    corners = self.center + (signs * self.halfSizes).dot(self.axes)
+    # corners that differ by one sign
+    edges = [(i, j) for i in range(8) for j in range(i + 1, 8) if np.count_nonzero(signs[i] != signs[j]) == 1]
+    edges = np.array(edges)
+    return corners[edges[:, 0]], corners[edges[:, 1]]
+
+
+class AnalyticCylinder(AnalyticShape):
+  """Capped cylinder: center, unit axis, radius and half height along the axis.
+  """
+
+  def __init__(self, center, axis, radius, halfHeight):
+    self.center = np.asarray(center, dtype=float)
+    self.axis = np.asarray(axis, dtype=float) / np.linalg.norm(axis)
+    self.radius = float(radius)
+    self.halfHeight = float(halfHeight)
+
+  @classmethod
+  def fit(cls, points, axis):
+    """
+    Smallest cylinder of the given axis, centered on the bounding box of points, that contains
+    points.
+    """
+    frame = getFrameFromAxis(axis)
+    localPoints = points.dot(frame.T)
+    lower = localPoints.min(axis=0)
+    upper = localPoints.max(axis=0)
+    center = ((lower + upper) / 2.0).dot(frame)
+    radius = np.linalg.norm(localPoints[:, 1:] - (lower + upper)[1:] / 2.0, axis=1).max()
+    return cls(center, frame[0], radius, (upper[0] - lower[0]) / 2.0)
+
+  def getAxialAndRadial(self, points):
+    offsets = points - self.center
+    heights = offsets.dot(self.axis)
+    return heights, offsets - heights[:, np.newaxis] * self.axis
+
+  def signedDistance(self, points):
+    heights, radialOffsets = self.getAxialAndRadial(points)
+    q = np.stack([np.linalg.norm(radialOffsets, axis=1) - self.radius, np.abs(heights) - self.halfHeight], axis=1)
+    return np.linalg.norm(np.maximum(q, 0.0), axis=1) + np.minimum(q.max(axis=1), 0.0)
+
+  def intersectsSegments(self, starts, ends):
+    startHeights, startRadials = self.getAxialAndRadial(starts)
+    endHeights, endRadials = self.getAxialAndRadial(ends)
+    # part of the segment between the cap planes
+    heightChanges = endHeights - startHeights
+    inSlab = np.abs(startHeights) <= self.halfHeight
+    parallel = heightChanges == 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+      t1 = (-self.halfHeight - startHeights) / heightChanges
+      t2 = (self.halfHeight - startHeights) / heightChanges
+    tMin = np.maximum(np.where(parallel, np.where(inSlab, 0.0, np.inf), np.minimum(t1, t2)), 0.0)
+    tMax = np.minimum(np.where(parallel, np.where(inSlab, 1.0, -np.inf), np.maximum(t1, t2)), 1.0)
+    crossesSlab = tMin <= tMax
+    # segments outside the slab get finite bounds (their t bounds may be infinite), their closest
+    # point is not used
+    tMin = np.where(crossesSlab, tMin, 0.0)
+    tMax = np.where(crossesSlab, tMax, 0.0)
+    # closest point to the axis in that part: minimum of a quadratic in t
+    radialChanges = endRadials - startRadials
+    a = np.sum(radialChanges ** 2, axis=1)
+    b = np.sum(startRadials * radialChanges, axis=1)
+    tClosest = np.clip(-b / np.where(a > 0, a, 1.0), tMin, tMax)
+    closestRadials = startRadials + tClosest[:, np.newaxis] * radialChanges
+    return crossesSlab & (np.linalg.norm(closestRadials, axis=1) <= self.radius)
+
+  def getSkeletonSegments(self):
+    return (self.center - self.halfHeight * self.axis)[np.newaxis], (self.center + self.halfHeight * self.axis)[np.newaxis]
+
+
+def fitAnalyticShape(polyData, tolerance=0.02):
+  """
+  Fit a box or a cylinder to a mesh. Candidate axes are the principal axes of the points and the
+  normals of the largest faces. Returns the shape whose surface is the closest to the mesh
+  points and triangle centers, None if it is farther than tolerance (fraction of the mesh size)
+  from any of them, i.e. the mesh is not one of these primitives.
+  """
+  points, triangles = getTriangleMesh(polyData)
+  if len(triangles) == 0:
+    return None
+  size = float((points.max(axis=0) - points.min(axis=0)).max())
+  if size <= 0:
+    return None
+  frames = [np.linalg.svd(points - points.mean(axis=0), full_matrices=False)[2]]
+  crossProducts = np.cross(points[triangles[:, 1]] - points[triangles[:, 0]], points[triangles[:, 2]] - points[triangles[:, 0]])
+  areas = np.linalg.norm(crossProducts, axis=1)
+  normals = crossProducts / np.where(areas > 0, areas, 1.0)[:, np.newaxis]
+  first = normals[np.argmax(areas)]
+  perpendicular = np.abs(normals.dot(first)) < 0.01
+  if np.any(perpendicular):
+    second = normals[perpendicular][np.argmax(areas[perpendicular])]
+    second = second - second.dot(first) * first
+    second /= np.linalg.norm(second)
+    frames.append(np.array([first, second, np.cross(first, second)]))
+  candidates = [AnalyticBox.fit(points, frame) for frame in frames]
+  candidates += [AnalyticCylinder.fit(points, axis) for frame in frames for axis in frame]
+  # triangle centers reject shapes that only pass through the mesh points (e.g. a cylinder
+  # through the corners of a box)
+  surfacePoints = np.concatenate([points, points[triangles].mean(axis=1)])
+  errors = [float(np.abs(shape.signedDistance(surfacePoints)).max()) for shape in candidates]
+  bestIndex = int(np.argmin(errors))
+  if errors[bestIndex] > tolerance * size:
+    return None
+  return candidates[bestIndex]
+
+#
+# AnalyticTargetCache
+#
+
+class AnalyticTargetCache(object):
+  """Analytic shapes of target models, fitted once per mesh (see fitAnalyticShape) or declared
+  with setShape. Models that are not primitives have no shape, their collisions use the mesh test.
+  """
+
+  def __init__(self, tolerance=0.02):
+    self.tolerance = tolerance
+    # node ID -> (model node, polydata, polydata MTime, shape)
+    self.fittedShapes = {}
+    self.declaredShapes = {}
+    self.targetDistanceFields = {}
+
+  def setShape(self, targetModel, shape):
+    """
+    Declare the shape of a target model, in model coordinates. The mesh is not fitted.
+    """
+    self.declaredShapes[targetModel.GetID()] = (targetModel, shape)
+
+  def getShape(self, targetModel):
+    """
+    Return the analytic shape of a target model, None if the model is not a primitive.
+    """
+    declaredShape = self.declaredShapes.get(targetModel.GetID())
+    if declaredShape is not None and declaredShape[0] is targetModel:
+      return declaredShape[1]
+    polyData = targetModel.GetPolyData()
+    if polyData is None or polyData.GetNumberOfPoints() == 0:
+      return None
+    fittedShape = self.fittedShapes.get(targetModel.GetID())
+    if fittedShape is None or fittedShape[0] is not targetModel or fittedShape[1] is not polyData or fittedShape[2] != polyData.GetMTime():
+      shape = fitAnalyticShape(polyData, self.tolerance)
+      if shape is not None:
+        logging.info('{0} is tested as an analytic {1}'.format(targetModel.GetName(), type(shape).__name__))
+      fittedShape = (targetModel, polyData, polyData.GetMTime(), shape)
+      self.fittedShapes[targetModel.GetID()] = fittedShape
+    return fittedShape[3]
+
+  def getTargetDistanceField(self, targetModel):
+    """
+    Return the exact distance field of a target model (a TargetDistanceField of its shape), None
+    if the model is not a primitive.
+    """
+    shape = self.getShape(targetModel)
+    if shape is None:
+      return None
+    targetDistanceField = self.targetDistanceFields.get(targetModel.GetID())
+    if targetDistanceField is None or targetDistanceField.targetModel is not targetModel or targetDistanceField.distanceField is not shape:
+      targetDistanceField = TargetDistanceField(targetModel, shape)
+      self.targetDistanceFields[targetModel.GetID()] = targetDistanceField
+    return targetDistanceField
+
+  def clear(self):
+    """
+    Forget the fitted shapes, declared shapes are kept.
+    """
+    self.fittedShapes = {}
+    self.targetDistanceFields = {}
+
+#
+# AnalyticCollisionPair
+#
+
+class AnalyticCollisionPair(MeshCollisionPair):
+  """Collision test of a model (node1) against a target (node2) with an analytic shape: the mesh
+  of the model (or its proxy) is tested against the shape in closed form, instead of against the
+  target mesh. Inputs, matrices and broad phase are the ones of MeshCollisionPair.
+  """
+
+  def __init__(self, node1, node2, shape, proxyCache=None):
+    MeshCollisionPair.__init__(self, node1, node2, proxyCache)
+    self.shape = shape
+    self._mesh = None
+
+  def getMesh(self):
+    """
+    Points, triangles and edges of the tested mesh of node1, updated when the mesh changes.
+    """
+    polyData = self._collisionPolyData[0]
+    if self._mesh is None or self._mesh[0] is not polyData or self._mesh[1] != polyData.GetMTime():
+      points, triangles = getTriangleMesh(polyData)
+      self._mesh = (polyData, polyData.GetMTime(), points, triangles, getEdges(triangles))
+    return self._mesh[2:]
+
+  def _testMeshes(self):
+    points, triangles, edges = self.getMesh()
+    matrices = [np.array([[matrix.GetElement(row, column) for column in range(4)] for row in range(4)]) for matrix in self.matrices]
+    modelToTarget = np.linalg.inv(matrices[1]).dot(matrices[0])
+    return self.shape.countContacts(points.dot(modelToTarget[:3, :3].T) + modelToTarget[:3, 3], triangles, edges)
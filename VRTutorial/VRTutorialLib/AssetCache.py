@@ -0,0 +1,272 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import vtk, slicer
+
+#
+# AssetCache
+#
+
+class AssetCache(object):
+  """Binary cache of the models and images loaded by the tutorial.
+  The first time a resource is used it is loaded with the regular Slicer readers and the
+  resulting data (already converted to RAS) is stored as compressed binary VTK XML (VTP for
+  meshes, VTI for images), named after the SHA-256 of the source file. Later loads read the
+  cached file directly, which is much faster than parsing legacy VTK, STL or OBJ.
+  Source file hashes are remembered by file size and modification time so that unchanged
+  files are not hashed again. The cache is limited in size, least recently used entries are
+  removed first.
+  The index is modified under a lock and only marked as modified; it is written once by
+  flushIndex at the end of a batch of loads instead of on every access.
+  """
+
+  INDEX_FILE_NAME = 'index.json'
+  SOURCE_FILE_ATTRIBUTE = 'VRTutorial.SourceFilePath'
+
+  def __init__(self, cacheDirectory=None, maximumSizeBytes=512 * 1024 * 1024):
+    if cacheDirectory is None:
+      cacheDirectory = os.path.join(slicer.app.cachePath, 'VRTutorial', 'Assets')
+    self.cacheDirectory = cacheDirectory
+    self.maximumSizeBytes = maximumSizeBytes
+    self.enabled = True
+    self.index = {'sourceFiles': {}, 'entries': {}}
+    self.indexModified = False
+    self.lock = threading.RLock()
+    try:
+      if not os.path.exists(self.cacheDirectory):
+        os.makedirs(self.cacheDirectory)
+      self.readIndex()
+    except (OSError, ValueError) as e:
+      logging.warning('Asset cache disabled, {0} cannot be used: {1}'.format(self.cacheDirectory, e))
+      self.enabled = False
+
+  def readIndex(self):
+    indexFilePath = os.path.join(self.cacheDirectory, self.INDEX_FILE_NAME)
+    if os.path.exists(indexFilePath):
+      with open(indexFilePath, 'r') as file:
+        self.index = json.load(file)
+    # Forget entries whose files were removed outside of the cache
+    self.index['entries'] = {entryName: entry for entryName, entry in self.index['entries'].items()
+      if os.path.exists(os.path.join(self.cacheDirectory, entryName))}
+
+  def writeIndex(self):
+    indexFilePath = os.path.join(self.cacheDirectory, self.INDEX_FILE_NAME)
+    temporaryFilePath = indexFilePath + '.tmp'
+    with self.lock:
+      with open(temporaryFilePath, 'w') as file:
+        json.dump(self.index, file)
+      os.replace(temporaryFilePath, indexFilePath)
+      self.indexModified = False
+
+  def flushIndex(self):
+    """
+    Write the index if it was modified since it was last written.
+    """
+    with self.lock:
+      if not self.indexModified or not self.enabled:
+        return
+      try:
+        self.writeIndex()
+      except OSError as e:
+        logging.warning('Asset cache index could not be written: {0}'.format(e))
+
+  def fileHash(self, filePath):
+    """
+    Return the SHA-256 of the file content. Unchanged files (same size and modification time)
+    are not read again.
+    """
+    fileStat = os.stat(filePath)
+    sourceFilePath = os.path.abspath(filePath)
+    with self.lock:
+      sourceFile = self.index['sourceFiles'].get(sourceFilePath)
+    if sourceFile and sourceFile['size'] == fileStat.st_size and sourceFile['mtime'] == fileStat.st_mtime_ns:
+      return sourceFile['hash']
+    sha256 = hashlib.sha256()
+    with open(filePath, 'rb') as file:
+      for chunk in iter(lambda: file.read(1024 * 1024), b''):
+        sha256.update(chunk)
+    fileHash = sha256.hexdigest()
+    with self.lock:
+      self.index['sourceFiles'][sourceFilePath] = {'size': fileStat.st_size, 'mtime': fileStat.st_mtime_ns, 'hash': fileHash}
+      self.indexModified = True
+    return fileHash
+
+  def getEntryFilePath(self, filePath, extension):
+    return os.path.join(self.cacheDirectory, self.fileHash(filePath) + extension)
+
+  def loadModel(self, filePath, nodeName=None):
+    """
+    Load a model file into a new model node, from the cache if available.
+    """
+    if nodeName is None:
+      nodeName = os.path.splitext(os.path.basename(filePath))[0]
+    if not self.enabled:
+      modelNode = slicer.util.loadModel(filePath)
+      modelNode.SetName(nodeName)
+      modelNode.SetAttribute(self.SOURCE_FILE_ATTRIBUTE, os.path.abspath(filePath))
+      return modelNode
+    startTime = time.perf_counter()
+    entryFilePath = self.getEntryFilePath(filePath, '.vtp')
+    polyData = self.readCachedData(entryFilePath, vtk.vtkXMLPolyDataReader())
+    if polyData is not None:
+      modelNode = self.addModelNode(polyData, filePath, nodeName)
+      cached = True
+    else:
+      modelNode = slicer.util.loadModel(filePath)
+      modelNode.SetName(nodeName)
+      modelNode.SetAttribute(self.SOURCE_FILE_ATTRIBUTE, os.path.abspath(filePath))
+      self.writeCachedData(entryFilePath, vtk.vtkXMLPolyDataWriter(), modelNode.GetPolyData(), {'type': 'model'})
+      cached = False
+    self.touch(entryFilePath)
+    logging.debug('Loaded {0} in {1:.3f} s ({2})'.format(filePath, time.perf_counter() - startTime, 'cached' if cached else 'not cached'))
+    return modelNode
+
+  def addModelNode(self, polyData, filePath, nodeName):
+    """
+    Create a model node with display node for a mesh read from filePath (or from its cache entry).
+    """
+    modelNode = slicer.modules.models.logic().AddModel(polyData)
+    modelNode.SetName(nodeName)
+    modelNode.SetAttribute(self.SOURCE_FILE_ATTRIBUTE, os.path.abspath(filePath))
+    return modelNode
+
+  def loadVolume(self, filePath, nodeName=None):
+    """
+    Load an image file into a new volume node, from the cache if available.
+    """
+    if nodeName is None:
+      nodeName = os.path.splitext(os.path.basename(filePath))[0]
+    if not self.enabled:
+      volumeNode = slicer.util.loadVolume(filePath)
+      volumeNode.SetName(nodeName)
+      volumeNode.SetAttribute(self.SOURCE_FILE_ATTRIBUTE, os.path.abspath(filePath))
+      return volumeNode
+    startTime = time.perf_counter()
+    entryFilePath = self.getEntryFilePath(filePath, '.vti')
+    imageData = self.readCachedData(entryFilePath, vtk.vtkXMLImageDataReader())
+    with self.lock:
+      entry = self.index['entries'].get(os.path.basename(entryFilePath))
+    if imageData is not None and entry is not None:
+      volumeNode = slicer.mrmlScene.AddNewNodeByClass(entry['volumeClassName'], nodeName)
+      volumeNode.SetAndObserveImageData(imageData)
+      ijkToRAS = vtk.vtkMatrix4x4()
+      ijkToRAS.DeepCopy(entry['ijkToRAS'])
+      volumeNode.SetIJKToRASMatrix(ijkToRAS)
+      volumeNode.CreateDefaultDisplayNodes()
+      cached = True
+    else:
+      volumeNode = slicer.util.loadVolume(filePath)
+      volumeNode.SetName(nodeName)
+      ijkToRAS = vtk.vtkMatrix4x4()
+      volumeNode.GetIJKToRASMatrix(ijkToRAS)
+      # Geometry is kept in the node (IJK to RAS), store it along with the image
+      imageData = vtk.vtkImageData()
+      imageData.ShallowCopy(volumeNode.GetImageData())
+      imageData.SetOrigin(0, 0, 0)
+      imageData.SetSpacing(1, 1, 1)
+      self.writeCachedData(entryFilePath, vtk.vtkXMLImageDataWriter(), imageData,
+        {'type': 'volume', 'volumeClassName': volumeNode.GetClassName(), 'ijkToRAS': [ijkToRAS.GetElement(i // 4, i % 4) for i in range(16)]})
+      cached = False
+    volumeNode.SetAttribute(self.SOURCE_FILE_ATTRIBUTE, os.path.abspath(filePath))
+    self.touch(entryFilePath)
+    logging.debug('Loaded {0} in {1:.3f} s ({2})'.format(filePath, time.perf_counter() - startTime, 'cached' if cached else 'not cached'))
+    return volumeNode
+
+  def readCachedData(self, entryFilePath, reader):
+    if not os.path.exists(entryFilePath):
+      return None
+    reader.SetFileName(entryFilePath)
+    reader.Update()
+    if reader.GetErrorCode():
+      logging.warning('Invalid asset cache entry ' + entryFilePath)
+      return None
+    data = reader.GetOutputDataObject(0).NewInstance()
+    data.ShallowCopy(reader.GetOutputDataObject(0))
+    return data
+
+  def writeCachedData(self, entryFilePath, writer, data, entry):
+    if self.writeEntryFile(entryFilePath, writer, data):
+      self.registerEntry(entryFilePath, entry)
+
+  @staticmethod
+  def writeEntryFile(entryFilePath, writer, data):
+    """
+    Write a cache entry file. Does not modify the index, so it can be called from worker threads.
+    """
+    writer.SetFileName(entryFilePath)
+    writer.SetInputData(data)
+    writer.SetDataModeToBinary()
+    writer.SetCompressorTypeToLZ4()
+    if not writer.Write():
+      logging.warning('Asset cache entry could not be written to ' + entryFilePath)
+      return False
+    return True
+
+  def registerEntry(self, entryFilePath, entry):
+    """
+    Add a written entry file to the index, evicting old entries if the cache is too large.
+    """
+    entry['size'] = os.path.getsize(entryFilePath)
+    entry['lastAccess'] = time.time()
+    with self.lock:
+      self.index['entries'][os.path.basename(entryFilePath)] = entry
+      self.indexModified = True
+      self.evict()
+
+  def touch(self, entryFilePath):
+    """
+    Mark an entry as used now. The index is written by the next flushIndex.
+    """
+    with self.lock:
+      entry = self.index['entries'].get(os.path.basename(entryFilePath))
+      if entry is not None:
+        entry['lastAccess'] = time.time()
+        self.indexModified = True
+
+  def getMetadata(self, key):
+    """
+    Return a value stored in the cache index with setMetadata, None if not set.
+    """
+    with self.lock:
+      return self.index.setdefault('metadata', {}).get(key)
+
+  def setMetadata(self, key, value):
+    """
+    Store a small JSON serializable value derived from source files (e.g. keyed by file hashes).
+    """
+    with self.lock:
+      self.index.setdefault('metadata', {})[key] = value
+      self.indexModified = True
+
+  def getSize(self):
+    with self.lock:
+      return sum(entry['size'] for entry in self.index['entries'].values())
+
+  def evict(self, maximumSizeBytes=None):
+    """
+    Remove least recently used entries until the cache is within maximumSizeBytes.
+    """
+    if maximumSizeBytes is None:
+      maximumSizeBytes = self.maximumSizeBytes
+    with self.lock:
+      entries = sorted(self.index['entries'].items(), key=lambda item: item[1].get('lastAccess', 0))
+      totalSize = self.getSize()
+      for entryName, entry in entries:
+        if totalSize <= maximumSizeBytes:
+          break
+        try:
+          os.remove(os.path.join(self.cacheDirectory, entryName))
+        except OSError:
+          pass
+        totalSize -= entry['size']
+        del self.index['entries'][entryName]
+        self.indexModified = True
+
+  def clear(self):
+    with self.lock:
+      self.evict(0)
+      self.index['sourceFiles'] = {}
+      self.writeIndex()
@@ -0,0 +1,201 @@
+import concurrent.futures
+import logging
+import os
+import time
+import qt, vtk, slicer
+
+#
+# Model file reading (thread safe, no MRML scene access)
+#
+
+def readFileHeader(filePath, extension):
+  """
+  Return the text header of a model file, where Slicer records the coordinate system (SPACE=RAS/LPS).
+  """
+  if extension == '.stl':
+    with open(filePath, 'rb') as file:
+      return file.read(80).decode('latin-1')
+  with open(filePath, 'rb') as file:
+    lines = []
+    for line in file:
+      line = line.decode('latin-1').strip()
+      if extension == '.vtk' and len(lines) < 2:
+        lines.append(line)
+      elif extension == '.obj' and line.startswith('#'):
+        lines.append(line)
+      else:
+        break
+    return '\n'.join(lines)
+
+
+def readModelFile(filePath):
+  """
+  Read a VTK, VTP, STL or OBJ file into a polydata in RAS coordinates, the same way the Slicer model
+  storage node does (files without SPACE=RAS in their header are assumed to be LPS).
+  Returns None if the file type is not supported or the file cannot be read.
+  """
+  extension = os.path.splitext(filePath)[1].lower()
+  readerClasses = {'.vtk': vtk.vtkPolyDataReader, '.vtp': vtk.vtkXMLPolyDataReader, '.stl': vtk.vtkSTLReader, '.obj': vtk.vtkOBJReader}
+  if extension not in readerClasses:
+    return None
+  reader = readerClasses[extension]()
+  reader.SetFileName(filePath)
+  reader.Update()
+  if reader.GetErrorCode() or reader.GetOutput().GetNumberOfPoints() == 0:
+    return None
+  polyData = reader.GetOutput()
+  if extension != '.vtp' and 'SPACE=RAS' not in readFileHeader(filePath, extension):
+    lpsToRas = vtk.vtkTransform()
+    lpsToRas.Scale(-1.0, -1.0, 1.0)
+    transformFilter = vtk.vtkTransformPolyDataFilter()
+    transformFilter.SetTransform(lpsToRas)
+    transformFilter.SetInputData(polyData)
+    transformFilter.Update()
+    polyData = transformFilter.GetOutput()
+  result = vtk.vtkPolyData()
+  result.ShallowCopy(polyData)
+  return result
+
+#
+# AssetLoader
+#
+
+class AssetLoader(object):
+  """Loads tutorial assets in the background.
+  Files are read and parsed concurrently on a thread pool (from the asset cache when available,
+  new cache entries are also written by the workers). Creation of MRML nodes, which is not
+  thread safe, is done on the main thread from a QTimer, a few assets per tick so that the
+  application stays responsive.
+  Assets have a priority: nodes of a priority are only created after all assets with a lower
+  priority value, so that for example the avatar appears before the interaction models.
+  Tasks that must run on the main thread entirely (e.g. loading a volume with Slicer readers)
+  can be added as well.
+  """
+
+  def __init__(self, assetCache=None, maximumNumberOfWorkers=4, timeBudgetPerTickSeconds=0.02):
+    self.assetCache = assetCache
+    self.maximumNumberOfWorkers = maximumNumberOfWorkers
+    self.timeBudgetPerTickSeconds = timeBudgetPerTickSeconds
+    self.jobs = []
+    self.executor = None
+    self.progressCallback = None
+    self.finishedCallback = None
+    self.numberOfCompletedJobs = 0
+    self.timer = qt.QTimer()
+    self.timer.setInterval(10)
+    self.timer.timeout.connect(self.onTimeout)
+
+  def addModel(self, filePath, nodeName=None, priority=0, loadedCallback=None):
+    """
+    Add a model file to load. loadedCallback(modelNode) is called on the main thread once the node is created.
+    """
+    if nodeName is None:
+      nodeName = os.path.splitext(os.path.basename(filePath))[0]
+    self.jobs.append({'type': 'model', 'filePath': filePath, 'nodeName': nodeName, 'priority': priority,
+      'loadedCallback': loadedCallback, 'future': None})
+
+  def addMainThreadTask(self, task, description, priority=0):
+    """
+    Add a function that is called on the main thread (without arguments) in priority order.
+    """
+    self.jobs.append({'type': 'task', 'task': task, 'nodeName': description, 'priority': priority,
+      'loadedCallback': None, 'future': None})
+
+  def getNumberOfJobs(self):
+    return len(self.jobs)
+
+  def isLoading(self):
+    return self.timer.isActive()
+
+  def start(self, progressCallback=None, finishedCallback=None):
+    """
+    Start loading. progressCallback(numberOfCompletedJobs, numberOfJobs, description) is called
+    after each asset, finishedCallback() after the last one.
+    """
+    self.progressCallback = progressCallback
+    self.finishedCallback = finishedCallback
+    self.numberOfCompletedJobs = 0
+    # Stable sort, assets of the same priority keep the order they were added in
+    self.jobs.sort(key=lambda job: job['priority'])
+    self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.maximumNumberOfWorkers)
+    for job in self.jobs:
+      if job['type'] == 'model':
+        # Hashes are computed here because the cache index is only modified on the main thread
+        job['entryFilePath'] = self.assetCache.getEntryFilePath(job['filePath'], '.vtp') if self.assetCache and self.assetCache.enabled else None
+        job['future'] = self.executor.submit(self.readModel, job['filePath'], job['entryFilePath'])
+    self.timer.start()
+
+  def cancel(self):
+    self.timer.stop()
+    if self.executor is not None:
+      for job in self.jobs:
+        if job['future'] is not None:
+          job['future'].cancel()
+      self.executor.shutdown(wait=False)
+      self.executor = None
+    self.jobs = []
+
+  def readModel(self, filePath, entryFilePath):
+    """
+    Runs on a worker thread. Returns the polydata and the cache entry to register (None if read from cache).
+    """
+    if entryFilePath and os.path.exists(entryFilePath):
+      polyData = self.assetCache.readCachedData(entryFilePath, vtk.vtkXMLPolyDataReader())
+      if polyData is not None:
+        return polyData, None
+    polyData = readModelFile(filePath)
+    if polyData is None or not entryFilePath:
+      return polyData, None
+    if self.assetCache.writeEntryFile(entryFilePath, vtk.vtkXMLPolyDataWriter(), polyData):
+      return polyData, {'type': 'model'}
+    return polyData, None
+
+  def onTimeout(self):
+    startTime = time.perf_counter()
+    while self.numberOfCompletedJobs < len(self.jobs):
+      job = self.jobs[self.numberOfCompletedJobs]
+      if job['future'] is not None and not job['future'].done():
+        # Wait for this asset, later ones must not be shown before it
+        break
+      try:
+        self.completeJob(job)
+      except Exception as e:
+        logging.error('Failed to load {0}: {1}'.format(job['nodeName'], e))
+      self.numberOfCompletedJobs += 1
+      if self.progressCallback:
+        self.progressCallback(self.numberOfCompletedJobs, len(self.jobs), job['nodeName'])
+      if time.perf_counter() - startTime > self.timeBudgetPerTickSeconds:
+        break
+    if self.numberOfCompletedJobs >= len(self.jobs):
+      self.timer.stop()
+      self.executor.shutdown(wait=False)
+      self.executor = None
+      self.jobs = []
+      if self.assetCache is not None:
+        # accesses of the whole batch are written at once
+        self.assetCache.flushIndex()
+      if self.finishedCallback:
+        self.finishedCallback()
+
+  def completeJob(self, job):
+    if job['type'] == 'task':
+      job['task']()
+      return
+    polyData, newEntry = job['future'].result()
+    if polyData is not None:
+      if self.assetCache is not None:
+        modelNode = self.assetCache.addModelNode(polyData, job['filePath'], job['nodeName'])
+        if job['entryFilePath']:
+          if newEntry is not None:
+            self.assetCache.registerEntry(job['entryFilePath'], newEntry)
+          self.assetCache.touch(job['entryFilePath'])
+      else:
+        modelNode = slicer.modules.models.logic().AddModel(polyData)
+        modelNode.SetName(job['nodeName'])
+    elif self.assetCache is not None:
+      # File type not supported by the worker reader, use the Slicer readers on the main thread
+      modelNode = self.assetCache.loadModel(job['filePath'], job['nodeName'])
+    else:
+      modelNode = slicer.util.loadModel(job['filePath'])
+    if job['loadedCallback']:
+      job['loadedCallback'](modelNode)
@@ -0,0 +1,275 @@
+import concurrent.futures
+import contextlib
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import time
+import numpy as np
+import vtk, slicer
+from . import VRTutorialBatchWorker
+from .TrackingRecording import DEVICE_NAMES, readTrackingFile
+
+#
+# Simulated trainees
+#
+
+def rotationMatrices(axis, angles):
+  """
+  Return the rotation matrices (N x 3 x 3) about a unit axis for an array of angles (radians).
+  """
+  x, y, z = axis
+  crossProductMatrix = np.array([[0.0, -z, y], [z, 0.0, -x], [-y, x, 0.0]])
+  sines = np.sin(angles)[:, np.newaxis, np.newaxis]
+  cosines = np.cos(angles)[:, np.newaxis, np.newaxis]
+  return np.eye(3) + sines * crossProductMatrix + (1.0 - cosines) * crossProductMatrix.dot(crossProductMatrix)
+
+
+def makeSimulatedTrainee(name, randomGenerator, headStartToWorld, headTargetPosition, femurStartToWorld, femurAlignedToWorld,
+    duration=30.0, sampleRateHz=90.0, tremorMm=1.5):
+  """
+  Return a synthetic trajectory of a trainee who moves the head from headStartToWorld toward
+  headTargetPosition and the femur from femurStartToWorld toward femurAlignedToWorld. Reaction
+  time, speed, how far the motion goes (some trainees stop short) and the hand tremor are random.
+  If femurStartToWorld or femurAlignedToWorld is None, only the head moves (femurToWorld is None).
+  """
+  times = np.arange(0.0, duration, 1.0 / sampleRateHz)
+  numberOfSamples = len(times)
+
+  def progress():
+    # smooth motion starting after a reaction time, ending between 80 and 105 % of the way
+    startTime = randomGenerator.uniform(0.5, 3.0)
+    motionDuration = randomGenerator.uniform(2.0, duration - startTime)
+    fraction = np.clip((times - startTime) / motionDuration, 0.0, 1.0)
+    return randomGenerator.uniform(0.8, 1.05) * fraction * fraction * (3.0 - 2.0 * fraction)
+
+  def tremor():
+    # low-pass filtered random walk
+    steps = randomGenerator.normal(0.0, tremorMm, (numberOfSamples, 3))
+    kernel = np.ones(int(sampleRateHz / 4)) / int(sampleRateHz / 4)
+    return np.stack([np.convolve(steps[:, axis], kernel, mode='same') for axis in range(3)], axis=1)
+
+  headToWorld = np.tile(np.asarray(headStartToWorld, dtype=float), (numberOfSamples, 1, 1))
+  headTranslation = np.asarray(headTargetPosition, dtype=float) - headToWorld[0, :3, 3]
+  headToWorld[:, :3, 3] += progress()[:, np.newaxis] * headTranslation + tremor()
+
+  if femurStartToWorld is None or femurAlignedToWorld is None:
+    return {'name': name, 'times': times, 'headToWorld': headToWorld, 'femurToWorld': None}
+  femurStartToWorld = np.asarray(femurStartToWorld, dtype=float)
+  femurAlignedToWorld = np.asarray(femurAlignedToWorld, dtype=float)
+  femurProgress = progress()
+  # rotation from the start to the aligned orientation, applied progressively about its axis
+  relativeRotation = femurAlignedToWorld[:3, :3].dot(femurStartToWorld[:3, :3].T)
+  angle = np.arccos(np.clip((np.trace(relativeRotation) - 1.0) / 2.0, -1.0, 1.0))
+  axis = np.array([relativeRotation[2, 1] - relativeRotation[1, 2], relativeRotation[0, 2] - relativeRotation[2, 0], relativeRotation[1, 0] - relativeRotation[0, 1]])
+  axis = axis / np.linalg.norm(axis) if np.linalg.norm(axis) > 1e-9 else np.array([0.0, 0.0, 1.0])
+  femurToWorld = np.tile(np.eye(4), (numberOfSamples, 1, 1))
+  femurToWorld[:, :3, :3] = np.einsum('nij,jk->nik', rotationMatrices(axis, femurProgress * angle), femurStartToWorld[:3, :3])
+  femurToWorld[:, :3, 3] = (femurStartToWorld[:3, 3] + femurProgress[:, np.newaxis] * (femurAlignedToWorld[:3, 3] - femurStartToWorld[:3, 3])
+    + tremor())
+  return {'name': name, 'times': times, 'headToWorld': headToWorld, 'femurToWorld': femurToWorld}
+
+#
+# BatchEvaluator
+#
+
+class BatchEvaluator(object):
+  """Runs many trajectories (simulated trainees or tracking recordings) through the success logic of
+  the tutorial tasks, to compare outcomes of task thresholds without the module widget or a VR headset.
+  The geometry (collision meshes, femur sample points and correspondence) and the collision and
+  alignment settings are taken from a VRTutorialLogic once, sent to each worker process once, and
+  trajectories are spread over a process pool. Workers evaluate every trajectory sample with the
+  success predicates of the logic (see TargetContactPredicate and AlignmentEvaluator). With maximumNumberOfWorkers=0, trajectories are evaluated in this process.
+  """
+
+  def __init__(self, logic, maximumNumberOfWorkers=None, alignmentThresholds=(2.0, 5.0, 10.0)):
+    self.logic = logic
+    self.maximumNumberOfWorkers = os.cpu_count() if maximumNumberOfWorkers is None else maximumNumberOfWorkers
+    self.alignmentThresholds = list(alignmentThresholds)
+    self.trajectories = []
+    self.results = []
+    self.elapsedTimeSeconds = 0.0
+
+  def loadModels(self):
+    """
+    Load the models of the head and tutorial task models through the logic (no VR connection needed).
+    """
+    for modelDefinition in self.logic.modelDefinitions:
+      if modelDefinition['attributeName'] in ['headModel', 'cylinderModel', 'femurModel', 'femurModelCopy']:
+        self.logic.loadModel(modelDefinition)
+
+  @staticmethod
+  def getModelToWorld(modelNode):
+    matrix = vtk.vtkMatrix4x4()
+    if modelNode.GetParentTransformNode() is not None:
+      modelNode.GetParentTransformNode().GetMatrixTransformToWorld(matrix)
+    return slicer.util.arrayFromVTKMatrix(matrix)
+
+  def getCollisionPolyData(self, modelNode):
+    proxyPolyData = self.logic.collisionProxyCache.getProxyPolyData(modelNode) if self.logic.useCollisionProxies else None
+    return proxyPolyData if proxyPolyData is not None else modelNode.GetPolyData()
+
+  def getGeometry(self):
+    """
+    Return the task geometry and the collision and alignment settings of the logic as plain arrays
+    and picklable objects (distance fields, analytic shapes), to initialize the workers.
+    """
+    self.loadModels()
+    logic = self.logic
+    alignmentEvaluator = logic.getAlignmentEvaluator()
+    geometry = {
+      'head': VRTutorialBatchWorker.arraysFromPolyData(self.getCollisionPolyData(logic.headModel)),
+      'cylinder': VRTutorialBatchWorker.arraysFromPolyData(self.getCollisionPolyData(logic.cylinderModel)),
+      'cylinderToWorld': self.getModelToWorld(logic.cylinderModel),
+      'cylinderShape': logic.analyticTargetCache.getShape(logic.cylinderModel) if logic.useAnalyticTargets else None,
+      'cylinderDistanceField': None,
+      'continuousCollision': logic.useContinuousCollision,
+      }
+    if logic.useDistanceFields:
+      probeSphere = logic.getProbeSphere(logic.headModel)
+      geometry.update({
+        'cylinderDistanceField': logic.getTargetDistanceField(logic.cylinderModel).distanceField,
+        'headProbeSphere': {'center': probeSphere.center, 'radius': probeSphere.radius},
+        })
+    if alignmentEvaluator is not None:
+      geometry.update({
+        'femurPoints': alignmentEvaluator.modelPoints,
+        'correspondenceMatrix': alignmentEvaluator.correspondenceMatrix,
+        'femurCopyToWorld': self.getModelToWorld(logic.femurModelCopy),
+        'alignmentMetric': alignmentEvaluator.metric,
+        })
+    return geometry
+
+  def addTrajectory(self, name, times, headToWorld=None, femurToWorld=None):
+    self.trajectories.append({'name': name, 'times': np.asarray(times, dtype=float),
+      'headToWorld': headToWorld, 'femurToWorld': femurToWorld})
+
+  def addTrackingRecording(self, filePath):
+    """
+    Add the HMD motion of a tracking recording (see TrackingRecorder) as a trajectory.
+    """
+    deviceNames, samples = readTrackingFile(filePath)
+    headSamples = samples[samples['device'] == deviceNames.index(DEVICE_NAMES[0])]
+    headToWorld = np.tile(np.eye(4), (len(headSamples), 1, 1))
+    headToWorld[:, :3, :] = headSamples['matrix'].reshape(-1, 3, 4)
+    self.addTrajectory(os.path.basename(filePath), headSamples['time'], headToWorld=headToWorld)
+
+  def addSimulatedTrainees(self, numberOfTrainees, seed=0, **kwargs):
+    """
+    Add trajectories of simulated trainees that start 1 m in front of the cylinder with the femur
+    where it is loaded, and try to reach the cylinder and to align the femur with its copy.
+    If the femur alignment cannot be scored (see VRTutorialLogic.getAlignmentEvaluator), trainees
+    only move the head.
+    """
+    self.loadModels()
+    logic = self.logic
+    randomGenerator = np.random.default_rng(seed)
+    headBounds = np.array(logic.headModel.GetPolyData().GetBounds()).reshape(3, 2)
+    cylinderBounds = np.array(logic.cylinderModel.GetPolyData().GetBounds()).reshape(3, 2)
+    cylinderToWorld = self.getModelToWorld(logic.cylinderModel)
+    headTargetPosition = cylinderToWorld[:3, :3].dot(cylinderBounds.mean(axis=1)) + cylinderToWorld[:3, 3] - headBounds.mean(axis=1)
+    headStartToWorld = np.eye(4)
+    headStartToWorld[:3, 3] = headTargetPosition + [0.0, -1000.0, 0.0]
+    alignmentEvaluator = logic.getAlignmentEvaluator()
+    femurStartToWorld = None
+    femurAlignedToWorld = None
+    if alignmentEvaluator is not None:
+      femurStartToWorld = self.getModelToWorld(logic.femurModel)
+      femurAlignedToWorld = self.getModelToWorld(logic.femurModelCopy).dot(alignmentEvaluator.correspondenceMatrix)
+    for traineeIndex in range(numberOfTrainees):
+      self.trajectories.append(makeSimulatedTrainee('SimulatedTrainee{0}'.format(traineeIndex), randomGenerator,
+        headStartToWorld, headTargetPosition, femurStartToWorld, femurAlignedToWorld, **kwargs))
+
+  @staticmethod
+  def getWorkerExecutable():
+    """
+    Python interpreter of the worker processes: the Slicer Python launcher, because the Slicer
+    executable itself would start a new application.
+    """
+    return shutil.which('PythonSlicer')
+
+  @staticmethod
+  @contextlib.contextmanager
+  def workerEnvironment():
+    """
+    Environment inherited by the worker processes while they are started: the folder of the
+    VRTutorialLib package on the Python path, and VRTUTORIAL_BATCH_WORKER so that the package does
+    not import its modules that need the Slicer application. The environment of this process is
+    restored afterwards.
+    """
+    moduleFolder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    pythonPath = os.environ.get('PYTHONPATH')
+    variables = {'VRTUTORIAL_BATCH_WORKER': '1',
+      'PYTHONPATH': os.pathsep.join([moduleFolder, pythonPath]) if pythonPath else moduleFolder}
+    previousValues = {name: os.environ.get(name) for name in variables}
+    os.environ.update(variables)
+    try:
+      yield
+    finally:
+      for name, value in previousValues.items():
+        if value is None:
+          del os.environ[name]
+        else:
+          os.environ[name] = value
+
+  def run(self):
+    """
+    Evaluate all trajectories. Returns the list of per-trajectory results.
+    """
+    for trajectory in self.trajectories:
+      trajectory['alignmentThresholds'] = self.alignmentThresholds
+    geometry = self.getGeometry()
+    startTime = time.perf_counter()
+    workerExecutable = self.getWorkerExecutable() if self.maximumNumberOfWorkers > 0 else None
+    if workerExecutable is None:
+      if self.maximumNumberOfWorkers > 0:
+        logging.warning('PythonSlicer not found, trajectories are evaluated in the application process')
+      VRTutorialBatchWorker.initializeWorker(geometry)
+      self.results = [VRTutorialBatchWorker.evaluateTrajectory(trajectory) for trajectory in self.trajectories]
+    else:
+      context = multiprocessing.get_context('spawn')
+      context.set_executable(workerExecutable)
+      numberOfWorkers = max(1, min(self.maximumNumberOfWorkers, len(self.trajectories)))
+      # workers are started when the trajectories are submitted
+      with self.workerEnvironment(), concurrent.futures.ProcessPoolExecutor(max_workers=numberOfWorkers, mp_context=context,
+          initializer=VRTutorialBatchWorker.initializeWorker, initargs=(geometry,)) as executor:
+        chunkSize = max(1, len(self.trajectories) // (4 * numberOfWorkers))
+        self.results = list(executor.map(VRTutorialBatchWorker.evaluateTrajectory, self.trajectories, chunksize=chunkSize))
+    self.elapsedTimeSeconds = time.perf_counter() - startTime
+    return self.results
+
+  @staticmethod
+  def successStatistics(taskResults):
+    """
+    Success rate and time to success statistics (seconds, over the successful trajectories).
+    """
+    timesToSuccess = np.array([taskResult['timeToSuccess'] for taskResult in taskResults if taskResult['success']])
+    statistics = {'trajectories': len(taskResults), 'successes': len(timesToSuccess),
+      'successRate': float(len(timesToSuccess)) / len(taskResults) if taskResults else 0.0}
+    if len(timesToSuccess):
+      p50, p90 = np.percentile(timesToSuccess, [50, 90])
+      statistics['timeToSuccessSeconds'] = {'mean': float(timesToSuccess.mean()), 'p50': float(p50), 'p90': float(p90),
+        'min': float(timesToSuccess.min()), 'max': float(timesToSuccess.max())}
+    return statistics
+
+  def getReport(self):
+    collisionResults = [result['HeadCylinderCollision'] for result in self.results if 'HeadCylinderCollision' in result]
+    alignmentResults = [result['FemurAlignment'] for result in self.results if 'FemurAlignment' in result]
+    report = {
+      'trajectories': len(self.results),
+      'workers': self.maximumNumberOfWorkers,
+      'elapsedTimeSeconds': self.elapsedTimeSeconds,
+      'HeadCylinderCollision': self.successStatistics(collisionResults),
+      'FemurAlignment': [],
+      'results': self.results,
+      }
+    for thresholdIndex, threshold in enumerate(self.alignmentThresholds):
+      statistics = self.successStatistics([alignmentResult['thresholds'][thresholdIndex] for alignmentResult in alignmentResults])
+      statistics['threshold'] = threshold
+      report['FemurAlignment'].append(statistics)
+    return report
+
+  def writeReport(self, filePath):
+    with open(filePath, 'w') as file:
+      json.dump(self.getReport(), file, indent=2)
@@ -0,0 +1,157 @@
+import json
+import platform
+import time
+import numpy as np
+import vtk, slicer
+
+#
+# Pose and mesh generation
+#
+
+def makePoseSweep(startPosition, endPosition, numberOfPoses, rotationDegrees=90.0):
+  """
+  Return a list of 4x4 matrices moving linearly from startPosition to endPosition while rotating
+  about the Z axis by up to rotationDegrees.
+  """
+  startPosition = np.asarray(startPosition, dtype=float)
+  endPosition = np.asarray(endPosition, dtype=float)
+  poses = []
+  for fraction in np.linspace(0.0, 1.0, numberOfPoses):
+    angle = np.radians(rotationDegrees * fraction)
+    pose = np.eye(4)
+    pose[:2, :2] = [[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]]
+    pose[:3, 3] = startPosition + fraction * (endPosition - startPosition)
+    poses.append(pose)
+  return poses
+
+
+def makePassThroughSweep(movingModel, targetModel, numberOfPoses, distanceFactor=3.0, rotationDegrees=90.0):
+  """
+  Return poses that move movingModel from far on one side of targetModel, through its center,
+  to far on the other side. Most poses are far from the target, like tracked motion during a task.
+  """
+  movingBounds = movingModel.GetPolyData().GetBounds()
+  targetBounds = targetModel.GetPolyData().GetBounds()
+  movingCenter = np.array([(movingBounds[0] + movingBounds[1]) / 2.0, (movingBounds[2] + movingBounds[3]) / 2.0, (movingBounds[4] + movingBounds[5]) / 2.0])
+  targetCenter = np.array([(targetBounds[0] + targetBounds[1]) / 2.0, (targetBounds[2] + targetBounds[3]) / 2.0, (targetBounds[4] + targetBounds[5]) / 2.0])
+  extent = max(np.array(movingBounds[1::2]) - np.array(movingBounds[0::2])) + max(np.array(targetBounds[1::2]) - np.array(targetBounds[0::2]))
+  offset = np.array([distanceFactor * extent, 0.0, 0.0])
+  return makePoseSweep(targetCenter - movingCenter - offset, targetCenter - movingCenter + offset, numberOfPoses, rotationDegrees)
+
+
+def makeSphereModel(resolution, name, radius=50.0):
+  """
+  Add a sphere model node. The number of triangles grows with the square of resolution.
+  """
+  sphere = vtk.vtkSphereSource()
+  sphere.SetRadius(radius)
+  sphere.SetThetaResolution(resolution)
+  sphere.SetPhiResolution(resolution)
+  sphere.Update()
+  modelNode = slicer.modules.models.logic().AddModel(sphere.GetOutput())
+  modelNode.SetName(name)
+  return modelNode
+
+#
+# CollisionBenchmark
+#
+
+class CollisionBenchmark(object):
+  """Measures findMeshCollision of a VRTutorialLogic over synthetic pose sweeps.
+  The moving model of each case is placed under a benchmark transform that is set to every pose
+  of the sweep in turn; only the collision call itself is timed.
+  Results are collected as a list of dictionaries and can be written to JSON to compare runs.
+  """
+
+  def __init__(self, logic):
+    self.logic = logic
+    self.results = []
+    self.transformNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLLinearTransformNode', 'CollisionBenchmarkTransform')
+    self._matrix = vtk.vtkMatrix4x4()
+
+  def cleanup(self):
+    slicer.mrmlScene.RemoveNode(self.transformNode)
+
+  def runCase(self, name, movingModel, targetModel, poses, warmUpCalls=10):
+    """
+    Time findMeshCollision(movingModel, targetModel) for each pose. Returns the result dictionary.
+    """
+    previousParentTransform = movingModel.GetParentTransformNode()
+    movingModel.SetAndObserveTransformNodeID(self.transformNode.GetID())
+    for pose in poses[:warmUpCalls]:
+      self._setPose(pose)
+      self.logic.findMeshCollision(movingModel, targetModel)
+    latencies = np.zeros(len(poses))
+    numberOfCollidingPoses = 0
+    for poseIndex, pose in enumerate(poses):
+      self._setPose(pose)
+      startTime = time.perf_counter()
+      collisionFlag, numberOfCollisions = self.logic.findMeshCollision(movingModel, targetModel)
+      latencies[poseIndex] = time.perf_counter() - startTime
+      if collisionFlag:
+        numberOfCollidingPoses += 1
+    movingModel.SetAndObserveTransformNodeID(previousParentTransform.GetID() if previousParentTransform else None)
+    result = {
+      'name': name,
+      'movingModel': movingModel.GetName(),
+      'targetModel': targetModel.GetName(),
+      'movingTriangles': self._numberOfCells(movingModel),
+      'targetTriangles': self._numberOfCells(targetModel),
+      # MeshCollisionPair or AnalyticCollisionPair (see VRTutorialLogic.useAnalyticTargets)
+      'collisionPair': type(self.logic.getCollisionPair(movingModel, targetModel)).__name__,
+      'calls': len(poses),
+      'collidingPoses': numberOfCollidingPoses,
+      'latencyMs': self.latencyStatistics(latencies),
+      'throughputCallsPerSecond': float(len(poses) / latencies.sum()) if latencies.sum() > 0 else 0.0,
+      }
+    self.results.append(result)
+    return result
+
+  def runSweep(self, name, movingModel, targetModel, numberOfPoses=500):
+    return self.runCase(name, movingModel, targetModel, makePassThroughSweep(movingModel, targetModel, numberOfPoses))
+
+  def runTriangleCountSweep(self, targetModel, resolutions=(8, 16, 32, 64, 128), numberOfPoses=200, suffix=''):
+    """
+    Run the benchmark with sphere meshes of increasing triangle count moving through targetModel.
+    suffix is appended to the case names (e.g. to tell mesh and analytic target runs apart).
+    """
+    for resolution in resolutions:
+      sphereModel = makeSphereModel(resolution, 'BenchmarkSphere{0}'.format(resolution))
+      try:
+        self.runSweep('sphere{0} vs {1}{2}'.format(resolution, targetModel.GetName(), suffix), sphereModel, targetModel, numberOfPoses)
+      finally:
+        slicer.mrmlScene.RemoveNode(sphereModel)
+
+  @staticmethod
+  def latencyStatistics(latencies):
+    latenciesMs = np.asarray(latencies) * 1000.0
+    return {
+      'mean': float(np.mean(latenciesMs)),
+      'p50': float(np.percentile(latenciesMs, 50)),
+      'p90': float(np.percentile(latenciesMs, 90)),
+      'p95': float(np.percentile(latenciesMs, 95)),
+      'p99': float(np.percentile(latenciesMs, 99)),
+      'max': float(np.max(latenciesMs)),
+      }
+
+  def getReport(self):
+    return {
+      'benchmark': 'findMeshCollision',
+      'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+      'slicerVersion': slicer.app.applicationVersion,
+      'platform': platform.platform(),
+      'results': self.results,
+      }
+
+  def writeReport(self, filePath):
+    with open(filePath, 'w') as file:
+      json.dump(self.getReport(), file, indent=2)
+
+  def _setPose(self, pose):
+    slicer.util.updateVTKMatrixFromArray(self._matrix, pose)
+    self.transformNode.SetMatrixTransformToParent(self._matrix)
+
+  @staticmethod
+  def _numberOfCells(modelNode):
+    polyData = modelNode.GetPolyData()
+    return polyData.GetNumberOfCells() if polyData else 0
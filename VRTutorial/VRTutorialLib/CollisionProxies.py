@@ -0,0 +1,146 @@
+import logging
+import os
+import vtk, slicer
+
+#
+# CollisionProxyCache
+#
+
+class CollisionProxyCache(object):
+  """Low-poly versions of model meshes used as collision geometry.
+  A proxy is the mesh decimated to a triangle budget. Proxies of models loaded from a file are
+  written as VTP files to a CollisionProxies folder next to the source file (or to the
+  application cache folder if that is not writable) and reused while they are newer than the
+  source file. The full resolution mesh of the model node is left untouched for display.
+  The triangle budget is part of the file name and is also stored in the proxy file, a file
+  made for another budget is not reused.
+  """
+
+  PROXY_FOLDER_NAME = 'CollisionProxies'
+  TRIANGLE_BUDGET_ARRAY_NAME = 'TriangleBudget'
+
+  def __init__(self, defaultTriangleBudget=500):
+    self.defaultTriangleBudget = defaultTriangleBudget
+    self.triangleBudgets = {}
+    self.proxies = {}
+
+  def setTriangleBudget(self, modelName, triangleBudget):
+    """
+    Set the triangle budget of the proxy of models named modelName. 0 uses the full mesh.
+    """
+    self.triangleBudgets[modelName] = triangleBudget
+
+  def getTriangleBudget(self, modelName):
+    return self.triangleBudgets.get(modelName, self.defaultTriangleBudget)
+
+  def getProxyPolyData(self, modelNode):
+    """
+    Return the proxy mesh of a model node, generating it if needed. Returns None if the
+    full mesh should be used (no budget or already within budget).
+    """
+    polyData = modelNode.GetPolyData()
+    triangleBudget = self.getTriangleBudget(modelNode.GetName())
+    if polyData is None or not triangleBudget or polyData.GetNumberOfCells() <= triangleBudget:
+      return None
+    sourceFilePath = self.getSourceFilePath(modelNode)
+    key = (sourceFilePath or modelNode.GetID(), triangleBudget)
+    proxy = self.proxies.get(key)
+    if proxy is not None and proxy['sourceMTime'] == polyData.GetMTime():
+      return proxy['polyData']
+    proxyPolyData = None
+    proxyFilePath = self.getProxyFilePath(sourceFilePath, triangleBudget) if sourceFilePath else None
+    if proxyFilePath and os.path.exists(proxyFilePath) and os.path.getmtime(proxyFilePath) >= os.path.getmtime(sourceFilePath):
+      proxyPolyData = self.readPolyData(proxyFilePath)
+      if proxyPolyData is not None and self.getStoredTriangleBudget(proxyPolyData) != triangleBudget:
+        logging.warning('Collision proxy {0} was made for another triangle budget'.format(proxyFilePath))
+        proxyPolyData = None
+    if proxyPolyData is None:
+      proxyPolyData = self.decimate(polyData, triangleBudget)
+      budgetArray = vtk.vtkIntArray()
+      budgetArray.SetName(self.TRIANGLE_BUDGET_ARRAY_NAME)
+      budgetArray.InsertNextValue(triangleBudget)
+      proxyPolyData.GetFieldData().AddArray(budgetArray)
+      if proxyFilePath:
+        self.writePolyData(proxyPolyData, proxyFilePath)
+    self.proxies[key] = {'polyData': proxyPolyData, 'sourceMTime': polyData.GetMTime()}
+    logging.debug('Collision proxy of {0}: {1} of {2} triangles'.format(modelNode.GetName(), proxyPolyData.GetNumberOfCells(), polyData.GetNumberOfCells()))
+    return proxyPolyData
+
+  def clear(self):
+    self.proxies = {}
+
+  @staticmethod
+  def getSourceFilePath(modelNode):
+    # Models loaded from the asset cache have no storage node, the original file is recorded in an attribute
+    sourceFilePath = modelNode.GetAttribute('VRTutorial.SourceFilePath')
+    if sourceFilePath and os.path.exists(sourceFilePath):
+      return sourceFilePath
+    storageNode = modelNode.GetStorageNode()
+    if storageNode is None or not storageNode.GetFileName() or not os.path.exists(storageNode.GetFileName()):
+      return None
+    return storageNode.GetFileName()
+
+  def getProxyFilePath(self, sourceFilePath, triangleBudget):
+    sourceFolder, sourceFileName = os.path.split(sourceFilePath)
+    proxyFileName = '{0}_{1}.vtp'.format(os.path.splitext(sourceFileName)[0], triangleBudget)
+    proxyFolder = os.path.join(sourceFolder, self.PROXY_FOLDER_NAME)
+    if not self._isWritableFolder(proxyFolder):
+      proxyFolder = os.path.join(slicer.app.cachePath, 'VRTutorial', self.PROXY_FOLDER_NAME)
+      if not self._isWritableFolder(proxyFolder):
+        return None
+    return os.path.join(proxyFolder, proxyFileName)
+
+  @classmethod
+  def getStoredTriangleBudget(cls, proxyPolyData):
+    budgetArray = proxyPolyData.GetFieldData().GetArray(cls.TRIANGLE_BUDGET_ARRAY_NAME)
+    if budgetArray is None or budgetArray.GetNumberOfTuples() == 0:
+      return None
+    return int(budgetArray.GetTuple1(0))
+
+  @staticmethod
+  def decimate(polyData, triangleBudget):
+    triangleFilter = vtk.vtkTriangleFilter()
+    triangleFilter.SetInputData(polyData)
+    triangleFilter.Update()
+    numberOfTriangles = triangleFilter.GetOutput().GetNumberOfCells()
+    decimation = vtk.vtkQuadricDecimation()
+    decimation.SetInputConnection(triangleFilter.GetOutputPort())
+    decimation.VolumePreservationOn()
+    # the target reduction is not always reached exactly, aim lower until the budget is met
+    targetNumberOfTriangles = float(triangleBudget)
+    for attempt in range(5):
+      decimation.SetTargetReduction(max(0.0, 1.0 - targetNumberOfTriangles / numberOfTriangles))
+      decimation.Update()
+      if decimation.GetOutput().GetNumberOfCells() <= triangleBudget:
+        break
+      targetNumberOfTriangles *= 0.9
+    proxyPolyData = vtk.vtkPolyData()
+    proxyPolyData.DeepCopy(decimation.GetOutput())
+    return proxyPolyData
+
+  @staticmethod
+  def readPolyData(filePath):
+    reader = vtk.vtkXMLPolyDataReader()
+    reader.SetFileName(filePath)
+    reader.Update()
+    if reader.GetErrorCode() or reader.GetOutput().GetNumberOfCells() == 0:
+      return None
+    return reader.GetOutput()
+
+  @staticmethod
+  def writePolyData(polyData, filePath):
+    writer = vtk.vtkXMLPolyDataWriter()
+    writer.SetFileName(filePath)
+    writer.SetInputData(polyData)
+    writer.SetDataModeToBinary()
+    if not writer.Write():
+      logging.warning('Collision proxy could not be written to ' + filePath)
+
+  @staticmethod
+  def _isWritableFolder(folderPath):
+    try:
+      if not os.path.exists(folderPath):
+        os.makedirs(folderPath)
+      return os.access(folderPath, os.W_OK)
+    except OSError:
+      return False
@@ -0,0 +1,171 @@
+import numpy as np
+
+#
+# Pose interpolation
+#
+
+def quaternionsFromRotations(rotations):
+  """
+  Unit quaternions (w, x, y, z) of N x 3 x 3 rotation matrices.
+  """
+  rotations = np.asarray(rotations, dtype=float)
+  quaternions = np.zeros((len(rotations), 4))
+  trace = np.trace(rotations, axis1=1, axis2=2)
+  # w is computed from the trace, the signs of x, y, z from the antisymmetric part; the
+  # component magnitudes come from the diagonal, which is stable for all angles
+  quaternions[:, 0] = np.sqrt(np.maximum(0.0, 1.0 + trace)) / 2.0
+  quaternions[:, 1] = np.sqrt(np.maximum(0.0, 1.0 + rotations[:, 0, 0] - rotations[:, 1, 1] - rotations[:, 2, 2])) / 2.0
+  quaternions[:, 2] = np.sqrt(np.maximum(0.0, 1.0 - rotations[:, 0, 0] + rotations[:, 1, 1] - rotations[:, 2, 2])) / 2.0
+  quaternions[:, 3] = np.sqrt(np.maximum(0.0, 1.0 - rotations[:, 0, 0] - rotations[:, 1, 1] + rotations[:, 2, 2])) / 2.0
+  largest = np.argmax(quaternions, axis=1)
+  signs = np.ones((len(rotations), 4))
+  # signs relative to the largest component
+  pairs = {
+    0: [(1, rotations[:, 2, 1] - rotations[:, 1, 2]), (2, rotations[:, 0, 2] - rotations[:, 2, 0]), (3, rotations[:, 1, 0] - rotations[:, 0, 1])],
+    1: [(0, rotations[:, 2, 1] - rotations[:, 1, 2]), (2, rotations[:, 1, 0] + rotations[:, 0, 1]), (3, rotations[:, 0, 2] + rotations[:, 2, 0])],
+    2: [(0, rotations[:, 0, 2] - rotations[:, 2, 0]), (1, rotations[:, 1, 0] + rotations[:, 0, 1]), (3, rotations[:, 2, 1] + rotations[:, 1, 2])],
+    3: [(0, rotations[:, 1, 0] - rotations[:, 0, 1]), (1, rotations[:, 0, 2] + rotations[:, 2, 0]), (2, rotations[:, 2, 1] + rotations[:, 1, 2])],
+    }
+  for largestIndex, components in pairs.items():
+    rows = largest == largestIndex
+    for componentIndex, value in components:
+      signs[rows, componentIndex] = np.where(value[rows] < 0, -1.0, 1.0)
+  return quaternions * signs
+
+
+def rotationsFromQuaternions(quaternions):
+  w, x, y, z = quaternions[:, 0], quaternions[:, 1], quaternions[:, 2], quaternions[:, 3]
+  return np.stack([
+    np.stack([1 - 2 * (y * y + z * z), 2 * (x * y - w * z), 2 * (x * z + w * y)], axis=1),
+    np.stack([2 * (x * y + w * z), 1 - 2 * (x * x + z * z), 2 * (y * z - w * x)], axis=1),
+    np.stack([2 * (x * z - w * y), 2 * (y * z + w * x), 1 - 2 * (x * x + y * y)], axis=1),
+    ], axis=1)
+
+
+def interpolatePoses(startToWorld, endToWorld, fractions):
+  """
+  Poses (N x 4 x 4) between two rigid transforms, at the given fractions of the motion:
+  translation is interpolated linearly, rotation along the shortest arc (slerp). A uniform
+  scale of the transforms is interpolated linearly.
+  """
+  fractions = np.asarray(fractions, dtype=float)
+  startScale = np.cbrt(np.linalg.det(startToWorld[:3, :3]))
+  endScale = np.cbrt(np.linalg.det(endToWorld[:3, :3]))
+  startQuaternion, endQuaternion = quaternionsFromRotations(np.array([startToWorld[:3, :3] / startScale, endToWorld[:3, :3] / endScale]))
+  cosAngle = float(np.dot(startQuaternion, endQuaternion))
+  if cosAngle < 0:
+    endQuaternion = -endQuaternion
+    cosAngle = -cosAngle
+  if cosAngle > 0.9995:
+    # nearly the same orientation, linear interpolation is accurate
+    quaternions = startQuaternion + fractions[:, np.newaxis] * (endQuaternion - startQuaternion)
+  else:
+    angle = np.arccos(cosAngle)
+    quaternions = (np.sin((1 - fractions) * angle)[:, np.newaxis] * startQuaternion
+      + np.sin(fractions * angle)[:, np.newaxis] * endQuaternion) / np.sin(angle)
+  quaternions /= np.linalg.norm(quaternions, axis=1)[:, np.newaxis]
+  poses = np.zeros((len(fractions), 4, 4))
+  scales = startScale + fractions * (endScale - startScale)
+  poses[:, :3, :3] = rotationsFromQuaternions(quaternions) * scales[:, np.newaxis, np.newaxis]
+  poses[:, :3, 3] = startToWorld[:3, 3] + fractions[:, np.newaxis] * (endToWorld[:3, 3] - startToWorld[:3, 3])
+  poses[:, 3, 3] = 1.0
+  return poses
+
+#
+# SweptCollisionDetector
+#
+
+class SweptCollisionDetector(object):
+  """Continuous collision test of a moving model against a target, between the pose of the
+  previous check and the current one, so that a fast motion (or a low check rate) does not
+  pass through a thin target between two checks.
+  The motion is divided in steps of at most maximumStep (mm) of the moving model, and the
+  bounding sphere of the model is tested at every step at once: against the target distance
+  field if given (see TargetDistanceField), against the target bounding sphere otherwise. The
+  mesh test of the collision pair only runs at the steps where the sphere may touch the target,
+  in motion order, until a contact is found. maximumStep should be smaller than the thickness
+  of the target.
+  """
+
+  def __init__(self, collisionPair, targetDistanceField=None, movingIndex=0, maximumStep=5.0, maximumNumberOfSteps=256, maximumNumberOfMeshTests=16):
+    self.collisionPair = collisionPair
+    self.targetDistanceField = targetDistanceField
+    self.movingIndex = movingIndex
+    self.maximumStep = maximumStep
+    self.maximumNumberOfSteps = maximumNumberOfSteps
+    self.maximumNumberOfMeshTests = maximumNumberOfMeshTests
+    self.previousToWorld = None
+    self.stepLength = 0.0
+    # fraction of the last motion where the contact was found
+    self.contactFraction = None
+    self.numberOfSteps = 0
+    self.numberOfMeshTests = 0
+
+  def reset(self):
+    """
+    Forget the previous pose, the next check only tests the current pose.
+    """
+    self.previousToWorld = None
+
+  def getMovingToWorld(self):
+    matrix = self.collisionPair.matrices[self.movingIndex]
+    return np.array([[matrix.GetElement(row, column) for column in range(4)] for row in range(4)])
+
+  def getSteps(self, currentToWorld):
+    """
+    Poses of the moving model from the previous (excluded) to the current pose.
+    """
+    if self.previousToWorld is None:
+      self.stepLength = 0.0
+      return currentToWorld[np.newaxis]
+    boundingSphere = self.collisionPair.boundingSpheres[self.movingIndex]
+    # largest path of a point of the bounding sphere: center translation plus rotation of the
+    # radius (the norm is the chord of the rotation, an arc is at most pi / 2 times longer)
+    poses = np.array([self.previousToWorld, currentToWorld])
+    centers = np.einsum('nij,j->ni', poses[:, :3, :3], boundingSphere.center) + poses[:, :3, 3]
+    rotationChange = np.linalg.norm(currentToWorld[:3, :3] - self.previousToWorld[:3, :3], ord=2)
+    pathLength = float(np.linalg.norm(centers[1] - centers[0])) + rotationChange * np.pi / 2.0 * max(boundingSphere.radius, 0.0)
+    numberOfSteps = int(min(max(np.ceil(pathLength / self.maximumStep), 1), self.maximumNumberOfSteps))
+    self.stepLength = pathLength / numberOfSteps
+    fractions = np.arange(1, numberOfSteps + 1) / float(numberOfSteps)
+    return interpolatePoses(self.previousToWorld, currentToWorld, fractions)
+
+  def getClearances(self, poses):
+    """
+    Lower bound of the distance between the moving model and the target at each pose (mm).
+    """
+    movingSphere = self.collisionPair.boundingSpheres[self.movingIndex]
+    targetSphere = self.collisionPair.boundingSpheres[1 - self.movingIndex]
+    centers = np.einsum('nij,j->ni', poses[:, :3, :3], movingSphere.center) + poses[:, :3, 3]
+    radii = movingSphere.radius * np.linalg.norm(poses[:, :3, :3], axis=1).max(axis=1)
+    if self.targetDistanceField is not None:
+      return self.targetDistanceField.distanceToWorldPoints(centers) - radii
+    return np.linalg.norm(centers - targetSphere.worldCenter, axis=1) - radii - targetSphere.worldRadius
+
+  def check(self):
+    """
+    Test the motion since the previous check. Returns the number of contacts at the first
+    step in contact (0 if none).
+    """
+    collisionPair = self.collisionPair
+    collisionPair.updateInputs()
+    if not collisionPair.hasInputs():
+      return 0
+    collisionPair.updateMatrices()
+    currentToWorld = self.getMovingToWorld()
+    poses = self.getSteps(currentToWorld)
+    self.previousToWorld = currentToWorld
+    self.contactFraction = None
+    self.numberOfSteps = len(poses)
+    # the sphere may touch the target half a step away from a step
+    candidateSteps = np.nonzero(self.getClearances(poses) <= self.stepLength / 2.0)[0]
+    numberOfContacts = 0
+    for stepIndex in candidateSteps[:self.maximumNumberOfMeshTests]:
+      self.numberOfMeshTests += 1
+      numberOfContacts = collisionPair.checkAtPose(self.movingIndex, poses[stepIndex])
+      if numberOfContacts > 0:
+        self.contactFraction = (stepIndex + 1) / float(len(poses))
+        break
+    # the filter matrices are left at the current pose
+    collisionPair.setModelToWorld(self.movingIndex, currentToWorld)
+    return numberOfContacts
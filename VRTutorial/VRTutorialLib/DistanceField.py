@@ -0,0 +1,168 @@
+import logging
+import os
+import numpy as np
+import vtk
+from vtk.util.numpy_support import vtk_to_numpy
+
+#
+# SignedDistanceField
+#
+
+class SignedDistanceField(object):
+  """Signed distance to a surface mesh sampled on a regular grid (negative inside closed meshes).
+  Distances at arbitrary points are trilinearly interpolated from the grid, vectorized over
+  many points. Points outside the grid get the distance at the closest grid point plus the
+  distance to the grid, the margin around the mesh keeps those values positive.
+  """
+
+  def __init__(self, values, origin, spacing):
+    # values are indexed [k, j, i] (z, y, x) like vtkImageData scalars reshaped by NumPy
+    self.values = np.ascontiguousarray(values, dtype=np.float32)
+    self.origin = np.asarray(origin, dtype=float)
+    self.spacing = np.asarray(spacing, dtype=float)
+    self.dimensions = np.array(self.values.shape[::-1])
+
+  @classmethod
+  def fromPolyData(cls, polyData, maximumDimension=64, marginFraction=0.25):
+    """
+    Sample the signed distance to polyData on an isotropic grid with at most maximumDimension
+    points along the longest axis, covering the mesh bounds extended by marginFraction.
+    """
+    bounds = np.array(polyData.GetBounds()).reshape(3, 2)
+    size = bounds[:, 1] - bounds[:, 0]
+    margin = marginFraction * size.max()
+    bounds[:, 0] -= margin
+    bounds[:, 1] += margin
+    spacing = (bounds[:, 1] - bounds[:, 0]).max() / (maximumDimension - 1)
+    dimensions = np.maximum(2, np.ceil((bounds[:, 1] - bounds[:, 0]) / spacing).astype(int) + 1)
+    bounds[:, 1] = bounds[:, 0] + (dimensions - 1) * spacing
+    distance = vtk.vtkImplicitPolyDataDistance()
+    distance.SetInput(polyData)
+    sampleFunction = vtk.vtkSampleFunction()
+    sampleFunction.SetImplicitFunction(distance)
+    sampleFunction.SetModelBounds(bounds.ravel())
+    sampleFunction.SetSampleDimensions(*[int(dimension) for dimension in dimensions])
+    sampleFunction.SetOutputScalarTypeToFloat()
+    sampleFunction.ComputeNormalsOff()
+    sampleFunction.Update()
+    values = vtk_to_numpy(sampleFunction.GetOutput().GetPointData().GetScalars()).reshape(dimensions[::-1])
+    return cls(values, bounds[:, 0], [spacing] * 3)
+
+  @classmethod
+  def load(cls, filePath):
+    data = np.load(filePath)
+    return cls(data['values'], data['origin'], data['spacing'])
+
+  def save(self, filePath):
+    np.savez_compressed(filePath, values=self.values, origin=self.origin, spacing=self.spacing)
+
+  def evaluate(self, points):
+    """
+    Return the signed distances at an (N, 3) array of points given in mesh coordinates.
+    """
+    points = np.atleast_2d(points)
+    continuousIndex = (points - self.origin) / self.spacing
+    clampedIndex = np.clip(continuousIndex, 0, self.dimensions - 1)
+    lowerIndex = np.minimum(np.floor(clampedIndex).astype(int), self.dimensions - 2)
+    fraction = clampedIndex - lowerIndex
+    i, j, k = lowerIndex[:, 0], lowerIndex[:, 1], lowerIndex[:, 2]
+    fx, fy, fz = fraction[:, 0], fraction[:, 1], fraction[:, 2]
+    values = self.values
+    c00 = values[k, j, i] * (1 - fx) + values[k, j, i + 1] * fx
+    c10 = values[k, j + 1, i] * (1 - fx) + values[k, j + 1, i + 1] * fx
+    c01 = values[k + 1, j, i] * (1 - fx) + values[k + 1, j, i + 1] * fx
+    c11 = values[k + 1, j + 1, i] * (1 - fx) + values[k + 1, j + 1, i + 1] * fx
+    distances = (c00 * (1 - fy) + c10 * fy) * (1 - fz) + (c01 * (1 - fy) + c11 * fy) * fz
+    outsideDistances = np.linalg.norm((continuousIndex - clampedIndex) * self.spacing, axis=1)
+    return distances + outsideDistances
+
+#
+# TargetDistanceField
+#
+
+class TargetDistanceField(object):
+  """Signed distance field of a target model node, queried with points in world coordinates.
+  The world to target matrix is read from the target parent transform on every query, so the
+  target may be moved, but its mesh is assumed to be static. Without a target node (e.g. in batch
+  workers), the target stays at the pose targetToWorld (4x4 NumPy array, identity if None).
+  """
+
+  def __init__(self, targetModel, distanceField, targetToWorld=None):
+    self.targetModel = targetModel
+    self.distanceField = distanceField
+    self.fixedWorldToTarget = np.linalg.inv(targetToWorld) if targetToWorld is not None else None
+    self._worldToTargetMatrix = vtk.vtkMatrix4x4()
+    self._modelToWorldMatrix = vtk.vtkMatrix4x4()
+
+  def getWorldToTarget(self):
+    if self.targetModel is None:
+      return self.fixedWorldToTarget
+    parentTransformNode = self.targetModel.GetParentTransformNode()
+    if parentTransformNode is None:
+      return None
+    parentTransformNode.GetMatrixTransformFromWorld(self._worldToTargetMatrix)
+    return np.array([[self._worldToTargetMatrix.GetElement(row, column) for column in range(4)] for row in range(4)])
+
+  def distanceToWorldPoints(self, worldPoints):
+    worldPoints = np.atleast_2d(worldPoints)
+    worldToTarget = self.getWorldToTarget()
+    if worldToTarget is None:
+      return self.distanceField.evaluate(worldPoints)
+    return self.distanceField.evaluate(worldPoints.dot(worldToTarget[:3, :3].T) + worldToTarget[:3, 3])
+
+  def distanceToSphere(self, modelNode, boundingSphere):
+    """
+    Signed distance from the surface of the bounding sphere of modelNode (a BoundingSphere in model
+    coordinates) to the target surface. Negative if the sphere reaches inside the target.
+    Since the sphere contains the model mesh, a positive value means the meshes cannot intersect.
+    """
+    parentTransformNode = modelNode.GetParentTransformNode()
+    if parentTransformNode is not None:
+      parentTransformNode.GetMatrixTransformToWorld(self._modelToWorldMatrix)
+    else:
+      self._modelToWorldMatrix.Identity()
+    boundingSphere.updateWorld(self._modelToWorldMatrix)
+    return float(self.distanceToWorldPoints(boundingSphere.worldCenter)[0]) - boundingSphere.worldRadius
+
+#
+# DistanceFieldCache
+#
+
+class DistanceFieldCache(object):
+  """Builds the distance fields of target models once and keeps them in memory and in the asset
+  cache folder (as compressed NumPy files keyed by the hash of the mesh source file).
+  """
+
+  def __init__(self, assetCache, maximumDimension=64):
+    self.assetCache = assetCache
+    self.maximumDimension = maximumDimension
+    self.distanceFields = {}
+
+  def getTargetDistanceField(self, targetModel):
+    targetDistanceField = self.distanceFields.get(targetModel.GetID())
+    if targetDistanceField is None or targetDistanceField.targetModel is not targetModel:
+      targetDistanceField = TargetDistanceField(targetModel, self.getDistanceField(targetModel))
+      self.distanceFields[targetModel.GetID()] = targetDistanceField
+    return targetDistanceField
+
+  def getDistanceField(self, targetModel):
+    sourceFilePath = targetModel.GetAttribute(self.assetCache.SOURCE_FILE_ATTRIBUTE)
+    entryFilePath = None
+    if sourceFilePath and os.path.exists(sourceFilePath) and self.assetCache.enabled:
+      entryFilePath = os.path.join(self.assetCache.cacheDirectory,
+        'sdf-{0}-{1}.npz'.format(self.assetCache.fileHash(sourceFilePath), self.maximumDimension))
+      if os.path.exists(entryFilePath):
+        try:
+          distanceField = SignedDistanceField.load(entryFilePath)
+          self.assetCache.touch(entryFilePath)
+          return distanceField
+        except (OSError, ValueError, KeyError) as e:
+          logging.warning('Invalid distance field cache entry {0}: {1}'.format(entryFilePath, e))
+    distanceField = SignedDistanceField.fromPolyData(targetModel.GetPolyData(), self.maximumDimension)
+    if entryFilePath:
+      distanceField.save(entryFilePath)
+      self.assetCache.registerEntry(entryFilePath, {'type': 'distanceField'})
+    return distanceField
+
+  def clear(self):
+    self.distanceFields = {}
@@ -0,0 +1,138 @@
+import numpy as np
+import qt, vtk
+from vtk.util.numpy_support import vtk_to_numpy
+
+#
+# Hand probes
+#
+
+def fitProbeSpheres(polyData, numberOfSpheres=4):
+  """
+  Cover a mesh with spheres, for contact queries tighter than a single bounding sphere: points
+  are split in slabs of equal size along the main axis of the mesh, each slab is bounded by a
+  sphere. Returns the centers (N x 3) and radii in model coordinates.
+  """
+  points = vtk_to_numpy(polyData.GetPoints().GetData()).astype(float)
+  centeredPoints = points - points.mean(axis=0)
+  mainAxis = np.linalg.svd(centeredPoints, full_matrices=False)[2][0]
+  order = np.argsort(centeredPoints.dot(mainAxis))
+  centers = []
+  radii = []
+  for slab in np.array_split(order, min(numberOfSpheres, len(points))):
+    slabPoints = points[slab]
+    center = (slabPoints.min(axis=0) + slabPoints.max(axis=0)) / 2.0
+    centers.append(center)
+    radii.append(float(np.linalg.norm(slabPoints - center, axis=1).max()))
+  return np.array(centers), np.array(radii)
+
+#
+# HandTouchDetector
+#
+
+class HandTouchDetector(object):
+  """Detects when the hand avatars start and stop touching the models of a SceneBVH.
+  Each hand is covered by a few probe spheres (see fitProbeSpheres), the probes of all the hands
+  are queried together in one SceneBVH.findContacts call. Controller transform events only
+  schedule the query, so when both controllers moved it still runs once per frame.
+  touchCallback(handName, modelNode, touching) is called when a hand starts (touching is True)
+  or stops touching a model.
+  """
+
+  def __init__(self, sceneBVH, transformDispatcher, numberOfProbesPerHand=4):
+    self.sceneBVH = sceneBVH
+    self.transformDispatcher = transformDispatcher
+    self.numberOfProbesPerHand = numberOfProbesPerHand
+    self.hands = []
+    self.probes = {}
+    # hand name -> touched model nodes
+    self.touchedModels = {}
+    self.touchCallback = None
+    self.updateScheduled = False
+    self.detecting = False
+    self._handToWorld = vtk.vtkMatrix4x4()
+
+  def setHands(self, hands):
+    """
+    hands: list of (name, controller transform node, hand model node). Hands without transform
+    or model are ignored.
+    """
+    self.stop()
+    self.hands = [(name, transformNode, modelNode) for name, transformNode, modelNode in hands
+      if transformNode is not None and modelNode is not None]
+    self.touchedModels = {name: [] for name, transformNode, modelNode in self.hands}
+
+  def start(self):
+    self.detecting = True
+    for name, transformNode, modelNode in self.hands:
+      self.transformDispatcher.addCallback(transformNode, self.onControllerModified, priority=10)
+    self.update()
+
+  def stop(self):
+    """
+    Stop detecting, touched models are released (touchCallback is called for each of them).
+    """
+    self.detecting = False
+    for name, transformNode, modelNode in self.hands:
+      self.transformDispatcher.removeCallback(transformNode, self.onControllerModified)
+    for name, modelNodes in self.touchedModels.items():
+      for modelNode in modelNodes:
+        if self.touchCallback:
+          self.touchCallback(name, modelNode, False)
+    self.touchedModels = {name: [] for name in self.touchedModels}
+
+  def onControllerModified(self, transformNode, event):
+    if self.updateScheduled:
+      return
+    self.updateScheduled = True
+    qt.QTimer.singleShot(0, self.update)
+
+  def getProbeSpheres(self, modelNode):
+    """
+    Probe spheres of a hand in model coordinates, computed again when the mesh changes.
+    """
+    polyData = modelNode.GetPolyData()
+    probe = self.probes.get(modelNode)
+    if probe is None or probe[0] is not polyData or probe[1] != polyData.GetMTime():
+      probe = (polyData, polyData.GetMTime()) + fitProbeSpheres(polyData, self.numberOfProbesPerHand)
+      self.probes[modelNode] = probe
+    return probe[2], probe[3]
+
+  def update(self):
+    """
+    Query the contacts of all the hands and call touchCallback for the changes.
+    """
+    self.updateScheduled = False
+    if not self.detecting:
+      return
+    probeHands = []
+    centers = []
+    radii = []
+    for handIndex, (name, transformNode, modelNode) in enumerate(self.hands):
+      if modelNode.GetPolyData() is None or modelNode.GetPolyData().GetNumberOfPoints() == 0:
+        continue
+      modelCenters, modelRadii = self.getProbeSpheres(modelNode)
+      if modelNode.GetParentTransformNode() is not None:
+        modelNode.GetParentTransformNode().GetMatrixTransformToWorld(self._handToWorld)
+      else:
+        self._handToWorld.Identity()
+      handToWorld = np.array([[self._handToWorld.GetElement(row, column) for column in range(4)] for row in range(3)])
+      centers.append(modelCenters.dot(handToWorld[:, :3].T) + handToWorld[:, 3])
+      radii.append(modelRadii * float(np.max(np.linalg.norm(handToWorld[:, :3], axis=0))))
+      probeHands.extend([handIndex] * len(modelRadii))
+    touchedModels = {name: [] for name, transformNode, modelNode in self.hands}
+    if probeHands:
+      for probeIndex, modelNode, distance in self.sceneBVH.findContacts(np.concatenate(centers), np.concatenate(radii)):
+        name = self.hands[probeHands[probeIndex]][0]
+        if modelNode not in touchedModels[name]:
+          touchedModels[name].append(modelNode)
+    previousTouchedModels = self.touchedModels
+    self.touchedModels = touchedModels
+    if not self.touchCallback:
+      return
+    for name, modelNodes in touchedModels.items():
+      for modelNode in previousTouchedModels.get(name, []):
+        if modelNode not in modelNodes:
+          self.touchCallback(name, modelNode, False)
+      for modelNode in modelNodes:
+        if modelNode not in previousTouchedModels.get(name, []):
+          self.touchCallback(name, modelNode, True)
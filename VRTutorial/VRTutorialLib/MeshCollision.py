@@ -0,0 +1,203 @@
+import numpy as np
+import vtk
+from vtk.util.numpy_support import vtk_to_numpy
+
+#
+# BoundingSphere
+#
+
+class BoundingSphere(object):
+  """Bounding sphere of a polydata in model coordinates, transformed on demand to world.
+  The center is the center of the bounding box and the radius the largest distance from it
+  to a mesh point, which is tighter than the half diagonal of the box for rounded meshes.
+  """
+
+  def __init__(self, polyData=None):
+    self.center = np.zeros(3)
+    self.radius = -1.0
+    self.worldCenter = np.zeros(3)
+    self.worldRadius = -1.0
+    if polyData is not None:
+      self.update(polyData)
+
+  def update(self, polyData):
+    if polyData is None or polyData.GetNumberOfPoints() == 0:
+      self.center = np.zeros(3)
+      self.radius = -1.0
+      return
+    bounds = polyData.GetBounds()
+    self.center = np.array([(bounds[0] + bounds[1]) / 2.0, (bounds[2] + bounds[3]) / 2.0, (bounds[4] + bounds[5]) / 2.0])
+    points = vtk_to_numpy(polyData.GetPoints().GetData())
+    self.radius = float(np.sqrt(np.max(np.sum((points - self.center) ** 2, axis=1))))
+
+  def isValid(self):
+    return self.radius >= 0
+
+  def updateWorld(self, modelToWorldMatrix):
+    """
+    Update world center and radius from a vtkMatrix4x4. The radius is scaled by the largest
+    axis scaling of the matrix so that the sphere stays conservative for scaled models.
+    """
+    matrix = np.array([[modelToWorldMatrix.GetElement(row, column) for column in range(4)] for row in range(3)])
+    self.worldCenter = matrix[:, :3].dot(self.center) + matrix[:, 3]
+    self.worldRadius = self.radius * float(np.max(np.linalg.norm(matrix[:, :3], axis=0)))
+
+  def overlaps(self, other):
+    if not self.isValid() or not other.isValid():
+      return False
+    distance = self.worldRadius + other.worldRadius
+    return float(np.sum((self.worldCenter - other.worldCenter) ** 2)) <= distance * distance
+
+#
+# MeshCollisionPair
+#
+
+class MeshCollisionPair(object):
+  """Persistent collision test between the meshes of two model nodes.
+  The vtkCollisionDetectionFilter (and the OBB trees it builds for each input) is kept
+  alive between calls. Only the model-to-world matrices are refreshed on every check; the
+  inputs are set again (which rebuilds the trees) only when a polydata object is replaced
+  or its MTime changes.
+  A broad phase compares the world bounding spheres of both meshes first, the triangle level
+  test only runs when they overlap. Counters of both phases are kept for profiling.
+  If a proxy cache is given, the low-poly collision proxies of the models are tested instead of
+  their display meshes.
+  Nodes may be None (e.g. in batch workers without a scene): meshes and poses of those models are
+  set with setInputData and setModelToWorld instead of being read from the nodes.
+  """
+
+  def __init__(self, node1, node2, proxyCache=None):
+    self.nodes = [node1, node2]
+    self.proxyCache = proxyCache
+    self.collisionDetection = vtk.vtkCollisionDetectionFilter()
+    self.collisionDetection.SetBoxTolerance(0.0)
+    self.collisionDetection.SetCellTolerance(0.0)
+    self.collisionDetection.SetNumberOfCellsPerNode(2)
+    self.matrices = [vtk.vtkMatrix4x4(), vtk.vtkMatrix4x4()]
+    self.collisionDetection.SetMatrix(0, self.matrices[0])
+    self.collisionDetection.SetMatrix(1, self.matrices[1])
+    self._polyData = [None, None]
+    self._polyDataMTime = [0, 0]
+    # meshes actually tested (proxies or display meshes)
+    self._collisionPolyData = [None, None]
+    self._worldMatrix = vtk.vtkMatrix4x4()
+    self.boundingSpheres = [BoundingSphere(), BoundingSphere()]
+    self.broadPhaseEnabled = True
+    self.resetStatistics()
+
+  def resetStatistics(self):
+    self.numberOfChecks = 0
+    self.numberOfBroadPhaseRejections = 0
+    self.numberOfNarrowPhaseChecks = 0
+
+  def updateInputs(self):
+    """
+    Set the polydata inputs (or their proxies) again if the model meshes were replaced or
+    modified since the last check.
+    Returns True if any input was updated.
+    """
+    updated = False
+    for index, node in enumerate(self.nodes):
+      polyData = node.GetPolyData() if node is not None else None
+      if polyData is None:
+        continue
+      if polyData is self._polyData[index] and polyData.GetMTime() == self._polyDataMTime[index]:
+        continue
+      collisionPolyData = self.proxyCache.getProxyPolyData(node) if self.proxyCache is not None else None
+      self.setInputData(index, polyData, collisionPolyData)
+      updated = True
+    return updated
+
+  def setInputData(self, index, polyData, collisionPolyData=None):
+    """
+    Set the mesh of model index, and the mesh actually tested for it if it is not polyData itself
+    (e.g. its collision proxy).
+    """
+    if collisionPolyData is None:
+      collisionPolyData = polyData
+    self.collisionDetection.SetInputData(index, collisionPolyData)
+    self._polyData[index] = polyData
+    self._polyDataMTime[index] = polyData.GetMTime()
+    self._collisionPolyData[index] = collisionPolyData
+    self.boundingSpheres[index].update(collisionPolyData)
+    self.boundingSpheres[index].updateWorld(self.matrices[index])
+    self.collisionDetection.Modified()
+
+  def updateMatrices(self):
+    """
+    Copy the current model-to-world matrices into the matrices observed by the filter.
+    Matrices are only modified when an element actually changed, so an unchanged pose does
+    not re-execute the filter.
+    """
+    for index, node in enumerate(self.nodes):
+      if node is None:
+        continue
+      parentTransformNode = node.GetParentTransformNode()
+      if parentTransformNode is not None:
+        parentTransformNode.GetMatrixTransformToWorld(self._worldMatrix)
+      else:
+        self._worldMatrix.Identity()
+      matrix = self.matrices[index]
+      if not self._matricesEqual(matrix, self._worldMatrix):
+        matrix.DeepCopy(self._worldMatrix)
+        self.boundingSpheres[index].updateWorld(matrix)
+
+  def hasInputs(self):
+    return self._polyData[0] is not None and self._polyData[1] is not None
+
+  def check(self):
+    """
+    Run the collision test with the current poses.
+    Returns the number of contacts between the two meshes.
+    """
+    self.updateInputs()
+    if not self.hasInputs():
+      return 0
+    self.updateMatrices()
+    return self._checkMatrices()
+
+  def checkAtPose(self, index, modelToWorld):
+    """
+    Run the collision test with the model of node index at the pose modelToWorld (4x4 NumPy
+    array) instead of its current pose, e.g. at an intermediate pose of its motion.
+    Returns the number of contacts between the two meshes.
+    """
+    self.updateInputs()
+    if not self.hasInputs():
+      return 0
+    self.updateMatrices()
+    self.setModelToWorld(index, modelToWorld)
+    return self._checkMatrices()
+
+  def setModelToWorld(self, index, modelToWorld):
+    """
+    Set the pose of the model of node index (4x4 NumPy array), until the next updateMatrices.
+    """
+    self._worldMatrix.DeepCopy(np.ascontiguousarray(modelToWorld, dtype=float).ravel())
+    matrix = self.matrices[index]
+    if not self._matricesEqual(matrix, self._worldMatrix):
+      matrix.DeepCopy(self._worldMatrix)
+      self.boundingSpheres[index].updateWorld(matrix)
+
+  def _checkMatrices(self):
+    self.numberOfChecks += 1
+    if self.broadPhaseEnabled and not self.boundingSpheres[0].overlaps(self.boundingSpheres[1]):
+      self.numberOfBroadPhaseRejections += 1
+      return 0
+    self.numberOfNarrowPhaseChecks += 1
+    return self._testMeshes()
+
+  def _testMeshes(self):
+    """
+    Triangle level test at the current matrices, returns the number of contacts.
+    """
+    self.collisionDetection.Update()
+    return self.collisionDetection.GetNumberOfContacts()
+
+  @staticmethod
+  def _matricesEqual(matrix1, matrix2):
+    for row in range(4):
+      for column in range(4):
+        if matrix1.GetElement(row, column) != matrix2.GetElement(row, column):
+          return False
+    return True
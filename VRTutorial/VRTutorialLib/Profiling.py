@@ -0,0 +1,142 @@
+import csv
+import functools
+import json
+import time
+import numpy as np
+
+#
+# CallStatistics
+#
+
+class CallStatistics(object):
+  """Durations and start times of the most recent calls of a function, in fixed-size ring buffers.
+  """
+
+  def __init__(self, name, topLevel=False, bufferSize=1024):
+    self.name = name
+    self.topLevel = topLevel
+    self.durations = np.zeros(bufferSize)
+    self.startTimes = np.zeros(bufferSize)
+    self.numberOfCalls = 0
+
+  def record(self, startTime, duration):
+    index = self.numberOfCalls % len(self.durations)
+    self.durations[index] = duration
+    self.startTimes[index] = startTime
+    self.numberOfCalls += 1
+
+  def reset(self):
+    self.numberOfCalls = 0
+
+  def getSummary(self, now=None):
+    """
+    Return count, call rate (calls per second over the buffered calls) and latency statistics
+    in milliseconds of the buffered calls.
+    """
+    numberOfBufferedCalls = min(self.numberOfCalls, len(self.durations))
+    summary = {'name': self.name, 'count': self.numberOfCalls, 'callRateHz': 0.0,
+      'meanMs': 0.0, 'p50Ms': 0.0, 'p95Ms': 0.0, 'p99Ms': 0.0, 'maxMs': 0.0}
+    if numberOfBufferedCalls == 0:
+      return summary
+    durationsMs = self.durations[:numberOfBufferedCalls] * 1000.0
+    p50, p95, p99 = np.percentile(durationsMs, [50, 95, 99])
+    summary.update({'meanMs': float(durationsMs.mean()), 'p50Ms': float(p50), 'p95Ms': float(p95),
+      'p99Ms': float(p99), 'maxMs': float(durationsMs.max())})
+    if numberOfBufferedCalls > 1:
+      startTimes = self.startTimes[:numberOfBufferedCalls]
+      if now is None:
+        now = time.perf_counter()
+      timeSpan = now - startTimes.min()
+      if timeSpan > 0:
+        summary['callRateHz'] = float(numberOfBufferedCalls / timeSpan)
+    return summary
+
+#
+# CallProfiler
+#
+
+class CallProfiler(object):
+  """Collects call durations of functions decorated with profiled().
+  When disabled, the cost of a decorated function is one extra call and one attribute check.
+  """
+
+  def __init__(self, frameRateHz=90.0):
+    self.enabled = False
+    self.frameRateHz = frameRateHz
+    self.statistics = {}
+
+  def getStatistics(self, name, topLevel=False):
+    statistics = self.statistics.get(name)
+    if statistics is None:
+      statistics = CallStatistics(name, topLevel)
+      self.statistics[name] = statistics
+    return statistics
+
+  def reset(self):
+    for statistics in self.statistics.values():
+      statistics.reset()
+
+  def getSummary(self):
+    now = time.perf_counter()
+    return [statistics.getSummary(now) for statistics in self.statistics.values()]
+
+  def getFrameTimeMs(self):
+    """
+    Estimated module time per rendered frame in milliseconds: time spent per second in top-level
+    callbacks (the ones called by VTK or Qt, which include the nested profiled calls) divided by
+    the frame rate.
+    """
+    busyTimePerSecondMs = 0.0
+    now = time.perf_counter()
+    for statistics in self.statistics.values():
+      if statistics.topLevel:
+        summary = statistics.getSummary(now)
+        busyTimePerSecondMs += summary['meanMs'] * summary['callRateHz']
+    return busyTimePerSecondMs / self.frameRateHz
+
+  def getFrameBudgetMs(self):
+    return 1000.0 / self.frameRateHz
+
+  def getReport(self):
+    return {'frameRateHz': self.frameRateHz, 'frameBudgetMs': self.getFrameBudgetMs(),
+      'frameTimeMs': self.getFrameTimeMs(), 'calls': self.getSummary()}
+
+  def getSummaryText(self):
+    lines = ['Module time per frame: {0:.3f} ms of {1:.1f} ms'.format(self.getFrameTimeMs(), self.getFrameBudgetMs())]
+    for summary in self.getSummary():
+      lines.append('{name}: {callRateHz:.1f} Hz, p50 {p50Ms:.3f} ms, p95 {p95Ms:.3f} ms, p99 {p99Ms:.3f} ms, max {maxMs:.3f} ms'.format(**summary))
+    return '\n'.join(lines)
+
+  def exportJSON(self, filePath):
+    with open(filePath, 'w') as file:
+      json.dump(self.getReport(), file, indent=2)
+
+  def exportCSV(self, filePath):
+    fieldNames = ['name', 'count', 'callRateHz', 'meanMs', 'p50Ms', 'p95Ms', 'p99Ms', 'maxMs']
+    with open(filePath, 'w', newline='') as file:
+      writer = csv.DictWriter(file, fieldnames=fieldNames)
+      writer.writeheader()
+      for summary in self.getSummary():
+        writer.writerow(summary)
+
+callProfiler = CallProfiler()
+
+
+def profiled(name, topLevel=False):
+  """
+  Decorator recording the duration of each call in callProfiler while it is enabled.
+  topLevel marks callbacks invoked directly by VTK or Qt events, used for the frame time estimate.
+  """
+  def decorator(function):
+    statistics = callProfiler.getStatistics(name, topLevel)
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+      if not callProfiler.enabled:
+        return function(*args, **kwargs)
+      startTime = time.perf_counter()
+      try:
+        return function(*args, **kwargs)
+      finally:
+        statistics.record(startTime, time.perf_counter() - startTime)
+    return wrapper
+  return decorator
@@ -0,0 +1,354 @@
+import collections
+import concurrent.futures
+import json
+import logging
+import os
+import numpy as np
+import vtk, slicer
+from vtk.util.numpy_support import numpy_to_vtk, numpy_to_vtkIdTypeArray, vtk_to_numpy
+from .AssetLoader import readModelFile
+
+#
+# Tiling of scenario meshes
+#
+
+def splitIntoTiles(polyData, tileSize):
+  """
+  Split a mesh into cubic tiles of tileSize (mm), by triangle center. Point data (texture
+  coordinates, normals) is kept. Returns a list of polydata.
+  """
+  triangleFilter = vtk.vtkTriangleFilter()
+  triangleFilter.SetInputData(polyData)
+  triangleFilter.PassLinesOff()
+  triangleFilter.PassVertsOff()
+  triangleFilter.Update()
+  triangles = triangleFilter.GetOutput()
+  points = vtk_to_numpy(triangles.GetPoints().GetData())
+  connectivity = vtk_to_numpy(triangles.GetPolys().GetConnectivityArray()).reshape(-1, 3)
+  triangleCenters = points[connectivity].mean(axis=1)
+  tileIndices = np.floor((triangleCenters - triangleCenters.min(axis=0)) / tileSize).astype(np.int64)
+  _, triangleTiles = np.unique(tileIndices, axis=0, return_inverse=True)
+  triangleTiles = triangleTiles.ravel()
+  pointData = triangles.GetPointData()
+  tiles = []
+  for tileIndex in range(triangleTiles.max() + 1 if len(triangleTiles) else 0):
+    tileConnectivity = connectivity[triangleTiles == tileIndex]
+    pointIds, tileConnectivity = np.unique(tileConnectivity, return_inverse=True)
+    tilePolyData = vtk.vtkPolyData()
+    tilePoints = vtk.vtkPoints()
+    tilePoints.SetData(numpy_to_vtk(np.ascontiguousarray(points[pointIds]), deep=True))
+    tilePolyData.SetPoints(tilePoints)
+    cells = vtk.vtkCellArray()
+    offsets = np.arange(0, tileConnectivity.size + 1, 3, dtype=np.int64)
+    cells.SetData(numpy_to_vtkIdTypeArray(offsets, deep=True), numpy_to_vtkIdTypeArray(tileConnectivity.astype(np.int64).ravel(), deep=True))
+    tilePolyData.SetPolys(cells)
+    for arrayIndex in range(pointData.GetNumberOfArrays()):
+      array = pointData.GetArray(arrayIndex)
+      if array is None:
+        continue
+      tileArray = numpy_to_vtk(np.ascontiguousarray(vtk_to_numpy(array)[pointIds]), deep=True)
+      tileArray.SetName(array.GetName())
+      tilePolyData.GetPointData().AddArray(tileArray)
+    if pointData.GetTCoords() is not None:
+      tilePolyData.GetPointData().SetActiveTCoords(pointData.GetTCoords().GetName())
+    if pointData.GetNormals() is not None:
+      tilePolyData.GetPointData().SetActiveNormals(pointData.GetNormals().GetName())
+    tiles.append(tilePolyData)
+  return tiles
+
+
+def decimateTile(polyData, targetReduction):
+  """
+  Reduce the number of triangles of a tile, texture coordinates and normals are interpolated.
+  """
+  decimation = vtk.vtkQuadricDecimation()
+  decimation.SetInputData(polyData)
+  decimation.SetTargetReduction(targetReduction)
+  decimation.AttributeErrorMetricOn()
+  decimation.TCoordsAttributeOn()
+  decimation.NormalsAttributeOn()
+  decimation.Update()
+  result = vtk.vtkPolyData()
+  result.DeepCopy(decimation.GetOutput())
+  return result
+
+#
+# ScenarioTileCache
+#
+
+class ScenarioTileCache(object):
+  """Tiled versions of scenario meshes, for streaming (see ScenarioTileStreamer).
+  A scenario mesh is split into cubic tiles, and each tile is written as VTP files at several
+  levels of detail (LOD 0 is the full mesh). Tiles are written with a tiles.json manifest to a
+  ScenarioTiles folder of the asset cache, named after the hash of the source file (or of the
+  application cache folder, named after the source file, without asset cache), and reused while
+  they are newer than the source file. Tile folders are not counted in the asset cache size.
+  """
+
+  TILE_FOLDER_NAME = 'ScenarioTiles'
+  MANIFEST_FILE_NAME = 'tiles.json'
+
+  def __init__(self, assetCache=None, tileSize=1000.0, lodReductions=(0.0, 0.75, 0.95)):
+    self.assetCache = assetCache
+    self.tileSize = tileSize
+    # fraction of the triangles removed at each level of detail
+    self.lodReductions = list(lodReductions)
+
+  def getTileFolder(self, sourceFilePath):
+    if self.assetCache is not None and self.assetCache.enabled:
+      tileFolderName = '{0}_{1:g}'.format(self.assetCache.fileHash(sourceFilePath), self.tileSize)
+      tileFolder = os.path.join(self.assetCache.cacheDirectory, self.TILE_FOLDER_NAME, tileFolderName)
+    else:
+      tileFolderName = '{0}_{1:g}'.format(os.path.splitext(os.path.basename(sourceFilePath))[0], self.tileSize)
+      tileFolder = os.path.join(slicer.app.cachePath, 'VRTutorial', self.TILE_FOLDER_NAME, tileFolderName)
+    if not self._isWritableFolder(tileFolder):
+      return None
+    return tileFolder
+
+  def getTileSet(self, sourceFilePath):
+    """
+    Return the manifest of the tiles of a scenario mesh file, tiling it if needed. None if the
+    file cannot be read or the tiles cannot be written.
+    """
+    tileFolder = self.getTileFolder(sourceFilePath)
+    if tileFolder is None:
+      return None
+    manifestFilePath = os.path.join(tileFolder, self.MANIFEST_FILE_NAME)
+    if os.path.exists(manifestFilePath) and os.path.getmtime(manifestFilePath) >= os.path.getmtime(sourceFilePath):
+      try:
+        with open(manifestFilePath) as file:
+          tileSet = json.load(file)
+        if tileSet['lodReductions'] == self.lodReductions:
+          tileSet['folder'] = tileFolder
+          return tileSet
+      except (OSError, ValueError, KeyError) as e:
+        logging.warning('Invalid scenario tile manifest {0}: {1}'.format(manifestFilePath, e))
+    polyData = readModelFile(sourceFilePath)
+    if polyData is None:
+      logging.error('Scenario mesh {0} could not be read'.format(sourceFilePath))
+      return None
+    tileSet = self.writeTiles(polyData, tileFolder)
+    with open(manifestFilePath, 'w') as file:
+      json.dump(tileSet, file, indent=2)
+    tileSet['folder'] = tileFolder
+    return tileSet
+
+  def writeTiles(self, polyData, tileFolder):
+    tiles = []
+    for tileIndex, tilePolyData in enumerate(splitIntoTiles(polyData, self.tileSize)):
+      bounds = np.array(tilePolyData.GetBounds()).reshape(3, 2)
+      tile = {
+        'name': 'Tile{0:04d}'.format(tileIndex),
+        'center': bounds.mean(axis=1).tolist(),
+        'radius': float(np.linalg.norm(bounds[:, 1] - bounds[:, 0]) / 2.0),
+        'lods': [],
+        }
+      for lod, targetReduction in enumerate(self.lodReductions):
+        lodPolyData = decimateTile(tilePolyData, targetReduction) if targetReduction > 0 else tilePolyData
+        fileName = '{0}_LOD{1}.vtp'.format(tile['name'], lod)
+        writer = vtk.vtkXMLPolyDataWriter()
+        writer.SetFileName(os.path.join(tileFolder, fileName))
+        writer.SetInputData(lodPolyData)
+        writer.SetDataModeToBinary()
+        writer.Write()
+        tile['lods'].append({'fileName': fileName, 'numberOfTriangles': lodPolyData.GetNumberOfCells(),
+          'memorySizeBytes': lodPolyData.GetActualMemorySize() * 1024})
+      tiles.append(tile)
+    logging.info('Scenario split into {0} tiles written to {1}'.format(len(tiles), tileFolder))
+    return {'tileSize': self.tileSize, 'lodReductions': self.lodReductions, 'tiles': tiles}
+
+  @staticmethod
+  def _isWritableFolder(folderPath):
+    try:
+      if not os.path.exists(folderPath):
+        os.makedirs(folderPath)
+      return os.access(folderPath, os.W_OK)
+    except OSError:
+      return False
+
+#
+# ScenarioTileStreamer
+#
+
+class ScenarioTileStreamer(object):
+  """Shows the tiles of a scenario (see ScenarioTileCache) that are in the camera frustum, at a
+  level of detail chosen by distance, within a memory budget.
+  Call update(camera) regularly from the main thread. Tile meshes are read by worker threads,
+  while a tile is being read the level of detail already in memory (if any) stays shown. Meshes
+  that are not shown are kept for reuse, least recently used ones are released first when the
+  budget is exceeded. Tiles have one model node each, created the first time they are shown.
+  """
+
+  def __init__(self, tileSet, memoryBudgetBytes=256 * 1024 * 1024, lodDistances=(2000.0, 6000.0), maximumDistance=20000.0, maximumNumberOfWorkers=2):
+    """
+    lodDistances: distance (mm) from the camera beyond which the next level of detail is used.
+    """
+    self.tileSet = tileSet
+    self.tiles = tileSet['tiles']
+    self.memoryBudgetBytes = memoryBudgetBytes
+    self.lodDistances = np.array(lodDistances, dtype=float)
+    self.maximumDistance = maximumDistance
+    self.maximumNumberOfWorkers = maximumNumberOfWorkers
+    self.tileCenters = np.array([tile['center'] for tile in self.tiles], dtype=float).reshape(-1, 3)
+    self.tileRadii = np.array([tile['radius'] for tile in self.tiles], dtype=float)
+    self.numberOfLods = len(tileSet['lodReductions'])
+    # (tile index, lod) -> polydata, least recently shown first
+    self.residentPolyData = collections.OrderedDict()
+    self.residentSizeBytes = 0
+    self.pendingLoads = {}
+    self.modelNodes = {}
+    # tile index -> lod of the mesh shown in its model node
+    self.displayedLods = {}
+    # function(modelNode) called when the model node of a tile is created (e.g. to set the texture)
+    self.tileNodeCreatedCallback = None
+    self.executor = None
+
+  def getTileDistances(self, cameraPosition):
+    """
+    Distances from a point to the bounding spheres of all the tiles (0 inside).
+    """
+    return np.maximum(np.linalg.norm(self.tileCenters - cameraPosition, axis=1) - self.tileRadii, 0.0)
+
+  def getVisibleTiles(self, camera, aspect=1.0):
+    """
+    Return the indices of the tiles whose bounding sphere intersects the camera frustum (near and
+    far planes excluded) within maximumDistance, nearest first, and their distances.
+    """
+    planes = [0.0] * 24
+    camera.GetFrustumPlanes(aspect, planes)
+    # left, right, bottom and top planes, normals pointing inside
+    planes = np.array(planes).reshape(6, 4)[:4]
+    planes /= np.linalg.norm(planes[:, :3], axis=1)[:, np.newaxis]
+    signedDistances = self.tileCenters.dot(planes[:, :3].T) + planes[:, 3]
+    distances = self.getTileDistances(np.array(camera.GetPosition()))
+    visible = (signedDistances >= -self.tileRadii[:, np.newaxis]).all(axis=1) & (distances <= self.maximumDistance)
+    visibleTiles = np.nonzero(visible)[0]
+    order = np.argsort(distances[visibleTiles])
+    return visibleTiles[order], distances[visibleTiles][order]
+
+  def selectLods(self, camera, aspect=1.0):
+    """
+    Return the level of detail to show for each visible tile. Tiles are added nearest first;
+    when the budget is exceeded the coarsest level is used, then farther tiles are left out.
+    """
+    visibleTiles, distances = self.getVisibleTiles(camera, aspect)
+    lods = np.minimum(np.searchsorted(self.lodDistances, distances, side='right'), self.numberOfLods - 1)
+    selectedLods = {}
+    totalSizeBytes = 0
+    for tileIndex, lod in zip(visibleTiles.tolist(), lods.tolist()):
+      lodSizes = [lodInfo['memorySizeBytes'] for lodInfo in self.tiles[tileIndex]['lods']]
+      if totalSizeBytes + lodSizes[lod] > self.memoryBudgetBytes:
+        lod = self.numberOfLods - 1
+        if totalSizeBytes + lodSizes[lod] > self.memoryBudgetBytes:
+          break
+      selectedLods[tileIndex] = lod
+      totalSizeBytes += lodSizes[lod]
+    return selectedLods
+
+  def update(self, camera, aspect=1.0):
+    self.collectLoadedTiles()
+    selectedLods = self.selectLods(camera, aspect)
+    for tileIndex, lod in selectedLods.items():
+      if (tileIndex, lod) in self.residentPolyData:
+        self.showTile(tileIndex, lod)
+      else:
+        self.requestTile(tileIndex, lod)
+        # keep showing another level of detail of the tile until this one is read
+        if tileIndex not in self.displayedLods:
+          for otherLod in range(self.numberOfLods - 1, -1, -1):
+            if (tileIndex, otherLod) in self.residentPolyData:
+              self.showTile(tileIndex, otherLod)
+              break
+    for tileIndex in list(self.displayedLods):
+      if tileIndex not in selectedLods:
+        self.hideTile(tileIndex)
+    self.releaseTiles()
+
+  def requestTile(self, tileIndex, lod):
+    key = (tileIndex, lod)
+    if key in self.pendingLoads:
+      return
+    if self.executor is None:
+      self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.maximumNumberOfWorkers)
+    filePath = os.path.join(self.tileSet['folder'], self.tiles[tileIndex]['lods'][lod]['fileName'])
+    self.pendingLoads[key] = self.executor.submit(self.readTile, filePath)
+
+  @staticmethod
+  def readTile(filePath):
+    """
+    Runs on a worker thread.
+    """
+    reader = vtk.vtkXMLPolyDataReader()
+    reader.SetFileName(filePath)
+    reader.Update()
+    if reader.GetErrorCode():
+      return None
+    polyData = vtk.vtkPolyData()
+    polyData.ShallowCopy(reader.GetOutput())
+    return polyData
+
+  def collectLoadedTiles(self):
+    for key, future in list(self.pendingLoads.items()):
+      if not future.done():
+        continue
+      del self.pendingLoads[key]
+      polyData = future.result() if not future.cancelled() else None
+      if polyData is None:
+        logging.warning('Scenario tile {0} LOD {1} could not be read'.format(self.tiles[key[0]]['name'], key[1]))
+        continue
+      self.residentPolyData[key] = polyData
+      self.residentSizeBytes += polyData.GetActualMemorySize() * 1024
+
+  def showTile(self, tileIndex, lod):
+    key = (tileIndex, lod)
+    self.residentPolyData.move_to_end(key)
+    modelNode = self.modelNodes.get(tileIndex)
+    if modelNode is None:
+      modelNode = slicer.modules.models.logic().AddModel(self.residentPolyData[key])
+      modelNode.SetName('ScenarioTile_' + self.tiles[tileIndex]['name'])
+      self.modelNodes[tileIndex] = modelNode
+      if self.tileNodeCreatedCallback:
+        self.tileNodeCreatedCallback(modelNode)
+    elif self.displayedLods.get(tileIndex) != lod:
+      modelNode.SetAndObservePolyData(self.residentPolyData[key])
+    if tileIndex not in self.displayedLods:
+      modelNode.GetDisplayNode().SetVisibility(True)
+    self.displayedLods[tileIndex] = lod
+
+  def hideTile(self, tileIndex):
+    self.modelNodes[tileIndex].GetDisplayNode().SetVisibility(False)
+    del self.displayedLods[tileIndex]
+
+  def releaseTiles(self):
+    """
+    Release the meshes that are not shown, least recently shown first, until within the budget.
+    """
+    for key in list(self.residentPolyData):
+      if self.residentSizeBytes <= self.memoryBudgetBytes:
+        break
+      tileIndex, lod = key
+      if self.displayedLods.get(tileIndex) == lod:
+        continue
+      if tileIndex not in self.displayedLods and self.modelNodes.get(tileIndex) is not None:
+        # the hidden node must not keep the mesh
+        self.modelNodes[tileIndex].SetAndObservePolyData(None)
+      polyData = self.residentPolyData.pop(key)
+      self.residentSizeBytes -= polyData.GetActualMemorySize() * 1024
+
+  def stop(self):
+    if self.executor is not None:
+      for future in self.pendingLoads.values():
+        future.cancel()
+      self.executor.shutdown(wait=False)
+      self.executor = None
+    self.pendingLoads = {}
+
+  def removeModelNodes(self):
+    self.stop()
+    for modelNode in self.modelNodes.values():
+      if modelNode.GetScene() is not None:
+        slicer.mrmlScene.RemoveNode(modelNode)
+    self.modelNodes = {}
+    self.displayedLods = {}
+    self.residentPolyData.clear()
+    self.residentSizeBytes = 0
@@ -0,0 +1,279 @@
+import numpy as np
+import vtk
+
+#
+# SceneBVH
+#
+
+class SceneBVH(object):
+  """Bounding volume hierarchy over the interactable models of the scene, for contact queries
+  of many probe spheres (hands, controller tips) against all the models at once.
+  Leaves are the world bounding boxes of the models, computed from their model bounding box
+  and model to world matrix. When a model moves only its leaf and the ancestors of the leaf are
+  refitted, the tree is rebuilt when models are added or removed, or when refitting made its
+  boxes much larger than at the last build.
+  Queries traverse the tree for all the probes together with array operations; the mesh test
+  (closest point search in a cell locator built once per mesh, in model coordinates) only runs
+  for the probe and model pairs whose boxes overlap.
+  If a transform event dispatcher is given, models are refitted when their transform events are
+  dispatched, otherwise their world matrices are compared at each query.
+  """
+
+  def __init__(self, transformDispatcher=None, proxyCache=None, rebuildCostRatio=2.0):
+    self.transformDispatcher = transformDispatcher
+    self.proxyCache = proxyCache
+    self.rebuildCostRatio = rebuildCostRatio
+    self.objects = []
+    self.objectIndices = {}
+    self.needsRebuild = True
+    self.buildCost = 0.0
+    self._worldMatrix = vtk.vtkMatrix4x4()
+    self.resetStatistics()
+
+  def resetStatistics(self):
+    self.numberOfRebuilds = 0
+    self.numberOfRefittedLeaves = 0
+    self.numberOfMeshTests = 0
+
+  def addObject(self, modelNode):
+    if modelNode is None or modelNode in self.objectIndices:
+      return
+    self.objectIndices[modelNode] = len(self.objects)
+    self.objects.append({'node': modelNode, 'polyData': None, 'polyDataMTime': 0, 'locator': None,
+      'modelToWorld': None, 'worldToModel': None, 'dirty': True})
+    if self.transformDispatcher is not None:
+      # before task callbacks, so that tasks query refitted boxes
+      self.transformDispatcher.addCallback(modelNode, self.onObjectModified, priority=50)
+    self.needsRebuild = True
+
+  def removeObject(self, modelNode):
+    if modelNode not in self.objectIndices:
+      return
+    if self.transformDispatcher is not None:
+      self.transformDispatcher.removeCallback(modelNode, self.onObjectModified)
+    del self.objects[self.objectIndices[modelNode]]
+    self.objectIndices = {sceneObject['node']: objectIndex for objectIndex, sceneObject in enumerate(self.objects)}
+    self.needsRebuild = True
+
+  def clear(self):
+    for sceneObject in list(self.objects):
+      self.removeObject(sceneObject['node'])
+
+  def getNodes(self):
+    return [sceneObject['node'] for sceneObject in self.objects]
+
+  def onObjectModified(self, modelNode, event):
+    objectIndex = self.objectIndices.get(modelNode)
+    if objectIndex is not None:
+      self.objects[objectIndex]['dirty'] = True
+
+  def getModelToWorld(self, modelNode):
+    if self.transformDispatcher is not None:
+      worldMatrix = self.transformDispatcher.getWorldMatrix(modelNode)
+      if worldMatrix is not None:
+        return worldMatrix.copy()
+    parentTransformNode = modelNode.GetParentTransformNode()
+    if parentTransformNode is not None:
+      parentTransformNode.GetMatrixTransformToWorld(self._worldMatrix)
+    else:
+      self._worldMatrix.Identity()
+    return np.array([[self._worldMatrix.GetElement(row, column) for column in range(4)] for row in range(4)])
+
+  def updateMesh(self, sceneObject):
+    """
+    Build the cell locator and model bounding box of an object if its mesh changed.
+    Returns True if it changed.
+    """
+    modelNode = sceneObject['node']
+    polyData = modelNode.GetPolyData()
+    if polyData is sceneObject['polyData'] and (polyData is None or polyData.GetMTime() == sceneObject['polyDataMTime']):
+      return False
+    sceneObject['polyData'] = polyData
+    sceneObject['polyDataMTime'] = polyData.GetMTime() if polyData is not None else 0
+    collisionPolyData = self.proxyCache.getProxyPolyData(modelNode) if self.proxyCache is not None and polyData is not None else None
+    if collisionPolyData is None:
+      collisionPolyData = polyData
+    if collisionPolyData is None or collisionPolyData.GetNumberOfPoints() == 0:
+      sceneObject['locator'] = None
+      sceneObject['corners'] = np.zeros((0, 3))
+      return True
+    locator = vtk.vtkStaticCellLocator()
+    locator.SetDataSet(collisionPolyData)
+    locator.BuildLocator()
+    sceneObject['locator'] = locator
+    bounds = np.array(collisionPolyData.GetBounds()).reshape(3, 2)
+    sceneObject['corners'] = np.array([[bounds[0, i], bounds[1, j], bounds[2, k]] for i in range(2) for j in range(2) for k in range(2)])
+    return True
+
+  def updateLeaf(self, sceneObject):
+    """
+    Read the world matrix of an object and compute its world bounding box. Returns True if the
+    box changed.
+    """
+    meshModified = self.updateMesh(sceneObject)
+    modelToWorld = self.getModelToWorld(sceneObject['node'])
+    sceneObject['dirty'] = self.transformDispatcher is None
+    if not meshModified and sceneObject['modelToWorld'] is not None and np.array_equal(modelToWorld, sceneObject['modelToWorld']):
+      return False
+    sceneObject['modelToWorld'] = modelToWorld
+    sceneObject['worldToModel'] = np.linalg.inv(modelToWorld)
+    # conservative ratio of world to model distances
+    sceneObject['minimumScale'] = float(np.min(np.linalg.svd(modelToWorld[:3, :3], compute_uv=False)))
+    corners = sceneObject['corners']
+    if len(corners) == 0:
+      # empty mesh, the box is inverted so that it overlaps nothing
+      sceneObject['boxMin'] = np.full(3, np.inf)
+      sceneObject['boxMax'] = np.full(3, -np.inf)
+    else:
+      worldCorners = corners.dot(modelToWorld[:3, :3].T) + modelToWorld[:3, 3]
+      sceneObject['boxMin'] = worldCorners.min(axis=0)
+      sceneObject['boxMax'] = worldCorners.max(axis=0)
+    return True
+
+  def build(self):
+    """
+    Build the tree over all the objects by splitting them at the median of the longest axis.
+    Nodes are stored in depth first order, so the parent of a node is always before it.
+    """
+    for sceneObject in self.objects:
+      self.updateLeaf(sceneObject)
+    self.nodeMin = []
+    self.nodeMax = []
+    self.nodeLeft = []
+    self.nodeRight = []
+    self.nodeParent = []
+    self.nodeObject = []
+    if self.objects:
+      self._buildNode(list(range(len(self.objects))), -1)
+    self.nodeMin = np.array(self.nodeMin, dtype=float).reshape(-1, 3)
+    self.nodeMax = np.array(self.nodeMax, dtype=float).reshape(-1, 3)
+    self.nodeLeft = np.array(self.nodeLeft, dtype=np.int64)
+    self.nodeRight = np.array(self.nodeRight, dtype=np.int64)
+    self.nodeParent = np.array(self.nodeParent, dtype=np.int64)
+    self.nodeObject = np.array(self.nodeObject, dtype=np.int64)
+    self.leafNodes = np.zeros(len(self.objects), dtype=np.int64)
+    self.leafNodes[self.nodeObject[self.nodeObject >= 0]] = np.nonzero(self.nodeObject >= 0)[0]
+    self.buildCost = self.getCost()
+    self.needsRebuild = False
+    self.numberOfRebuilds += 1
+
+  def _buildNode(self, objectIndices, parentIndex):
+    nodeIndex = len(self.nodeMin)
+    boxMin = np.min([self.objects[objectIndex]['boxMin'] for objectIndex in objectIndices], axis=0)
+    boxMax = np.max([self.objects[objectIndex]['boxMax'] for objectIndex in objectIndices], axis=0)
+    self.nodeMin.append(boxMin)
+    self.nodeMax.append(boxMax)
+    self.nodeParent.append(parentIndex)
+    self.nodeLeft.append(-1)
+    self.nodeRight.append(-1)
+    if len(objectIndices) == 1:
+      self.nodeObject.append(objectIndices[0])
+      return nodeIndex
+    self.nodeObject.append(-1)
+    centers = np.array([(self.objects[objectIndex]['boxMin'] + self.objects[objectIndex]['boxMax']) / 2.0 for objectIndex in objectIndices])
+    # empty meshes have infinite boxes, they are sorted by index
+    centers[~np.isfinite(centers)] = 0.0
+    axis = int(np.argmax(centers.max(axis=0) - centers.min(axis=0)))
+    order = np.argsort(centers[:, axis], kind='stable')
+    half = len(objectIndices) // 2
+    self.nodeLeft[nodeIndex] = self._buildNode([objectIndices[i] for i in order[:half]], nodeIndex)
+    self.nodeRight[nodeIndex] = self._buildNode([objectIndices[i] for i in order[half:]], nodeIndex)
+    return nodeIndex
+
+  def getCost(self):
+    """
+    Sum of the surface areas of the internal node boxes, grows when refitting loosens the tree.
+    """
+    internal = self.nodeObject < 0
+    sizes = np.maximum(self.nodeMax[internal] - self.nodeMin[internal], 0.0)
+    return float(np.sum(sizes[:, 0] * sizes[:, 1] + sizes[:, 1] * sizes[:, 2] + sizes[:, 2] * sizes[:, 0]))
+
+  def refit(self):
+    """
+    Update the boxes of the moved objects and of their ancestors only.
+    """
+    if self.needsRebuild:
+      self.build()
+      return
+    modifiedNodes = set()
+    for objectIndex, sceneObject in enumerate(self.objects):
+      if not sceneObject['dirty'] or not self.updateLeaf(sceneObject):
+        continue
+      self.numberOfRefittedLeaves += 1
+      nodeIndex = self.leafNodes[objectIndex]
+      self.nodeMin[nodeIndex] = sceneObject['boxMin']
+      self.nodeMax[nodeIndex] = sceneObject['boxMax']
+      nodeIndex = self.nodeParent[nodeIndex]
+      while nodeIndex >= 0 and nodeIndex not in modifiedNodes:
+        modifiedNodes.add(nodeIndex)
+        nodeIndex = self.nodeParent[nodeIndex]
+    if not modifiedNodes:
+      return
+    # children are after their parent, refit deepest nodes first
+    for nodeIndex in sorted(modifiedNodes, reverse=True):
+      left, right = self.nodeLeft[nodeIndex], self.nodeRight[nodeIndex]
+      self.nodeMin[nodeIndex] = np.minimum(self.nodeMin[left], self.nodeMin[right])
+      self.nodeMax[nodeIndex] = np.maximum(self.nodeMax[left], self.nodeMax[right])
+    if self.getCost() > self.rebuildCostRatio * max(self.buildCost, 1e-6):
+      self.build()
+
+  def getCandidatePairs(self, centers, radii):
+    """
+    Return the probe and object indices of all the pairs whose boxes overlap, traversing the
+    tree level by level for all the probes at once.
+    """
+    if len(self.nodeMin) == 0 or len(centers) == 0:
+      return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    probeIndices = np.arange(len(centers))
+    nodeIndices = np.zeros(len(centers), dtype=np.int64)
+    candidateProbes = []
+    candidateObjects = []
+    while len(nodeIndices):
+      probeCenters = centers[probeIndices]
+      closestPoints = np.clip(probeCenters, self.nodeMin[nodeIndices], self.nodeMax[nodeIndices])
+      overlap = np.sum((closestPoints - probeCenters) ** 2, axis=1) <= radii[probeIndices] ** 2
+      probeIndices = probeIndices[overlap]
+      nodeIndices = nodeIndices[overlap]
+      objectIndices = self.nodeObject[nodeIndices]
+      isLeaf = objectIndices >= 0
+      candidateProbes.append(probeIndices[isLeaf])
+      candidateObjects.append(objectIndices[isLeaf])
+      probeIndices = np.concatenate([probeIndices[~isLeaf], probeIndices[~isLeaf]])
+      nodeIndices = np.concatenate([self.nodeLeft[nodeIndices[~isLeaf]], self.nodeRight[nodeIndices[~isLeaf]]])
+    return np.concatenate(candidateProbes), np.concatenate(candidateObjects)
+
+  def findContacts(self, centers, radii):
+    """
+    Find the models touched by probe spheres (world centers N x 3 and radii, mm).
+    Returns a list of (probe index, model node, distance) for each probe and model in contact,
+    where distance is from the probe center to the closest mesh point.
+    Distances are exact for rigid and uniformly scaled models.
+    """
+    centers = np.asarray(centers, dtype=float).reshape(-1, 3)
+    radii = np.broadcast_to(np.asarray(radii, dtype=float), (len(centers),))
+    self.refit()
+    probeIndices, objectIndices = self.getCandidatePairs(centers, radii)
+    if len(probeIndices) == 0:
+      return []
+    # probe centers in the coordinates of the candidate models
+    worldToModel = np.array([self.objects[objectIndex]['worldToModel'] for objectIndex in objectIndices])
+    modelCenters = np.einsum('nij,nj->ni', worldToModel[:, :3, :3], centers[probeIndices]) + worldToModel[:, :3, 3]
+    contacts = []
+    closestPoint = [0.0, 0.0, 0.0]
+    cellId = vtk.reference(0)
+    subId = vtk.reference(0)
+    squaredDistance = vtk.reference(0.0)
+    for probeIndex, objectIndex, modelCenter in zip(probeIndices.tolist(), objectIndices.tolist(), modelCenters):
+      sceneObject = self.objects[objectIndex]
+      if sceneObject['locator'] is None:
+        continue
+      self.numberOfMeshTests += 1
+      modelRadius = radii[probeIndex] / max(sceneObject['minimumScale'], 1e-9)
+      if not sceneObject['locator'].FindClosestPointWithinRadius(modelCenter, modelRadius, closestPoint, cellId, subId, squaredDistance):
+        continue
+      modelToWorld = sceneObject['modelToWorld']
+      worldClosestPoint = modelToWorld[:3, :3].dot(closestPoint) + modelToWorld[:3, 3]
+      distance = float(np.linalg.norm(worldClosestPoint - centers[probeIndex]))
+      if distance <= radii[probeIndex]:
+        contacts.append((probeIndex, sceneObject['node'], distance))
+    return contacts
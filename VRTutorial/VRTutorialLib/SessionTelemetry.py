@@ -0,0 +1,225 @@
+import glob
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import numpy as np
+from .TrackingRecording import DEVICE_NAMES, SAMPLE_DTYPE
+
+EVENT_DTYPE = np.dtype([('time', '<f8'), ('event', '<u2'), ('value', '<f8')])
+
+#
+# ChunkedRingBuffer
+#
+
+class ChunkedRingBuffer(object):
+  """Fixed number of preallocated chunks of samples, used in turn. A full chunk is handed to the
+  writer thread and can only be reused once it has been written: if the writer falls behind,
+  new samples are dropped (and counted) instead of growing the memory.
+  """
+
+  def __init__(self, name, dtype, chunkSize=8192, numberOfChunks=4):
+    self.name = name
+    self.chunks = np.zeros((numberOfChunks, chunkSize), dtype=dtype)
+    self.chunkSizes = [0] * numberOfChunks
+    self.chunkFree = [True] * numberOfChunks
+    self.currentChunk = 0
+    self.numberOfChunksQueued = 0
+    self.numberOfSamples = 0
+    self.numberOfDroppedSamples = 0
+
+  def reserve(self):
+    """
+    Return the (chunk, row) indices where to write the next sample, None if all chunks are
+    waiting to be written.
+    """
+    if not self.chunkFree[self.currentChunk]:
+      self.numberOfDroppedSamples += 1
+      return None
+    row = self.chunkSizes[self.currentChunk]
+    self.chunkSizes[self.currentChunk] += 1
+    self.numberOfSamples += 1
+    return self.currentChunk, row
+
+  def isCurrentChunkFull(self):
+    return self.chunkSizes[self.currentChunk] == self.chunks.shape[1]
+
+  def takeCurrentChunk(self):
+    """
+    Mark the current chunk as being written and move to the next one. Returns the chunk index and
+    its sequence number, None if the current chunk is empty.
+    """
+    chunkIndex = self.currentChunk
+    if self.chunkSizes[chunkIndex] == 0 or not self.chunkFree[chunkIndex]:
+      return None
+    self.chunkFree[chunkIndex] = False
+    sequenceNumber = self.numberOfChunksQueued
+    self.numberOfChunksQueued += 1
+    self.currentChunk = (chunkIndex + 1) % len(self.chunks)
+    return chunkIndex, sequenceNumber
+
+  def releaseChunk(self, chunkIndex):
+    """
+    Called by the writer thread once the chunk is on disk.
+    """
+    self.chunkSizes[chunkIndex] = 0
+    self.chunkFree[chunkIndex] = True
+
+#
+# SessionTelemetryRecorder
+#
+
+class SessionTelemetryRecorder(object):
+  """Logs the poses of the tracked devices and the task events of a tutorial session.
+  Poses are recorded by a raw TransformEventDispatcher callback (on every tracking event, before
+  the dispatcher coalesces them, with the world matrix it shares with the task callbacks) into
+  preallocated ring buffers. Full
+  chunks are written as compressed NumPy files by a background thread, so the observers never
+  wait for the disk. stop() writes the remaining samples and waits for the writer thread.
+  Files of a session (see readSessionTelemetry):
+    session.json: device and event names, start time, sample counts
+    poses-NNNNNN.npz, events-NNNNNN.npz: chunks of samples in recording order
+  """
+
+  def __init__(self, sessionDirectory, transformDispatcher, transformNodes, deviceNames=None, chunkSize=8192, numberOfChunks=4):
+    """
+    transformNodes: list of transform nodes, None entries are skipped (device not tracked).
+    """
+    self.sessionDirectory = sessionDirectory
+    self.transformDispatcher = transformDispatcher
+    self.transformNodes = list(transformNodes)
+    self.deviceNames = list(deviceNames) if deviceNames else DEVICE_NAMES[:len(transformNodes)]
+    self.deviceIndices = {}
+    self.poses = ChunkedRingBuffer('poses', SAMPLE_DTYPE, chunkSize, numberOfChunks)
+    self.events = ChunkedRingBuffer('events', EVENT_DTYPE, max(1, chunkSize // 16), numberOfChunks)
+    self.eventNames = []
+    self.eventCodes = {}
+    # additional session information written to session.json (e.g. task names)
+    self.metadata = {}
+    self.startTime = 0.0
+    self.startDateTime = None
+    self.writeQueue = queue.Queue()
+    self.writerThread = None
+
+  def isRecording(self):
+    return self.writerThread is not None
+
+  def start(self):
+    if self.isRecording():
+      return
+    if not os.path.exists(self.sessionDirectory):
+      os.makedirs(self.sessionDirectory)
+    self.startTime = time.perf_counter()
+    self.startDateTime = time.strftime('%Y-%m-%dT%H:%M:%S')
+    self.writerThread = threading.Thread(target=self.writeChunks, name='VRTutorialTelemetryWriter')
+    self.writerThread.daemon = True
+    self.writerThread.start()
+    for deviceIndex, transformNode in enumerate(self.transformNodes):
+      if transformNode is None:
+        continue
+      self.deviceIndices[transformNode] = deviceIndex
+      # Raw callbacks run before the task callbacks, so the pose that completes a task is logged
+      # before the task event
+      self.transformDispatcher.addRawCallback(transformNode, self.onDeviceModified)
+    self.writeMetadata()
+
+  def stop(self):
+    """
+    Stop recording, write all remaining samples and wait until they are on disk.
+    """
+    if not self.isRecording():
+      return
+    for transformNode in self.deviceIndices:
+      self.transformDispatcher.removeRawCallback(transformNode, self.onDeviceModified)
+    self.deviceIndices = {}
+    self.queueCurrentChunk(self.poses)
+    self.queueCurrentChunk(self.events)
+    self.writeQueue.put(None)
+    self.writerThread.join()
+    self.writerThread = None
+    self.writeMetadata()
+    if self.poses.numberOfDroppedSamples or self.events.numberOfDroppedSamples:
+      logging.warning('Telemetry writer could not keep up, {0} poses and {1} events were dropped'.format(
+        self.poses.numberOfDroppedSamples, self.events.numberOfDroppedSamples))
+
+  def onDeviceModified(self, transformNode, event):
+    indices = self.poses.reserve()
+    if indices is None:
+      return
+    chunk, row = indices
+    chunks = self.poses.chunks
+    chunks['time'][chunk, row] = time.perf_counter() - self.startTime
+    chunks['device'][chunk, row] = self.deviceIndices[transformNode]
+    chunks['matrix'][chunk, row] = self.transformDispatcher.getWorldMatrix(transformNode)[:3].ravel()
+    if self.poses.isCurrentChunkFull():
+      self.queueCurrentChunk(self.poses)
+
+  def recordEvent(self, eventName, value=0.0):
+    """
+    Log a task event (e.g. 'CollisionDetected') with an optional numeric value.
+    """
+    if not self.isRecording():
+      return
+    eventCode = self.eventCodes.get(eventName)
+    if eventCode is None:
+      eventCode = len(self.eventNames)
+      self.eventNames.append(eventName)
+      self.eventCodes[eventName] = eventCode
+    indices = self.events.reserve()
+    if indices is None:
+      return
+    chunk, row = indices
+    self.events.chunks[chunk, row] = (time.perf_counter() - self.startTime, eventCode, value)
+    if self.events.isCurrentChunkFull():
+      self.queueCurrentChunk(self.events)
+
+  def queueCurrentChunk(self, ringBuffer):
+    chunk = ringBuffer.takeCurrentChunk()
+    if chunk is not None:
+      self.writeQueue.put((ringBuffer,) + chunk)
+
+  def writeChunks(self):
+    """
+    Runs on the writer thread.
+    """
+    while True:
+      item = self.writeQueue.get()
+      if item is None:
+        return
+      ringBuffer, chunkIndex, sequenceNumber = item
+      filePath = os.path.join(self.sessionDirectory, '{0}-{1:06d}.npz'.format(ringBuffer.name, sequenceNumber))
+      try:
+        np.savez_compressed(filePath, samples=ringBuffer.chunks[chunkIndex, :ringBuffer.chunkSizes[chunkIndex]])
+      except OSError as e:
+        logging.error('Failed to write telemetry file {0}: {1}'.format(filePath, e))
+      ringBuffer.releaseChunk(chunkIndex)
+
+  def writeMetadata(self):
+    metadata = dict(self.metadata)
+    metadata.update({
+      'startDateTime': self.startDateTime,
+      'deviceNames': self.deviceNames,
+      'eventNames': self.eventNames,
+      'numberOfPoses': self.poses.numberOfSamples,
+      'numberOfEvents': self.events.numberOfSamples,
+      'droppedPoses': self.poses.numberOfDroppedSamples,
+      'droppedEvents': self.events.numberOfDroppedSamples,
+      })
+    with open(os.path.join(self.sessionDirectory, 'session.json'), 'w') as file:
+      json.dump(metadata, file, indent=2)
+
+
+def readSessionTelemetry(sessionDirectory):
+  """
+  Return the metadata, the pose samples (SAMPLE_DTYPE, see TrackingRecording) and the event
+  samples (EVENT_DTYPE) of a recorded session.
+  """
+  with open(os.path.join(sessionDirectory, 'session.json')) as file:
+    metadata = json.load(file)
+  session = {'metadata': metadata}
+  for name, dtype in [('poses', SAMPLE_DTYPE), ('events', EVENT_DTYPE)]:
+    chunks = [np.load(filePath)['samples'] for filePath in sorted(glob.glob(os.path.join(sessionDirectory, name + '-*.npz')))]
+    session[name] = np.concatenate(chunks) if chunks else np.zeros(0, dtype=dtype)
+  return session
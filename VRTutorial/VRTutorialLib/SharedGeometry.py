@@ -0,0 +1,125 @@
+import logging
+import numpy as np
+import slicer
+from vtk.util.numpy_support import vtk_to_numpy
+
+INSTANCE_TRANSFORM_ATTRIBUTE = 'VRTutorial.InstanceTransform'
+INSTANCE_OF_ATTRIBUTE = 'VRTutorial.InstanceOf'
+
+#
+# Instance transform fitting
+#
+
+def fitInstanceMatrix(sourcePolyData, instancePolyData, relativeTolerance=1e-4):
+  """
+  Return the 4x4 matrix (numpy array) that maps sourcePolyData points onto instancePolyData points,
+  or None if the meshes are not rigid (or mirrored) copies of each other with the same point order
+  and the same cells.
+  """
+  if sourcePolyData.GetNumberOfPoints() != instancePolyData.GetNumberOfPoints() or sourcePolyData.GetNumberOfPoints() < 3:
+    return None
+  if sourcePolyData.GetNumberOfCells() != instancePolyData.GetNumberOfCells():
+    return None
+  for getCells in ['GetPolys', 'GetStrips', 'GetLines', 'GetVerts']:
+    sourceCells = getattr(sourcePolyData, getCells)()
+    instanceCells = getattr(instancePolyData, getCells)()
+    if sourceCells.GetNumberOfCells() != instanceCells.GetNumberOfCells():
+      return None
+    if sourceCells.GetNumberOfCells() and not np.array_equal(vtk_to_numpy(sourceCells.GetConnectivityArray()), vtk_to_numpy(instanceCells.GetConnectivityArray())):
+      return None
+  sourcePoints = vtk_to_numpy(sourcePolyData.GetPoints().GetData()).astype(float)
+  instancePoints = vtk_to_numpy(instancePolyData.GetPoints().GetData()).astype(float)
+  sourceCentroid = sourcePoints.mean(axis=0)
+  instanceCentroid = instancePoints.mean(axis=0)
+  # Orthogonal Procrustes, reflections are allowed so that mirrored meshes are found as well
+  u, s, vt = np.linalg.svd((sourcePoints - sourceCentroid).T.dot(instancePoints - instanceCentroid))
+  rotation = vt.T.dot(u.T)
+  instanceMatrix = np.eye(4)
+  instanceMatrix[:3, :3] = rotation
+  instanceMatrix[:3, 3] = instanceCentroid - rotation.dot(sourceCentroid)
+  residual = np.max(np.linalg.norm(sourcePoints.dot(rotation.T) + instanceMatrix[:3, 3] - instancePoints, axis=1))
+  size = np.linalg.norm(instancePoints.max(axis=0) - instancePoints.min(axis=0))
+  if residual > relativeTolerance * size:
+    return None
+  return instanceMatrix
+
+#
+# SharedGeometryInstancer
+#
+
+class SharedGeometryInstancer(object):
+  """Creates model nodes that share the polydata of another model node.
+  Each instance has its own display node and is placed by a hidden linear transform node (the
+  instance transform, which may mirror). To move an instance, its instance transform is
+  parented instead of the model (see getAttachmentNode).
+  The instance matrix between two mesh files is fitted once, from the full meshes, and
+  stored in the asset cache index keyed by the hashes of both files, so later sessions create
+  the instance without reading the instance file at all.
+  """
+
+  def __init__(self, assetCache):
+    self.assetCache = assetCache
+
+  def getInstanceMatrix(self, sourceFilePath, instanceFilePath, sourcePolyData):
+    """
+    Return the matrix placing the source mesh where the instance file mesh is, None if the
+    instance file is not a rigid or mirrored copy of the source.
+    """
+    key = 'instance-{0}-{1}'.format(self.assetCache.fileHash(sourceFilePath), self.assetCache.fileHash(instanceFilePath))
+    metadata = self.assetCache.getMetadata(key)
+    if metadata is not None:
+      return np.array(metadata['matrix']).reshape(4, 4) if metadata['instanceable'] else None
+    # Not known yet, read the instance file once and fit
+    from .AssetLoader import readModelFile
+    instancePolyData = readModelFile(instanceFilePath)
+    instanceMatrix = fitInstanceMatrix(sourcePolyData, instancePolyData) if instancePolyData is not None else None
+    if instanceMatrix is None:
+      logging.info('{0} is not an instance of {1}, it is loaded separately'.format(instanceFilePath, sourceFilePath))
+      self.assetCache.setMetadata(key, {'instanceable': False})
+    else:
+      self.assetCache.setMetadata(key, {'instanceable': True, 'matrix': instanceMatrix.ravel().tolist()})
+    return instanceMatrix
+
+  def addInstance(self, sourceModelNode, nodeName, instanceMatrix):
+    """
+    Add a model node sharing the polydata of sourceModelNode, placed by instanceMatrix.
+    """
+    transformNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLLinearTransformNode', nodeName + '_InstanceTransform')
+    transformNode.SetAttribute(INSTANCE_TRANSFORM_ATTRIBUTE, 'true')
+    transformNode.SetHideFromEditors(True)
+    transformNode.SetMatrixTransformToParent(slicer.util.vtkMatrixFromArray(instanceMatrix))
+    modelNode = slicer.modules.models.logic().AddModel(sourceModelNode.GetPolyData())
+    modelNode.SetName(nodeName)
+    modelNode.SetAttribute(INSTANCE_OF_ATTRIBUTE, sourceModelNode.GetID())
+    sourceFilePath = sourceModelNode.GetAttribute(self.assetCache.SOURCE_FILE_ATTRIBUTE)
+    if sourceFilePath:
+      # Same mesh as the source, so the same collision proxy applies
+      modelNode.SetAttribute(self.assetCache.SOURCE_FILE_ATTRIBUTE, sourceFilePath)
+    modelNode.SetAndObserveTransformNodeID(transformNode.GetID())
+    return modelNode
+
+  @staticmethod
+  def getInstanceTransformNode(modelNode):
+    parentTransformNode = modelNode.GetParentTransformNode()
+    if parentTransformNode is not None and parentTransformNode.GetAttribute(INSTANCE_TRANSFORM_ATTRIBUTE):
+      return parentTransformNode
+    return None
+
+  @staticmethod
+  def getAttachmentNode(modelNode):
+    """
+    Return the node to parent under a transform to move modelNode: its instance transform if
+    it is an instance, otherwise the model itself.
+    """
+    instanceTransformNode = SharedGeometryInstancer.getInstanceTransformNode(modelNode)
+    return instanceTransformNode if instanceTransformNode is not None else modelNode
+
+  @staticmethod
+  def removeModel(modelNode):
+    """
+    Remove a model node and its instance transform, if any. Shared polydata is kept alive by other instances.
+    """
+    instanceTransformNode = SharedGeometryInstancer.getInstanceTransformNode(modelNode)
+    slicer.mrmlScene.RemoveNode(modelNode)
+    if instanceTransformNode is not None:
+      slicer.mrmlScene.RemoveNode(instanceTransformNode)
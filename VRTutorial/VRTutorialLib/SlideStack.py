@@ -0,0 +1,138 @@
+import glob
+import hashlib
+import logging
+import os
+import re
+import numpy as np
+import vtk, slicer
+from vtk.util.numpy_support import vtk_to_numpy
+
+#
+# Slide files
+#
+
+def getSlideFilePaths(slidesDirectory):
+  """
+  Return the PNG files of a folder in slide order (Slide2.PNG before Slide10.PNG).
+  """
+  filePaths = [filePath for filePath in glob.glob(os.path.join(slidesDirectory, '*'))
+    if os.path.splitext(filePath)[1].lower() == '.png']
+  naturalKey = lambda filePath: [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', os.path.basename(filePath))]
+  return sorted(filePaths, key=naturalKey)
+
+
+def readSlideImage(filePath):
+  """
+  Return the RGB pixels of a PNG file (rows x columns x 3, first row at the top of the image).
+  """
+  reader = vtk.vtkPNGReader()
+  reader.SetFileName(filePath)
+  # keep the rows in file order, as the Slicer image readers do
+  reader.FileLowerLeftOn()
+  reader.Update()
+  imageData = reader.GetOutput()
+  columns, rows, _ = imageData.GetDimensions()
+  numberOfComponents = imageData.GetNumberOfScalarComponents()
+  pixels = vtk_to_numpy(imageData.GetPointData().GetScalars()).reshape(rows, columns, numberOfComponents)
+  if numberOfComponents < 3:
+    # grayscale (with or without alpha)
+    return np.repeat(pixels[:, :, :1], 3, axis=2).astype(np.uint8)
+  return pixels[:, :, :3].astype(np.uint8)
+
+#
+# InstructionSlideStack
+#
+
+class InstructionSlideStack(object):
+  """All the instruction slides packed as the slices of a single RGB volume.
+  The slides are decoded once and the stack is stored in the asset cache, keyed by the content
+  of all the slide files, so that later sessions load one file. Slides of different sizes are
+  padded to the largest one. Once the volume is shown in a slice view, switching slides only
+  changes the slice offset: nothing is read, allocated or rebuilt.
+  """
+
+  NODE_NAME = 'InstructionSlides'
+
+  def __init__(self, slidesDirectory, assetCache=None):
+    self.slidesDirectory = slidesDirectory
+    self.assetCache = assetCache
+    self.slideFilePaths = getSlideFilePaths(slidesDirectory)
+    self.volumeNode = None
+    self.currentSlideIndex = 0
+
+  def getNumberOfSlides(self):
+    return len(self.slideFilePaths)
+
+  def getStackImageData(self):
+    """
+    Decode all the slides into a vtkImageData with one slice per slide.
+    """
+    slides = [readSlideImage(filePath) for filePath in self.slideFilePaths]
+    rows = max(slide.shape[0] for slide in slides)
+    columns = max(slide.shape[1] for slide in slides)
+    pixels = np.zeros((len(slides), rows, columns, 3), dtype=np.uint8)
+    for slideIndex, slide in enumerate(slides):
+      pixels[slideIndex, :slide.shape[0], :slide.shape[1]] = slide
+    imageData = vtk.vtkImageData()
+    imageData.SetDimensions(columns, rows, len(slides))
+    imageData.AllocateScalars(vtk.VTK_UNSIGNED_CHAR, 3)
+    vtk_to_numpy(imageData.GetPointData().GetScalars())[:] = pixels.reshape(-1, 3)
+    return imageData
+
+  def getCacheEntryFilePath(self):
+    sha256 = hashlib.sha256()
+    for filePath in self.slideFilePaths:
+      sha256.update(self.assetCache.fileHash(filePath).encode())
+    return os.path.join(self.assetCache.cacheDirectory, 'slides-{0}.vti'.format(sha256.hexdigest()))
+
+  def load(self):
+    """
+    Create the slide volume node (or return the existing one), from the asset cache if available.
+    Returns None if there is no slide.
+    """
+    if self.volumeNode is not None and self.volumeNode.GetScene() is not None:
+      return self.volumeNode
+    if not self.slideFilePaths:
+      logging.error('No instruction slides found in ' + self.slidesDirectory)
+      return None
+    imageData = None
+    if self.assetCache is not None and self.assetCache.enabled:
+      entryFilePath = self.getCacheEntryFilePath()
+      imageData = self.assetCache.readCachedData(entryFilePath, vtk.vtkXMLImageDataReader())
+      if imageData is None:
+        imageData = self.getStackImageData()
+        self.assetCache.writeCachedData(entryFilePath, vtk.vtkXMLImageDataWriter(), imageData,
+          {'type': 'slides', 'numberOfSlides': self.getNumberOfSlides()})
+      self.assetCache.touch(entryFilePath)
+    else:
+      imageData = self.getStackImageData()
+    self.volumeNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLVectorVolumeNode', self.NODE_NAME)
+    self.volumeNode.SetAndObserveImageData(imageData)
+    # Same orientation as a PNG loaded by Slicer (LPS image axes), slice k at offset k
+    self.volumeNode.SetIJKToRASDirections(-1, 0, 0, 0, -1, 0, 0, 0, 1)
+    self.volumeNode.CreateDefaultDisplayNodes()
+    return self.volumeNode
+
+  def show(self, sliceLogic):
+    """
+    Show the slide volume in a slice view, fitted to the view, at the current slide.
+    """
+    if sliceLogic is None or self.volumeNode is None:
+      return
+    sliceLogic.GetSliceCompositeNode().SetBackgroundVolumeID(self.volumeNode.GetID())
+    sliceLogic.FitSliceToAll()
+    self.showSlide(sliceLogic, self.currentSlideIndex)
+
+  def getSliceOffset(self, slideIndex):
+    ijkToRAS = vtk.vtkMatrix4x4()
+    self.volumeNode.GetIJKToRASMatrix(ijkToRAS)
+    return ijkToRAS.MultiplyPoint((0, 0, slideIndex, 1))[2]
+
+  def showSlide(self, sliceLogic, slideIndex):
+    """
+    Show a slide (clamped to the available slides) by moving the slice view to it.
+    """
+    self.currentSlideIndex = min(max(slideIndex, 0), max(self.getNumberOfSlides() - 1, 0))
+    if sliceLogic is None or self.volumeNode is None:
+      return
+    sliceLogic.SetSliceOffset(self.getSliceOffset(self.currentSlideIndex))
@@ -0,0 +1,54 @@
+from .ContinuousCollision import SweptCollisionDetector
+
+#
+# TargetContactPredicate
+#
+
+class TargetContactPredicate(object):
+  """Success predicate of a task where a model must touch a target: the model of node index 0 of a
+  collision pair (MeshCollisionPair or AnalyticCollisionPair) against the target of index 1.
+  It is evaluated the same way by the module logic, on tracking updates, and by batch workers,
+  on the samples of a trajectory (where the poses are set with collisionPair.setModelToWorld).
+  If a target distance field and the probe sphere of the model are given, the distance from the
+  sphere to the target is computed on every check (distanceToTarget), and the mesh test is
+  skipped while it is positive. If continuous, the motion since the previous check is tested
+  (see SweptCollisionDetector), which skips the mesh test by itself away from the target.
+  """
+
+  def __init__(self, collisionPair, targetDistanceField=None, probeSphere=None, continuous=True):
+    self.collisionPair = collisionPair
+    self.targetDistanceField = targetDistanceField
+    self.probeSphere = probeSphere
+    self.continuous = continuous
+    self.sweptCollisionDetector = SweptCollisionDetector(collisionPair, targetDistanceField) if continuous else None
+    self.distanceToTarget = None
+    self.numberOfContacts = 0
+
+  def reset(self):
+    """
+    Forget the previous pose, motion before the reset is not tested.
+    """
+    if self.sweptCollisionDetector is not None:
+      self.sweptCollisionDetector.reset()
+
+  def check(self):
+    """
+    Returns True if the model touches the target (along its motion since the previous check if
+    continuous). The number of contacts is kept in numberOfContacts.
+    """
+    collisionPair = self.collisionPair
+    collisionPair.updateInputs()
+    collisionPair.updateMatrices()
+    self.distanceToTarget = None
+    self.numberOfContacts = 0
+    if self.targetDistanceField is not None and self.probeSphere is not None:
+      self.probeSphere.updateWorld(collisionPair.matrices[0])
+      self.distanceToTarget = float(self.targetDistanceField.distanceToWorldPoints(self.probeSphere.worldCenter)[0]) - self.probeSphere.worldRadius
+      if self.distanceToTarget > 0 and self.sweptCollisionDetector is None:
+        # model cannot touch the target yet
+        return False
+    if self.sweptCollisionDetector is not None:
+      self.numberOfContacts = self.sweptCollisionDetector.check()
+    else:
+      self.numberOfContacts = collisionPair.check()
+    return self.numberOfContacts > 0
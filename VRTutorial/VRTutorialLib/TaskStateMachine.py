@@ -0,0 +1,116 @@
+import logging
+
+#
+# TaskStateMachine
+#
+
+class TaskStateMachine(object):
+  """Runs the tutorial tasks declared in a registry, one at a time.
+  A task is a dictionary with at least:
+    name: unique name, used to activate the task
+    observedNodes: names of the nodes whose motion triggers the evaluation (resolved with getNode)
+    successPredicate: function returning True when the task is completed
+  Other keys (models, slide, etc.) are interpreted by taskActivatedCallback(task).
+  Only the active task observes nodes: activating a task first removes all the callbacks of the
+  previous one, so switching back and forth never stacks up observers. The success predicate is
+  evaluated once per dispatch of an observed node until it returns True, then the observers are
+  removed and taskCompletedCallback(task) is called.
+  """
+
+  IDLE = 'idle'
+  ACTIVE = 'active'
+  COMPLETED = 'completed'
+
+  def __init__(self, transformDispatcher):
+    self.transformDispatcher = transformDispatcher
+    self.tasks = {}
+    self.taskNames = []
+    self.activeTask = None
+    self.state = self.IDLE
+    self.observedNodes = []
+    # function(nodeName) returning the node to observe, None if it is not available
+    self.getNode = None
+    self.taskActivatedCallback = None
+    self.taskCompletedCallback = None
+
+  def addTask(self, task):
+    if task['name'] in self.tasks:
+      raise ValueError('Task {0} is already registered'.format(task['name']))
+    task['index'] = len(self.taskNames)
+    self.tasks[task['name']] = task
+    self.taskNames.append(task['name'])
+
+  def getTask(self, name):
+    return self.tasks.get(name)
+
+  def getActiveTaskName(self):
+    return self.activeTask['name'] if self.activeTask is not None else None
+
+  def activateTask(self, name):
+    """
+    Stop the active task and start the task called name.
+    """
+    task = self.tasks[name]
+    self.stop()
+    self.activeTask = task
+    if self.taskActivatedCallback:
+      self.taskActivatedCallback(task)
+    for nodeName in task['observedNodes']:
+      node = self.getNode(nodeName) if self.getNode else None
+      if node is None:
+        logging.warning('Task {0}: {1} is not available, it is not observed'.format(name, nodeName))
+        continue
+      self.transformDispatcher.addCallback(node, self.onObservedNodeModified)
+      self.observedNodes.append(node)
+    self.state = self.ACTIVE
+
+  def activateNextTask(self):
+    """
+    Start the task after the active one (the first one if none is active, the last one stays active).
+    """
+    if not self.taskNames:
+      return
+    index = self.activeTask['index'] + 1 if self.activeTask is not None else 0
+    self.activateTask(self.taskNames[min(index, len(self.taskNames) - 1)])
+
+  def activatePreviousTask(self):
+    if not self.taskNames:
+      return
+    index = self.activeTask['index'] - 1 if self.activeTask is not None else 0
+    self.activateTask(self.taskNames[max(index, 0)])
+
+  def restartActiveTask(self):
+    """
+    Start the active task again, or the first task if none was started.
+    """
+    if self.activeTask is not None:
+      self.activateTask(self.activeTask['name'])
+    else:
+      self.activateNextTask()
+
+  def removeObservers(self):
+    for node in self.observedNodes:
+      self.transformDispatcher.removeCallback(node, self.onObservedNodeModified)
+    self.observedNodes = []
+
+  def stop(self):
+    """
+    Remove the observers of the active task. The task is kept as active task, so it can be restarted.
+    """
+    self.removeObservers()
+    self.state = self.IDLE
+
+  def reset(self):
+    self.stop()
+    self.activeTask = None
+
+  def onObservedNodeModified(self, node, event):
+    if self.state != self.ACTIVE:
+      return
+    task = self.activeTask
+    if not task['successPredicate']():
+      return
+    self.removeObservers()
+    self.state = self.COMPLETED
+    if self.taskCompletedCallback:
+      self.taskCompletedCallback(task)
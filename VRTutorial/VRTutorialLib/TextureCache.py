@@ -0,0 +1,138 @@
+import logging
+import os
+import numpy as np
+import vtk
+from vtk.util.numpy_support import numpy_to_vtk, vtk_to_numpy
+
+#
+# Texture preparation
+#
+
+def readTextureImage(filePath):
+  """
+  Return the pixels of an image file (rows x columns x components, first row at the top of the
+  image), None if the file cannot be read.
+  """
+  reader = vtk.vtkImageReader2Factory.CreateImageReader2(filePath)
+  if reader is None:
+    return None
+  reader.SetFileName(filePath)
+  reader.FileLowerLeftOn()
+  reader.Update()
+  imageData = reader.GetOutput()
+  columns, rows, _ = imageData.GetDimensions()
+  if rows * columns == 0:
+    return None
+  return vtk_to_numpy(imageData.GetPointData().GetScalars()).reshape(rows, columns, -1).astype(np.uint8)
+
+
+def downsampleImage(pixels):
+  """
+  Halve the resolution of an image with a 2 x 2 box filter (the last row and column are repeated
+  for odd sizes).
+  """
+  rows, columns = pixels.shape[:2]
+  padded = np.pad(pixels, ((0, rows % 2), (0, columns % 2), (0, 0)), mode='edge').astype(np.uint16)
+  summed = padded[0::2, 0::2] + padded[1::2, 0::2] + padded[0::2, 1::2] + padded[1::2, 1::2]
+  return ((summed + 2) // 4).astype(np.uint8)
+
+#
+# TexturePyramid
+#
+
+class TexturePyramid(object):
+  """Mip levels of a texture, ready to be used by VTK: rows are flipped so that the first row is
+  the bottom of the image (texture coordinate t = 0), and level 0 is at most maximumSize pixels
+  wide and high. Each level is half the size of the previous one, down to 1 x 1.
+  """
+
+  def __init__(self, levels):
+    self.levels = levels
+
+  @classmethod
+  def fromPixels(cls, pixels, maximumSize=4096):
+    level = np.ascontiguousarray(pixels[::-1])
+    while max(level.shape[:2]) > maximumSize:
+      level = downsampleImage(level)
+    levels = [level]
+    while max(level.shape[:2]) > 1:
+      level = downsampleImage(level)
+      levels.append(level)
+    return cls(levels)
+
+  @classmethod
+  def load(cls, filePath):
+    with np.load(filePath) as data:
+      return cls([data['level{0}'.format(levelIndex)] for levelIndex in range(int(data['numberOfLevels']))])
+
+  def save(self, filePath):
+    arrays = {'level{0}'.format(levelIndex): level for levelIndex, level in enumerate(self.levels)}
+    np.savez_compressed(filePath, numberOfLevels=len(self.levels), **arrays)
+
+  def getLevelIndex(self, maximumSize):
+    """
+    Return the index of the largest level that fits in maximumSize.
+    """
+    for levelIndex, level in enumerate(self.levels):
+      if max(level.shape[:2]) <= maximumSize:
+        return levelIndex
+    return len(self.levels) - 1
+
+  def getImageData(self, levelIndex=0):
+    level = self.levels[levelIndex]
+    rows, columns, numberOfComponents = level.shape
+    imageData = vtk.vtkImageData()
+    imageData.SetDimensions(columns, rows, 1)
+    scalars = numpy_to_vtk(level.reshape(-1, numberOfComponents), deep=True, array_type=vtk.VTK_UNSIGNED_CHAR)
+    imageData.GetPointData().SetScalars(scalars)
+    return imageData
+
+#
+# TextureCache
+#
+
+class TextureCache(object):
+  """Texture pyramids of image files, prepared once and stored in the asset cache.
+  Entries are named after the hash of the source file, so changing the image rebuilds them, and
+  hold all the mip levels, so a different maximum resolution does not read the image again.
+  """
+
+  def __init__(self, assetCache, maximumStoredSize=4096):
+    self.assetCache = assetCache
+    # resolution limit of the stored level 0
+    self.maximumStoredSize = maximumStoredSize
+
+  def getPyramid(self, filePath):
+    """
+    Return the texture pyramid of an image file, None if it cannot be read.
+    """
+    entryFilePath = None
+    if self.assetCache is not None and self.assetCache.enabled:
+      entryFilePath = os.path.join(self.assetCache.cacheDirectory,
+        'texture-{0}-{1}.npz'.format(self.assetCache.fileHash(filePath), self.maximumStoredSize))
+      if os.path.exists(entryFilePath):
+        try:
+          pyramid = TexturePyramid.load(entryFilePath)
+          self.assetCache.touch(entryFilePath)
+          return pyramid
+        except (OSError, ValueError, KeyError) as e:
+          logging.warning('Invalid texture cache entry {0}: {1}'.format(entryFilePath, e))
+    pixels = readTextureImage(filePath)
+    if pixels is None:
+      logging.error('Texture image {0} could not be read'.format(filePath))
+      return None
+    pyramid = TexturePyramid.fromPixels(pixels, self.maximumStoredSize)
+    if entryFilePath:
+      pyramid.save(entryFilePath)
+      self.assetCache.registerEntry(entryFilePath, {'type': 'texture'})
+      self.assetCache.touch(entryFilePath)
+    return pyramid
+
+  def getTexture(self, filePath, maximumSize=2048):
+    """
+    Return the texture image of a file, at most maximumSize pixels wide and high.
+    """
+    pyramid = self.getPyramid(filePath)
+    if pyramid is None:
+      return None
+    return pyramid.getImageData(pyramid.getLevelIndex(maximumSize))
@@ -0,0 +1,205 @@
+import logging
+import time
+import numpy as np
+import qt, vtk, slicer
+
+#
+# Tracking recording file format
+#
+# Header: magic (4 bytes), format version (uint16), number of devices (uint16),
+# then for each device the length (uint16) and UTF-8 bytes of its name.
+# Followed by fixed size little-endian samples (see SAMPLE_DTYPE): time since the start of
+# the recording in seconds, index of the device that moved and the first three rows of its
+# device-to-world matrix (the last row is always 0 0 0 1).
+#
+
+FILE_MAGIC = b'VRTR'
+FILE_VERSION = 1
+DEVICE_NAMES = ['HMD', 'RightController', 'LeftController']
+SAMPLE_DTYPE = np.dtype([('time', '<f8'), ('device', 'u1'), ('matrix', '<f4', (12,))])
+
+
+def writeTrackingFile(filePath, deviceNames, samples):
+  with open(filePath, 'wb') as file:
+    file.write(FILE_MAGIC)
+    file.write(np.array([FILE_VERSION, len(deviceNames)], dtype='<u2').tobytes())
+    for deviceName in deviceNames:
+      encodedName = deviceName.encode('utf-8')
+      file.write(np.array([len(encodedName)], dtype='<u2').tobytes())
+      file.write(encodedName)
+    file.write(np.ascontiguousarray(samples, dtype=SAMPLE_DTYPE).tobytes())
+
+
+def readTrackingFile(filePath):
+  """
+  Returns the list of device names and the structured sample array of a tracking file.
+  """
+  with open(filePath, 'rb') as file:
+    if file.read(4) != FILE_MAGIC:
+      raise ValueError('{0} is not a tracking recording'.format(filePath))
+    version, numberOfDevices = np.frombuffer(file.read(4), dtype='<u2')
+    if version != FILE_VERSION:
+      raise ValueError('Unsupported tracking recording version {0}'.format(version))
+    deviceNames = []
+    for deviceIndex in range(numberOfDevices):
+      nameLength = int(np.frombuffer(file.read(2), dtype='<u2')[0])
+      deviceNames.append(file.read(nameLength).decode('utf-8'))
+    samples = np.frombuffer(file.read(), dtype=SAMPLE_DTYPE)
+  return deviceNames, samples
+
+#
+# TrackingRecorder
+#
+
+class TrackingRecorder(object):
+  """Records the world matrices of tracked device transform nodes (HMD, right and left
+  controllers) with timestamps. Samples are stored in a preallocated array that grows by
+  doubling, so the observer does not allocate on most events.
+  """
+
+  def __init__(self, transformNodes, deviceNames=None, initialCapacity=4096):
+    """
+    transformNodes: list of transform nodes, None entries are skipped (device not tracked).
+    """
+    self.deviceNames = list(deviceNames) if deviceNames else DEVICE_NAMES[:len(transformNodes)]
+    self.transformNodes = list(transformNodes)
+    self.samples = np.zeros(initialCapacity, dtype=SAMPLE_DTYPE)
+    self.numberOfSamples = 0
+    self.startTime = 0.0
+    self.observations = []
+    self._matrix = vtk.vtkMatrix4x4()
+
+  def start(self):
+    self.stop()
+    self.numberOfSamples = 0
+    self.startTime = time.perf_counter()
+    for deviceIndex, transformNode in enumerate(self.transformNodes):
+      if transformNode is None:
+        continue
+      tag = transformNode.AddObserver(slicer.vtkMRMLTransformableNode.TransformModifiedEvent,
+        lambda caller, event, deviceIndex=deviceIndex: self.recordSample(deviceIndex, caller))
+      self.observations.append((transformNode, tag))
+      # Initial pose, so that replay starts from the state at the start of the recording
+      self.recordSample(deviceIndex, transformNode)
+
+  def stop(self):
+    for transformNode, tag in self.observations:
+      transformNode.RemoveObserver(tag)
+    self.observations = []
+
+  def isRecording(self):
+    return len(self.observations) > 0
+
+  def recordSample(self, deviceIndex, transformNode):
+    if self.numberOfSamples == len(self.samples):
+      samples = np.zeros(2 * len(self.samples), dtype=SAMPLE_DTYPE)
+      samples[:self.numberOfSamples] = self.samples
+      self.samples = samples
+    transformNode.GetMatrixTransformToWorld(self._matrix)
+    self.samples['time'][self.numberOfSamples] = time.perf_counter() - self.startTime
+    self.samples['device'][self.numberOfSamples] = deviceIndex
+    self.samples['matrix'][self.numberOfSamples] = slicer.util.arrayFromVTKMatrix(self._matrix)[:3].ravel()
+    self.numberOfSamples += 1
+
+  def getSamples(self):
+    return self.samples[:self.numberOfSamples]
+
+  def save(self, filePath):
+    writeTrackingFile(filePath, self.deviceNames, self.getSamples())
+    logging.info('Saved {0} tracking samples to {1}'.format(self.numberOfSamples, filePath))
+
+#
+# TrackingReplayer
+#
+
+class TrackingReplayer(object):
+  """Replays a tracking recording into plain vtkMRMLLinearTransformNodes, so that task logic
+  observing these nodes can be driven without VR hardware.
+  Replay can follow the recorded timestamps (on a QTimer) or push all samples as fast as
+  possible.
+  """
+
+  def __init__(self, filePath=None, deviceNames=None, samples=None):
+    if filePath is not None:
+      deviceNames, samples = readTrackingFile(filePath)
+    self.deviceNames = list(deviceNames)
+    self.samples = samples
+    self.transformNodes = []
+    self.currentSampleIndex = 0
+    self.sampleCallback = None
+    self.finishedCallback = None
+    self.timer = qt.QTimer()
+    self.timer.setSingleShot(True)
+    self.timer.timeout.connect(self.onTimeout)
+    self._replayStartTime = 0.0
+    self._matrix = vtk.vtkMatrix4x4()
+    self._array = np.eye(4)
+
+  def getNumberOfSamples(self):
+    return len(self.samples)
+
+  def getDuration(self):
+    return float(self.samples['time'][-1]) if len(self.samples) else 0.0
+
+  def createTransformNodes(self, nodeNamePrefix='Replay'):
+    """
+    Get or create one linear transform node per recorded device, named nodeNamePrefix + device name.
+    """
+    self.transformNodes = []
+    for deviceName in self.deviceNames:
+      nodeName = nodeNamePrefix + deviceName
+      transformNode = slicer.mrmlScene.GetFirstNodeByName(nodeName)
+      if transformNode is None or not transformNode.IsA('vtkMRMLLinearTransformNode'):
+        transformNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLLinearTransformNode', nodeName)
+      self.transformNodes.append(transformNode)
+    return self.transformNodes
+
+  def getTransformNode(self, deviceName):
+    return self.transformNodes[self.deviceNames.index(deviceName)]
+
+  def applySample(self, sampleIndex):
+    self._array[:3] = self.samples['matrix'][sampleIndex].reshape(3, 4)
+    slicer.util.updateVTKMatrixFromArray(self._matrix, self._array)
+    self.transformNodes[self.samples['device'][sampleIndex]].SetMatrixTransformToParent(self._matrix)
+    if self.sampleCallback:
+      self.sampleCallback(sampleIndex)
+
+  def replayAll(self):
+    """
+    Push every sample into the transform nodes as fast as possible. Returns elapsed seconds.
+    """
+    if not self.transformNodes:
+      self.createTransformNodes()
+    startTime = time.perf_counter()
+    for sampleIndex in range(len(self.samples)):
+      self.applySample(sampleIndex)
+    return time.perf_counter() - startTime
+
+  def start(self):
+    """
+    Start replay at the original speed. finishedCallback is called after the last sample.
+    """
+    if not self.transformNodes:
+      self.createTransformNodes()
+    self.currentSampleIndex = 0
+    self._replayStartTime = time.perf_counter()
+    self.onTimeout()
+
+  def stop(self):
+    self.timer.stop()
+
+  def isReplaying(self):
+    return self.timer.isActive()
+
+  def onTimeout(self):
+    # Apply all samples that are due, then wait until the next one
+    elapsedTime = time.perf_counter() - self._replayStartTime
+    while self.currentSampleIndex < len(self.samples) and self.samples['time'][self.currentSampleIndex] <= elapsedTime:
+      self.applySample(self.currentSampleIndex)
+      self.currentSampleIndex += 1
+    if self.currentSampleIndex >= len(self.samples):
+      if self.finishedCallback:
+        self.finishedCallback()
+      return
+    waitTime = self.samples['time'][self.currentSampleIndex] - elapsedTime
+    self.timer.start(max(0, int(waitTime * 1000.0)))
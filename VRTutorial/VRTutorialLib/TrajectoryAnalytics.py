@@ -0,0 +1,186 @@
+import csv
+import os
+import numpy as np
+from .TrackingRecording import DEVICE_NAMES
+from .SessionTelemetry import readSessionTelemetry
+
+#
+# Trajectory arrays
+#
+
+def getDevicePositions(poses, deviceIndex, times):
+  """
+  Return the positions (mm) of a device in a pose sample array (see SAMPLE_DTYPE) at the given
+  times, a regular grid so that derivatives are plain finite differences. None if the device
+  has no samples.
+  """
+  deviceSamples = poses[poses['device'] == deviceIndex]
+  if len(deviceSamples) == 0:
+    return None
+  # the first three rows of the matrix are stored, the translation is the last column
+  samplePositions = deviceSamples['matrix'][:, [3, 7, 11]].astype(float)
+  return np.stack([np.interp(times, deviceSamples['time'], samplePositions[:, axis]) for axis in range(3)], axis=1)
+
+
+def findRuns(mask):
+  """
+  Return the start and end (exclusive) indices of the runs of True values of a boolean array.
+  """
+  edges = np.diff(np.concatenate([[0], mask.astype(np.int8), [0]]))
+  return np.nonzero(edges == 1)[0], np.nonzero(edges == -1)[0]
+
+
+def getSmoothness(positions, sampleRateHz):
+  """
+  Return the RMS jerk (mm/s^3) and the log dimensionless jerk (higher is smoother) of a motion.
+  """
+  if len(positions) < 4:
+    return float('nan'), float('nan')
+  timeStep = 1.0 / sampleRateHz
+  velocities = np.diff(positions, axis=0) / timeStep
+  jerks = np.diff(positions, n=3, axis=0) / timeStep ** 3
+  squaredJerks = np.einsum('ij,ij->i', jerks, jerks)
+  duration = len(positions) * timeStep
+  peakSpeed = np.linalg.norm(velocities, axis=1).max()
+  rmsJerk = float(np.sqrt(squaredJerks.mean()))
+  if peakSpeed == 0:
+    return rmsJerk, float('nan')
+  dimensionlessJerk = duration ** 3 / peakSpeed ** 2 * squaredJerks.sum() * timeStep
+  return rmsJerk, float(-np.log(dimensionlessJerk)) if dimensionlessJerk > 0 else float('nan')
+
+#
+# SessionAnalyzer
+#
+
+class SessionAnalyzer(object):
+  """Per-task motion metrics of a recorded session (see SessionTelemetryRecorder), computed with
+  array operations over whole trajectories:
+    duration: time from task start to completion (or to the next task / end of the session)
+    completed: whether the task was completed
+    headPathLength: distance travelled by the headset (mm), fly motion excluded
+    hesitations, hesitationTime: periods when the headset is still for hesitationDuration to idleDuration seconds
+    idlePeriods, idleTime: periods when all devices are still for at least idleDuration seconds
+    flyActions: number of times the headset moves faster than a person walks (flying with the controller)
+    <controller>RMSJerk, <controller>LogDimensionlessJerk: smoothness of each controller motion
+  """
+
+  def __init__(self, session, sampleRateHz=90.0, stillSpeed=50.0, hesitationDuration=0.5, idleDuration=3.0, flySpeed=2000.0):
+    """
+    Speeds are in mm/s, durations in seconds.
+    """
+    self.session = session
+    self.sampleRateHz = sampleRateHz
+    self.stillSpeed = stillSpeed
+    self.hesitationDuration = hesitationDuration
+    self.idleDuration = idleDuration
+    self.flySpeed = flySpeed
+    metadata = session['metadata']
+    self.deviceNames = metadata.get('deviceNames', DEVICE_NAMES)
+    self.taskNames = metadata.get('taskNames', [])
+    # Positions and speeds of all devices resampled on a common time grid, computed once
+    poseTimes = session['poses']['time']
+    self.times = np.arange(poseTimes.min(), poseTimes.max(), 1.0 / sampleRateHz) if len(poseTimes) else np.zeros(0)
+    self.trajectories = {}
+    for deviceIndex, deviceName in enumerate(self.deviceNames):
+      positions = getDevicePositions(session['poses'], deviceIndex, self.times)
+      if positions is None:
+        continue
+      speeds = np.linalg.norm(np.diff(positions, axis=0), axis=1) * sampleRateHz
+      self.trajectories[deviceName] = {'positions': positions, 'speeds': speeds}
+
+  @classmethod
+  def fromDirectory(cls, sessionDirectory, **kwargs):
+    return cls(readSessionTelemetry(sessionDirectory), **kwargs)
+
+  def getEventTimes(self, eventName):
+    eventNames = self.session['metadata']['eventNames']
+    if eventName not in eventNames:
+      return np.zeros(0), np.zeros(0)
+    events = self.session['events'][self.session['events']['event'] == eventNames.index(eventName)]
+    return events['time'], events['value']
+
+  def getTaskIntervals(self):
+    """
+    Return (task index, start time, end time, completed) for each task started in the session.
+    """
+    startTimes, startTaskIndices = self.getEventTimes('TaskStarted')
+    completedTimes, completedTaskIndices = self.getEventTimes('TaskCompleted')
+    sessionEndTime = float(self.times[-1]) if len(self.times) else 0.0
+    endTimes = np.append(startTimes[1:], sessionEndTime)
+    intervals = []
+    for taskIndex, startTime, endTime in zip(startTaskIndices.astype(int), startTimes, endTimes):
+      completions = completedTimes[(completedTaskIndices == taskIndex) & (completedTimes >= startTime) & (completedTimes <= endTime)]
+      if len(completions):
+        intervals.append((taskIndex, float(startTime), float(completions[0]), True))
+      else:
+        intervals.append((taskIndex, float(startTime), float(endTime), False))
+    return intervals
+
+  def getInterval(self, deviceName, startTime, endTime):
+    """
+    Return the positions and the speeds (between consecutive positions) of a device during a time interval.
+    """
+    trajectory = self.trajectories[deviceName]
+    first, last = np.searchsorted(self.times, [startTime, endTime])
+    return trajectory['positions'][first:last], trajectory['speeds'][first:max(first, last - 1)]
+
+  def getStillPeriods(self, stillMask, minimumDuration, maximumDuration=None):
+    starts, ends = findRuns(stillMask)
+    durations = (ends - starts) / self.sampleRateHz
+    selected = durations >= minimumDuration
+    if maximumDuration is not None:
+      selected &= durations < maximumDuration
+    return int(selected.sum()), float(durations[selected].sum())
+
+  def analyzeTask(self, taskIndex, startTime, endTime, completed):
+    metrics = {
+      'task': self.taskNames[taskIndex] if taskIndex < len(self.taskNames) else str(taskIndex),
+      'duration': endTime - startTime,
+      'completed': completed,
+      }
+    headName = self.deviceNames[0]
+    if headName not in self.trajectories:
+      return metrics
+    headPositions, headSpeeds = self.getInterval(headName, startTime, endTime)
+    flying = headSpeeds > self.flySpeed
+    metrics['flyActions'] = len(findRuns(flying)[0])
+    metrics['headPathLength'] = float(headSpeeds[~flying].sum() / self.sampleRateHz)
+    headStill = headSpeeds < self.stillSpeed
+    metrics['hesitations'], metrics['hesitationTime'] = self.getStillPeriods(headStill, self.hesitationDuration, self.idleDuration)
+    # idle: every tracked device still at the same time
+    allStill = headStill
+    for deviceName in self.deviceNames[1:]:
+      if deviceName not in self.trajectories:
+        continue
+      positions, speeds = self.getInterval(deviceName, startTime, endTime)
+      allStill = allStill & (speeds < self.stillSpeed)
+      metrics[deviceName + 'RMSJerk'], metrics[deviceName + 'LogDimensionlessJerk'] = getSmoothness(positions, self.sampleRateHz)
+    metrics['idlePeriods'], metrics['idleTime'] = self.getStillPeriods(allStill, self.idleDuration)
+    return metrics
+
+  def getSummary(self):
+    """
+    Return one row of metrics per task of the session.
+    """
+    return [self.analyzeTask(*interval) for interval in self.getTaskIntervals()]
+
+
+def writeSessionSummaryTable(sessionDirectories, filePath, **kwargs):
+  """
+  Analyze recorded sessions and write one CSV row per session and task.
+  """
+  rows = []
+  for sessionDirectory in sessionDirectories:
+    for metrics in SessionAnalyzer.fromDirectory(sessionDirectory, **kwargs).getSummary():
+      row = {'session': os.path.basename(os.path.normpath(sessionDirectory))}
+      row.update(metrics)
+      rows.append(row)
+  fieldNames = []
+  for row in rows:
+    fieldNames.extend(fieldName for fieldName in row if fieldName not in fieldNames)
+  with open(filePath, 'w', newline='') as file:
+    writer = csv.DictWriter(file, fieldnames=fieldNames)
+    writer.writeheader()
+    for row in rows:
+      writer.writerow(row)
+  return rows
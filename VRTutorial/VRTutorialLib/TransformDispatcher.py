@@ -0,0 +1,214 @@
+import numpy as np
+import qt, vtk, slicer
+from .Profiling import profiled
+
+#
+# TransformEventDispatcher
+#
+
+class TransformEventDispatcher(object):
+  """Rate limited dispatch of transform modified events to task callbacks.
+  Each node has a single VTK observer, whatever the number of callbacks registered for it.
+  Callbacks are called in decreasing priority order (in the order they were added for equal
+  priorities), and may add or remove callbacks while being called: removed callbacks are not
+  called anymore, added ones are called from the next dispatch.
+  The world matrix of a node is read at most once per event, on the first getWorldMatrix call
+  after the event, into a NumPy buffer shared by all callbacks.
+  Bursts of TransformModifiedEvent from tracked device transforms are coalesced: the VTK
+  observer only flags the node as pending and callbacks run at most once per timer tick,
+  reading the latest pose from the node at that time.
+  If the update rate is 0, callbacks run synchronously on every Nth event instead
+  (N = event decimation, 1 calls them on every event).
+  Raw callbacks (see addRawCallback) run in the observer on every event, before coalescing and
+  decimation, for consumers that need every pose (e.g. telemetry); they must be cheap.
+  """
+
+  def __init__(self, updateRateHz=60.0, eventDecimation=1):
+    self.observedNodes = {}
+    # Rows of worldMatrices are allocated to observed nodes, freed rows are reused
+    self.worldMatrices = np.zeros((8, 4, 4))
+    self.freeWorldMatrixIndices = list(range(len(self.worldMatrices)))
+    self._worldMatrix = vtk.vtkMatrix4x4()
+    self.timer = qt.QTimer()
+    self.timer.timeout.connect(self.onTimeout)
+    self.updateRateHz = 0.0
+    self.eventDecimation = 1
+    self.setUpdateRate(updateRateHz)
+    self.setEventDecimation(eventDecimation)
+
+  def setUpdateRate(self, updateRateHz):
+    """
+    Set the maximum number of callback evaluations per second. 0 disables the timer.
+    """
+    self.updateRateHz = max(0.0, float(updateRateHz))
+    if self.updateRateHz > 0:
+      self.timer.setInterval(int(round(1000.0 / self.updateRateHz)))
+    else:
+      self.timer.stop()
+      # Pending events would not be dispatched by the timer anymore
+      self.dispatchPending()
+
+  def setEventDecimation(self, eventDecimation):
+    """
+    Set N so that callbacks are called on every Nth event when the update rate is 0.
+    """
+    self.eventDecimation = max(1, int(eventDecimation))
+
+  def addCallback(self, transformNode, callback, priority=0):
+    """
+    Call callback(transformNode, event) when transformNode (a transform or a transformable node)
+    is modified. Callbacks with higher priority are called first. Adding the same callback twice
+    for a node has no effect.
+    """
+    if transformNode is None:
+      return
+    observation = self.observe(transformNode)
+    if callback in observation['callbacks']:
+      return
+    # Priorities are kept in decreasing order
+    index = len([callbackPriority for callbackPriority in observation['priorities'] if callbackPriority >= priority])
+    observation['callbacks'].insert(index, callback)
+    observation['priorities'].insert(index, priority)
+
+  def addRawCallback(self, transformNode, callback):
+    """
+    Call callback(transformNode, event) on every modified event of transformNode, from the
+    observer, without waiting for the timer or the event decimation. getWorldMatrix returns the
+    pose of that event. Adding the same callback twice for a node has no effect.
+    """
+    if transformNode is None:
+      return
+    observation = self.observe(transformNode)
+    if callback not in observation['rawCallbacks']:
+      observation['rawCallbacks'].append(callback)
+
+  def observe(self, transformNode):
+    observation = self.observedNodes.get(transformNode)
+    if observation is None:
+      observation = {'callbacks': [], 'priorities': [], 'rawCallbacks': [], 'pending': False, 'eventCount': 0,
+        'worldMatrixIndex': self.allocateWorldMatrix(), 'worldMatrixModified': True}
+      observation['tag'] = transformNode.AddObserver(slicer.vtkMRMLTransformableNode.TransformModifiedEvent, self.onTransformModified)
+      self.observedNodes[transformNode] = observation
+    return observation
+
+  def removeCallback(self, transformNode, callback):
+    observation = self.observedNodes.get(transformNode)
+    if observation is None:
+      return
+    if callback in observation['callbacks']:
+      index = observation['callbacks'].index(callback)
+      del observation['callbacks'][index]
+      del observation['priorities'][index]
+    self.releaseObservation(transformNode)
+
+  def removeRawCallback(self, transformNode, callback):
+    observation = self.observedNodes.get(transformNode)
+    if observation is None:
+      return
+    if callback in observation['rawCallbacks']:
+      observation['rawCallbacks'].remove(callback)
+    self.releaseObservation(transformNode)
+
+  def releaseObservation(self, transformNode):
+    """
+    Stop observing transformNode if it has no callbacks left.
+    """
+    observation = self.observedNodes[transformNode]
+    if not observation['callbacks'] and not observation['rawCallbacks']:
+      transformNode.RemoveObserver(observation['tag'])
+      self.freeWorldMatrixIndices.append(observation['worldMatrixIndex'])
+      del self.observedNodes[transformNode]
+    if not self.observedNodes:
+      self.timer.stop()
+
+  def removeAllCallbacks(self):
+    for transformNode, observation in list(self.observedNodes.items()):
+      transformNode.RemoveObserver(observation['tag'])
+      # Callbacks of a dispatch in progress are not called anymore
+      del observation['callbacks'][:]
+      del observation['rawCallbacks'][:]
+      self.freeWorldMatrixIndices.append(observation['worldMatrixIndex'])
+    self.observedNodes = {}
+    self.timer.stop()
+
+  def allocateWorldMatrix(self):
+    if not self.freeWorldMatrixIndices:
+      numberOfMatrices = len(self.worldMatrices)
+      self.worldMatrices = np.concatenate([self.worldMatrices, np.zeros((numberOfMatrices, 4, 4))])
+      self.freeWorldMatrixIndices = list(range(numberOfMatrices, 2 * numberOfMatrices))
+    return self.freeWorldMatrixIndices.pop()
+
+  def getWorldMatrix(self, transformNode):
+    """
+    Return the transform to world of an observed transform node (of the parent transform for
+    other transformable nodes) as a 4x4 NumPy array, None if the node is not observed.
+    The array is a view in the shared buffer: it is updated in place on later events and
+    must not be kept across observations of new nodes.
+    """
+    observation = self.observedNodes.get(transformNode)
+    if observation is None:
+      return None
+    worldMatrix = self.worldMatrices[observation['worldMatrixIndex']]
+    if observation['worldMatrixModified']:
+      observation['worldMatrixModified'] = False
+      if transformNode.IsA('vtkMRMLTransformNode'):
+        transformNode.GetMatrixTransformToWorld(self._worldMatrix)
+      elif transformNode.GetParentTransformNode() is not None:
+        transformNode.GetParentTransformNode().GetMatrixTransformToWorld(self._worldMatrix)
+      else:
+        self._worldMatrix.Identity()
+      self._worldMatrix.DeepCopy(worldMatrix.ravel(), self._worldMatrix)
+    return worldMatrix
+
+  def hasCallback(self, transformNode, callback):
+    observation = self.observedNodes.get(transformNode)
+    return observation is not None and callback in observation['callbacks']
+
+  @profiled('transformObserver', topLevel=True)
+  def onTransformModified(self, caller, event):
+    observation = self.observedNodes.get(caller)
+    if observation is None:
+      return
+    observation['worldMatrixModified'] = True
+    rawCallbacks = observation['rawCallbacks']
+    for callback in list(rawCallbacks):
+      if callback in rawCallbacks:
+        callback(caller, event)
+    if not observation['callbacks']:
+      return
+    if self.updateRateHz > 0:
+      observation['pending'] = True
+      if not self.timer.isActive():
+        self.timer.start()
+      return
+    observation['eventCount'] += 1
+    if observation['eventCount'] >= self.eventDecimation:
+      observation['eventCount'] = 0
+      self.dispatch(caller)
+
+  @profiled('transformDispatchTimer', topLevel=True)
+  def onTimeout(self):
+    if not self.dispatchPending():
+      # No events since last tick, timer is restarted by the next event
+      self.timer.stop()
+
+  def dispatchPending(self):
+    """
+    Call the callbacks of all nodes modified since the last dispatch.
+    Returns True if any node was pending.
+    """
+    pendingNodes = [node for node, observation in self.observedNodes.items() if observation['pending']]
+    for transformNode in pendingNodes:
+      self.dispatch(transformNode)
+    return len(pendingNodes) > 0
+
+  def dispatch(self, transformNode):
+    observation = self.observedNodes.get(transformNode)
+    if observation is None:
+      return
+    observation['pending'] = False
+    # Callbacks may remove themselves or others (e.g. when a task is completed)
+    callbacks = observation['callbacks']
+    for callback in list(callbacks):
+      if callback in callbacks:
+        callback(transformNode, slicer.vtkMRMLTransformableNode.TransformModifiedEvent)
@@ -0,0 +1,132 @@
+import numpy as np
+import vtk
+from vtk.util.numpy_support import numpy_to_vtk, numpy_to_vtkIdTypeArray, vtk_to_numpy
+from .AlignmentScoring import AlignmentEvaluator
+from .AnalyticTargets import AnalyticCollisionPair
+from .DistanceField import TargetDistanceField
+from .MeshCollision import BoundingSphere, MeshCollisionPair
+from .TaskPredicates import TargetContactPredicate
+
+#
+# Evaluation of tutorial tasks on trajectories, run in batch worker processes.
+#
+# Workers are plain Python interpreters without the Slicer application (no MRML scene, no Qt),
+# so this module only depends on NumPy and VTK. Workers import it as VRTutorialLib.VRTutorialBatchWorker
+# with VRTUTORIAL_BATCH_WORKER set, so that the package skips its application modules (see
+# BatchEvaluator.workerEnvironment). Meshes are received as arrays once per worker, the success
+# predicates are the ones of the module logic, built with the same collision settings.
+#
+
+_workerState = {}
+
+
+def arraysFromPolyData(polyData):
+  """
+  Return the points and the triangle connectivity (N x 3) of a triangle mesh.
+  """
+  triangulate = vtk.vtkTriangleFilter()
+  triangulate.SetInputData(polyData)
+  triangulate.PassLinesOff()
+  triangulate.PassVertsOff()
+  triangulate.Update()
+  triangles = triangulate.GetOutput()
+  points = vtk_to_numpy(triangles.GetPoints().GetData()).astype(float)
+  polys = vtk_to_numpy(triangles.GetPolys().GetConnectivityArray()).reshape(-1, 3)
+  return {'points': points, 'triangles': polys.astype(np.int64)}
+
+
+def polyDataFromArrays(meshArrays):
+  polyData = vtk.vtkPolyData()
+  points = vtk.vtkPoints()
+  points.SetData(numpy_to_vtk(np.ascontiguousarray(meshArrays['points']), deep=True))
+  polyData.SetPoints(points)
+  triangles = meshArrays['triangles']
+  offsets = np.arange(0, 3 * len(triangles) + 1, 3, dtype=np.int64)
+  cells = vtk.vtkCellArray()
+  cells.SetData(numpy_to_vtkIdTypeArray(offsets, deep=True), numpy_to_vtkIdTypeArray(np.ascontiguousarray(triangles.ravel()), deep=True))
+  polyData.SetPolys(cells)
+  return polyData
+
+
+def initializeWorker(geometry):
+  """
+  Build the success predicates of the tutorial tasks, once per worker process.
+  geometry is the dictionary made by BatchEvaluator.getGeometry.
+  """
+  _workerState.clear()
+  if 'head' in geometry:
+    cylinderToWorld = np.asarray(geometry['cylinderToWorld'], dtype=float)
+    if geometry['cylinderShape'] is not None:
+      collisionPair = AnalyticCollisionPair(None, None, geometry['cylinderShape'])
+    else:
+      collisionPair = MeshCollisionPair(None, None)
+    collisionPair.setInputData(0, polyDataFromArrays(geometry['head']))
+    collisionPair.setInputData(1, polyDataFromArrays(geometry['cylinder']))
+    collisionPair.setModelToWorld(1, cylinderToWorld)
+    targetDistanceField = None
+    probeSphere = None
+    if geometry['cylinderDistanceField'] is not None:
+      targetDistanceField = TargetDistanceField(None, geometry['cylinderDistanceField'], cylinderToWorld)
+      probeSphere = BoundingSphere()
+      probeSphere.center = np.asarray(geometry['headProbeSphere']['center'], dtype=float)
+      probeSphere.radius = float(geometry['headProbeSphere']['radius'])
+    _workerState['collision'] = TargetContactPredicate(collisionPair, targetDistanceField, probeSphere, geometry['continuousCollision'])
+  if 'femurPoints' in geometry:
+    _workerState['alignment'] = {
+      'evaluator': AlignmentEvaluator(geometry['femurPoints'], geometry['correspondenceMatrix'], metric=geometry['alignmentMetric']),
+      'femurCopyToWorld': np.asarray(geometry['femurCopyToWorld'], dtype=float),
+      }
+
+
+def getCollisionTime(headToWorld):
+  """
+  Return the index of the first sample where the head touches the cylinder (-1 if it never does)
+  and the number of mesh tests. Each sample is one check of the predicate, in time order.
+  """
+  predicate = _workerState['collision']
+  collisionPair = predicate.collisionPair
+  predicate.reset()
+  collisionPair.resetStatistics()
+  for sampleIndex in range(len(headToWorld)):
+    collisionPair.setModelToWorld(0, headToWorld[sampleIndex])
+    if predicate.check():
+      return sampleIndex, collisionPair.numberOfNarrowPhaseChecks
+  return -1, collisionPair.numberOfNarrowPhaseChecks
+
+
+def getAlignmentErrors(femurToWorld):
+  """
+  Alignment error (with the metric of the module logic) of the femur for every sample of a
+  trajectory (N x 4 x 4 femur model to world matrices).
+  """
+  state = _workerState['alignment']
+  return state['evaluator'].getTrajectoryErrors(femurToWorld, state['femurCopyToWorld'])
+
+
+def evaluateTrajectory(trajectory):
+  """
+  Run the task success logic over one trajectory: a dictionary with name, times (seconds) and
+  optionally headToWorld and femurToWorld (N x 4 x 4) and alignmentThresholds.
+  Returns a result dictionary per task.
+  """
+  times = np.asarray(trajectory['times'], dtype=float)
+  result = {'name': trajectory['name'], 'duration': float(times[-1] - times[0]) if len(times) else 0.0}
+  if trajectory.get('headToWorld') is not None and 'collision' in _workerState:
+    sampleIndex, numberOfMeshTests = getCollisionTime(np.asarray(trajectory['headToWorld'], dtype=float))
+    result['HeadCylinderCollision'] = {
+      'success': sampleIndex >= 0,
+      'timeToSuccess': float(times[sampleIndex] - times[0]) if sampleIndex >= 0 else None,
+      'meshTests': numberOfMeshTests,
+      }
+  if trajectory.get('femurToWorld') is not None and 'alignment' in _workerState:
+    errors = getAlignmentErrors(np.asarray(trajectory['femurToWorld'], dtype=float))
+    thresholdResults = []
+    for threshold in trajectory['alignmentThresholds']:
+      alignedIndices = np.nonzero(errors <= threshold)[0]
+      thresholdResults.append({
+        'threshold': float(threshold),
+        'success': len(alignedIndices) > 0,
+        'timeToSuccess': float(times[alignedIndices[0]] - times[0]) if len(alignedIndices) else None,
+        })
+    result['FemurAlignment'] = {'minimumError': float(errors.min()), 'finalError': float(errors[-1]), 'thresholds': thresholdResults}
+  return result
@@ -0,0 +1,29 @@
+import os
+
+# Batch evaluation workers (see BatchEvaluation) run in PythonSlicer, without the Slicer
+# application: they import the NumPy/VTK submodules they use directly, the modules that need
+# the application are only imported in the Slicer process.
+if os.environ.get('VRTUTORIAL_BATCH_WORKER') != '1':
+  from .Profiling import CallProfiler, CallStatistics, callProfiler, profiled
+  from .MeshCollision import BoundingSphere, MeshCollisionPair
+  from .TransformDispatcher import TransformEventDispatcher
+  from .TrackingRecording import SAMPLE_DTYPE, TrackingRecorder, TrackingReplayer, readTrackingFile, writeTrackingFile
+  from .Benchmark import CollisionBenchmark, makePassThroughSweep, makePoseSweep, makeSphereModel
+  from .CollisionProxies import CollisionProxyCache
+  from .AssetCache import AssetCache
+  from .AssetLoader import AssetLoader, readModelFile
+  from .SharedGeometry import SharedGeometryInstancer, fitInstanceMatrix
+  from .DistanceField import DistanceFieldCache, SignedDistanceField, TargetDistanceField
+  from .AlignmentScoring import AlignmentEvaluator, sampleSurfacePoints
+  from .TaskStateMachine import TaskStateMachine
+  from .BatchEvaluation import BatchEvaluator, makeSimulatedTrainee
+  from .SessionTelemetry import EVENT_DTYPE, ChunkedRingBuffer, SessionTelemetryRecorder, readSessionTelemetry
+  from .TrajectoryAnalytics import SessionAnalyzer, findRuns, getSmoothness, writeSessionSummaryTable
+  from .SlideStack import InstructionSlideStack, getSlideFilePaths
+  from .TextureCache import TextureCache, TexturePyramid
+  from .ScenarioTiles import ScenarioTileCache, ScenarioTileStreamer, splitIntoTiles
+  from .SceneBVH import SceneBVH
+  from .HandInteraction import HandTouchDetector, fitProbeSpheres
+  from .ContinuousCollision import SweptCollisionDetector, interpolatePoses
+  from .AnalyticTargets import AnalyticBox, AnalyticCollisionPair, AnalyticCylinder, AnalyticTargetCache, fitAnalyticShape
+  from .TaskPredicates import TargetContactPredicate